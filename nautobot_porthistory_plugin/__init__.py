@@ -1,8 +1,9 @@
 """nautobot_porthistory_plugin Plugin Initilization."""
 
 from nautobot.extras.plugins import PluginConfig
+from django.db.models.signals import post_save, post_delete
 from nautobot.core.signals import nautobot_database_ready
-from .signals import create_custom_fields_for_porthistory
+from .signals import create_custom_fields_for_porthistory, invalidate_cable_index
 
 class NautobotPorthistoryPluginConfig(PluginConfig):
     """Plugin configuration for the nautobot_porthistory_plugin plugin."""
@@ -14,12 +15,21 @@ class NautobotPorthistoryPluginConfig(PluginConfig):
     version = '1.1.0'
     author = 'Max Iontzev'
     author_email = 'iontzev@gmail.com'
-    min_version = "1.0.0"  # Minimum version of Nautobot with which the plugin is compatible.
+    min_version = "1.3.0"  # Minimum version of Nautobot with which the plugin is compatible.
     max_version = "1.999"  # Maximum version of Nautobot with which the plugin is compatible.
     default_settings = {
         'min_idle_days': 14,
         'snmp_community': 'public',
         'workers': 50,
+        'processes': 1,
+        'qbridge_platforms': [],
+        'history_gap_hours': 24,
+        'history_retention_days': 365,
+        'shard_max_devices': None,
+        'trap_address': '0.0.0.0',
+        'trap_port': 162,
+        'trap_communities': [],
+        'trap_batch_seconds': 5,
     }
     required_settings = ['switches_role_slug', 'routers_role_slug']
     caching_config = {}
@@ -27,6 +37,8 @@ class NautobotPorthistoryPluginConfig(PluginConfig):
     def ready(self):
         super().ready()
         nautobot_database_ready.connect(create_custom_fields_for_porthistory, sender=self)
+        post_save.connect(invalidate_cable_index, sender='dcim.Cable')
+        post_delete.connect(invalidate_cable_index, sender='dcim.Cable')
 
 
 config = NautobotPorthistoryPluginConfig
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""Per-agent SNMP parameters learned from previous runs and a circuit breaker for dead agents."""
+
+import time
+
+from django.core.cache import cache
+
+from nautobot_porthistory_plugin.collector import DEFAULT_PARAMS, MIN_REPETITIONS
+
+CACHE_KEY = 'nautobot_porthistory_plugin:agent:{host}'
+CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+MIN_TIMEOUT = 1
+MAX_TIMEOUT = DEFAULT_PARAMS['timeout']
+MAX_REPETITIONS = 50
+# время ответа на PDU, умноженное на этот множитель, - таймаут агента
+TIMEOUT_FACTOR = 4
+RTT_WEIGHT = 0.3
+DOWN_FIRST = 15 * 60
+DOWN_MAX = 24 * 60 * 60
+
+
+class AgentProfiles:
+    """Profiles of SNMP agents of a run, loaded from and saved to the Django cache.
+
+    A profile keeps a moving average of the response time, the max-repetitions the agent
+    handled last time and the number of consecutive failed runs. An agent that failed is
+    skipped for ``DOWN_FIRST`` seconds, twice as long after every next failure, up to
+    ``DOWN_MAX``; a run that answers closes the breaker again.
+    """
+
+    def __init__(self, hosts):
+        self.keys = {host: CACHE_KEY.format(host=host) for host in hosts}
+        self.profiles = cache.get_many(list(self.keys.values()))
+        self.changed = {}
+
+    def get(self, host):
+        return self.profiles.get(self.keys[host]) or {}
+
+    def is_down(self, host):
+        return self.get(host).get('down_until', 0) > time.time()
+
+    def params(self, host):
+        profile = self.get(host)
+        if not profile:
+            return dict(DEFAULT_PARAMS)
+        timeout = MAX_TIMEOUT
+        if profile.get('rtt'):
+            timeout = min(MAX_TIMEOUT, max(MIN_TIMEOUT, round(profile['rtt'] * TIMEOUT_FACTOR, 1)))
+        return {
+            'timeout': timeout,
+            'retries': 1 if profile.get('failures') else DEFAULT_PARAMS['retries'],
+            'max_repetitions': profile.get('max_repetitions', DEFAULT_PARAMS['max_repetitions']),
+        }
+
+    def record(self, host, stats):
+        """Update the profile of an agent with the statistics of this run (``Agent.stats()``)."""
+        profile = dict(self.get(host))
+        max_repetitions = stats['max_repetitions']
+        if stats['failed']:
+            failures = profile.get('failures', 0) + 1
+            profile['failures'] = failures
+            profile['down_until'] = time.time() + min(DOWN_MAX, DOWN_FIRST * 2 ** (failures - 1))
+        else:
+            profile['failures'] = 0
+            profile['down_until'] = 0
+            if stats['pdus']:
+                rtt = stats['rtt'] / stats['pdus']
+                if profile.get('rtt'):
+                    rtt = RTT_WEIGHT * rtt + (1 - RTT_WEIGHT) * profile['rtt']
+                profile['rtt'] = rtt
+            if stats['timeouts']:
+                max_repetitions = max(MIN_REPETITIONS, max_repetitions // 2)
+            else:
+                max_repetitions = min(MAX_REPETITIONS, max_repetitions * 2)
+        profile['max_repetitions'] = max_repetitions
+        key = self.keys[host]
+        self.profiles[key] = self.changed[key] = profile
+
+    def save(self):
+        if self.changed:
+            cache.set_many(self.changed, CACHE_TIMEOUT)
+            self.changed = {}
@@ -0,0 +1 @@
+"""REST API for nautobot_porthistory_plugin."""
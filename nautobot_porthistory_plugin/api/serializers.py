@@ -0,0 +1,48 @@
+"""Serializers for the nautobot_porthistory_plugin REST API."""
+
+from ipaddress import ip_interface
+
+from rest_framework import serializers
+
+from nautobot_porthistory_plugin.macs import parse_mac
+
+MAX_LOOKUP_ITEMS = 10000
+
+
+class LookupSerializer(serializers.Serializer):
+    """MACs (any notation), IP addresses (with or without a prefix length) and DNS names to look up."""
+
+    macs = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+    ips = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+    hostnames = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+
+    def validate_macs(self, value):
+        keys = {}
+        for mac in value:
+            try:
+                key = parse_mac(mac)
+            except ValueError:
+                raise serializers.ValidationError(f'Invalid MAC address: {mac}')
+            keys[f'{key:012X}'] = mac
+        return keys
+
+    def validate_ips(self, value):
+        hosts = {}
+        for address in value:
+            try:
+                hosts[str(ip_interface(address.strip()).ip)] = address
+            except ValueError:
+                raise serializers.ValidationError(f'Invalid IP address: {address}')
+        return hosts
+
+    def validate_hostnames(self, value):
+        # DNS имена не зависят от регистра: ищем и сопоставляем их в нижнем регистре
+        return {hostname.strip().rstrip('.').lower(): hostname for hostname in value}
+
+    def validate(self, data):
+        items = len(data['macs']) + len(data['ips']) + len(data['hostnames'])
+        if not items:
+            raise serializers.ValidationError('Nothing to look up: pass "macs", "ips" or "hostnames".')
+        if items > MAX_LOOKUP_ITEMS:
+            raise serializers.ValidationError(f'At most {MAX_LOOKUP_ITEMS} items can be looked up at once.')
+        return data
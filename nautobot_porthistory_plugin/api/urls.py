@@ -0,0 +1,9 @@
+"""REST API urls for nautobot_porthistory_plugin."""
+
+from django.urls import path
+
+from nautobot_porthistory_plugin.api import views
+
+urlpatterns = [
+    path('lookup/', views.LookupView.as_view(), name='lookup'),
+]
@@ -0,0 +1,118 @@
+"""Views for the nautobot_porthistory_plugin REST API."""
+
+import json
+
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Lower
+from django.http import StreamingHttpResponse
+from nautobot.ipam.models import IPAddress
+from rest_framework.permissions import BasePermission
+from rest_framework.views import APIView
+
+from nautobot_porthistory_plugin.api.serializers import LookupSerializer
+from nautobot_porthistory_plugin.models import MAConPorts
+from nautobot_porthistory_plugin.writers import BATCH_SIZE
+
+# (ключ в запросе, тип совпадения, условие поиска по MAConPorts)
+LOOKUPS = (
+    ('macs', 'mac', 'mac_key__in'),
+    ('ips', 'ip', 'ipaddress__host__in'),
+    ('hostnames', 'hostname', 'dns_name_lower__in'),
+)
+
+FIELDS = (
+    'id',
+    'mac',
+    'mac_key',
+    'vlan_id',
+    'vlan__vid',
+    'vlan__name',
+    'device_id',
+    'device__name',
+    'interface_id',
+    'interface__name',
+    'ipaddress_id',
+    'ipaddress__host',
+    'ipaddress__prefix_length',
+    'ipaddress__dns_name',
+    'updated',
+    'ipaddress_visible',
+)
+
+
+class CanViewMAConPorts(BasePermission):
+
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.has_perm('nautobot_porthistory_plugin.view_maconports')
+
+
+class LookupView(APIView):
+    """Look up MACs on switch ports by MACs, IP addresses and DNS names in one request.
+
+    The body is ``{"macs": [...], "ips": [...], "hostnames": [...]}``. Every kind of item is
+    resolved with ``IN`` queries of at most BATCH_SIZE values, and the matching MAConPorts
+    rows are streamed back as JSON lines (``application/x-ndjson``) while they are read.
+    Every line carries the kind of match and the item of the request that matched.
+
+    IP addresses the user may not view are neither searched by nor shown in the rows.
+    DNS names are matched case-insensitively.
+    """
+
+    permission_classes = [CanViewMAConPorts]
+
+    def post(self, request):
+        serializer = LookupSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ipaddresses = IPAddress.objects.restrict(request.user, 'view')
+        queryset = MAConPorts.objects.restrict(request.user, 'view').annotate(
+            dns_name_lower=Lower('ipaddress__dns_name'),
+            ipaddress_visible=Exists(ipaddresses.filter(pk=OuterRef('ipaddress_id'))),
+        )
+        return StreamingHttpResponse(
+            self.stream(queryset, serializer.validated_data),
+            content_type='application/x-ndjson',
+        )
+
+    def stream(self, queryset, data):
+        seen = set()
+        for kind, match, lookup in LOOKUPS:
+            items = data[kind]
+            values = list(items)
+            for i in range(0, len(values), BATCH_SIZE):
+                rows = queryset.filter(**{lookup: values[i:i + BATCH_SIZE]})
+                if match != 'mac':
+                    rows = rows.filter(ipaddress_visible=True)
+                rows = rows.values_list(*FIELDS)
+                for row in rows.iterator(chunk_size=BATCH_SIZE):
+                    row = dict(zip(FIELDS, row))
+                    if row['id'] in seen:
+                        continue
+                    seen.add(row['id'])
+                    yield json.dumps(self.format_row(row, match, items)) + '\n'
+
+    def format_row(self, row, match, items):
+        if match == 'mac':
+            key = row['mac_key']
+        elif match == 'ip':
+            key = str(row['ipaddress__host'])
+        else:
+            key = row['ipaddress__dns_name'].lower()
+        query = items.get(key, key)
+        ipaddress = None
+        if row['ipaddress_id'] and row['ipaddress_visible']:
+            ipaddress = {
+                'id': str(row['ipaddress_id']),
+                'address': f"{row['ipaddress__host']}/{row['ipaddress__prefix_length']}",
+                'dns_name': row['ipaddress__dns_name'],
+            }
+        return {
+            'match': match,
+            'query': query,
+            'id': str(row['id']),
+            'mac': str(row['mac']),
+            'vlan': {'id': str(row['vlan_id']), 'vid': row['vlan__vid'], 'name': row['vlan__name']},
+            'device': {'id': str(row['device_id']), 'name': row['device__name']},
+            'interface': {'id': str(row['interface_id']), 'name': row['interface__name']},
+            'ipaddress': ipaddress,
+            'updated': row['updated'].isoformat(),
+        }
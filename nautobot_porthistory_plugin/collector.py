@@ -0,0 +1,686 @@
+"""SNMP collection pipeline for nautobot_porthistory_plugin jobs."""
+
+import asyncio
+import pickle
+import queue
+import threading
+import time
+from array import array
+
+import aiosnmp
+from aiosnmp.exceptions import SnmpErrorTooBig
+
+try:
+    # a worker of Celery's prefork pool is a daemonic process: only billiard lets it start processes
+    import billiard as multiprocessing
+except ImportError:
+    import multiprocessing
+
+from nautobot_porthistory_plugin.macs import mac_from_bytes, mac_from_oid
+from nautobot_porthistory_plugin.transport import Transport
+
+OID_SYS_UPTIME = '.1.3.6.1.2.1.1.3.0'
+OID_IF_TABLE_LAST_CHANGE = '.1.3.6.1.2.1.31.1.5.0'
+OID_SNMP_ENGINE_TIME = '.1.3.6.1.6.3.10.2.1.3'
+OID_IF_NAME = '.1.3.6.1.2.1.31.1.1.1.1'
+OID_LOC_IF_LAST_OUTPUT = '.1.3.6.1.4.1.9.2.2.1.1.4'
+OID_DOT1D_BASE_PORT_IFINDEX = '.1.3.6.1.2.1.17.1.4.1.2'
+OID_DOT1D_TP_FDB_PORT = '.1.3.6.1.2.1.17.4.3.1.2'
+OID_AT_PHYS_ADDRESS = '.1.3.6.1.2.1.3.1.1.2'
+OID_DOT1Q_VLAN_FDB_ID = '.1.3.6.1.2.1.17.7.1.4.2.1.3'
+OID_DOT1Q_TP_FDB_PORT = '.1.3.6.1.2.1.17.7.1.2.2.1.2'
+
+# phases of a run the SNMP requests of every table are accounted to
+SNMP_PHASES = {
+    OID_SYS_UPTIME: 'ifname',
+    OID_IF_TABLE_LAST_CHANGE: 'ifname',
+    OID_IF_NAME: 'ifname',
+    OID_SNMP_ENGINE_TIME: 'uptime',
+    OID_LOC_IF_LAST_OUTPUT: 'last_output',
+    OID_DOT1D_BASE_PORT_IFINDEX: 'bridge_ports',
+    OID_DOT1Q_VLAN_FDB_ID: 'bridge_ports',
+    OID_DOT1D_TP_FDB_PORT: 'fdb',
+    OID_DOT1Q_TP_FDB_PORT: 'fdb',
+    OID_AT_PHYS_ADDRESS: 'arp',
+}
+
+# boot time computed from sysUpTime drifts with the poll time
+BOOTTIME_TOLERANCE = 60
+
+SNMP_PORT = 161
+DEFAULT_PARAMS = {'timeout': 5, 'retries': 3, 'max_repetitions': 10}
+MIN_REPETITIONS = 5
+
+# results waiting for the job thread; when the queue is full, collection waits for the job
+QUEUE_SIZE = 100
+# parsed rows of a long walk are handed to the job in chunks of this size
+CHUNK_ROWS = 500
+# a collector process sends its results to the job in pickled batches of this many items,
+# or of what it has collected in FLUSH_INTERVAL seconds
+BATCH_ITEMS = 20
+FLUSH_INTERVAL = 0.2
+
+_DONE = object()
+
+
+class Pipeline:
+    """Run a collection coroutine on a background event loop.
+
+    The coroutine receives an ``emit`` coroutine function as its first argument. Everything
+    passed to ``emit`` is handed to the thread iterating over the pipeline as soon as it is
+    ready, so the job can process (and write to the database) one device while the others
+    are still being polled. The ORM is only ever touched from the iterating thread.
+
+    At most ``maxsize`` results wait in the queue: ``emit`` of a producer blocks (without
+    blocking the event loop) until the job catches up, so memory held by results does not
+    grow with the number of devices.
+
+    When the iteration is abandoned, the coroutine is cancelled and the queue is drained
+    until the background thread exits, so its sockets and event loop are closed.
+    """
+
+    def __init__(self, main, *args, maxsize=QUEUE_SIZE):
+        self.main = main
+        self.args = args
+        self.results = queue.Queue(maxsize)
+        self.error = None
+        self.stopped = threading.Event()
+        self.loop = None
+        self.task = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if not self.thread.is_alive() and self.thread.ident is None:
+            self.thread.start()
+        return self
+
+    async def emit(self, result):
+        if self.stopped.is_set():
+            raise asyncio.CancelledError()
+        try:
+            self.results.put_nowait(result)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, self.results.put, result)
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        if self.stopped.is_set():
+            return
+        await self.main(self.emit, *self.args)
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except asyncio.CancelledError:
+            pass
+        except BaseException as error:
+            self.error = error
+        finally:
+            self.results.put(_DONE)
+
+    def stop(self):
+        """Cancel the coroutine and wait for the background thread to exit."""
+        self.stopped.set()
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.task.cancel)
+            except RuntimeError:
+                # the loop is already closed
+                pass
+        if self.thread.ident is not None:
+            # a producer blocked on the full queue has to get its result in to see the cancellation
+            while self.results.get() is not _DONE:
+                pass
+            self.thread.join()
+
+    def __iter__(self):
+        self.start()
+        finished = False
+        try:
+            while True:
+                result = self.results.get()
+                if result is _DONE:
+                    finished = True
+                    break
+                yield result
+        finally:
+            if not finished:
+                self.stop()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def split_evenly(items, parts):
+    """Split ``items`` into ``parts`` lists, round-robin."""
+    return [items[i::parts] for i in range(parts)]
+
+
+def split_workers(workers, parts):
+    """Share the ``workers`` concurrency budget between ``parts`` collectors, at least one each."""
+    return [max(1, workers // parts + (i < workers % parts)) for i in range(parts)]
+
+
+def process_count(processes, *items):
+    """Number of collector processes worth starting for ``items`` (lists of devices): no idle ones."""
+    return max(1, min(processes, sum(len(devices) for devices in items)))
+
+
+def _portable(item):
+    """``item`` with exceptions that do not survive pickling replaced by ones that do."""
+    if isinstance(item, tuple):
+        return tuple(_portable(value) for value in item)
+    if isinstance(item, BaseException):
+        try:
+            pickle.loads(pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            if isinstance(item, (TimeoutError, asyncio.TimeoutError)):
+                return asyncio.TimeoutError(str(item))
+            return RuntimeError(f'{type(item).__name__}: {item}')
+    return item
+
+
+class _ProcessEmitter:
+    """``emit`` of a collector process: batches results and sends them pickled to the job process."""
+
+    def __init__(self, index, results):
+        self.index = index
+        self.results = results
+        self.batch = []
+
+    async def emit(self, result):
+        self.batch.append(result)
+        if len(self.batch) >= BATCH_ITEMS:
+            await self.flush()
+
+    async def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        payload = pickle.dumps([_portable(result) for result in batch], pickle.HIGHEST_PROTOCOL)
+        message = ('batch', self.index, payload)
+        try:
+            self.results.put_nowait(message)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, self.results.put, message)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    async def run(self, main, args):
+        flusher = asyncio.ensure_future(self.flush_periodically())
+        try:
+            await main(self.emit, *args)
+        finally:
+            flusher.cancel()
+            await self.flush()
+
+
+def _run_process(main, args, index, results):
+    error = None
+    try:
+        asyncio.run(_ProcessEmitter(index, results).run(main, args))
+    except BaseException as exc:
+        error = _portable(exc)
+    results.put(('done', index, pickle.dumps(error, pickle.HIGHEST_PROTOCOL)))
+    results.close()
+    results.join_thread()
+
+
+class ProcessPipeline:
+    """Run a collection coroutine in several worker processes, each with its own event loop.
+
+    ``shards`` is a list of argument tuples of ``main``, one per process; every process
+    collects its own part of the devices with its own share of the concurrency budget.
+    Results are iterated in the job process as with ``Pipeline``; they arrive as pickled
+    batches (the collected rows are typed arrays), so parsing and building of the results
+    scale with the number of cores while the ORM is still only touched by the job.
+
+    Processes are forked: the arguments are inherited, not serialized, and a process never
+    touches the database connections of the job. They are started with billiard, Celery's fork
+    of multiprocessing, when it is installed, so the pipeline runs inside the prefork pool.
+    """
+
+    def __init__(self, main, shards, maxsize=QUEUE_SIZE):
+        context = multiprocessing.get_context('fork')
+        # the queue holds batches of results, not single results
+        self.results = context.Queue(max(len(shards), maxsize // BATCH_ITEMS))
+        self.processes = [
+            context.Process(target=_run_process, args=(main, args, index, self.results), daemon=True)
+            for index, args in enumerate(shards)
+        ]
+        self.started = False
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            for process in self.processes:
+                process.start()
+        return self
+
+    def _get(self, running):
+        while True:
+            try:
+                return self.results.get(timeout=1)
+            except queue.Empty:
+                dead = [index for index in running if not self.processes[index].is_alive()]
+                if dead:
+                    # the last message of a process that has just exited may still be in the pipe
+                    try:
+                        return self.results.get(timeout=1)
+                    except queue.Empty:
+                        process = self.processes[dead[0]]
+                        raise RuntimeError(f'collector process {dead[0]} exited with code {process.exitcode}')
+
+    def __iter__(self):
+        self.start()
+        running = set(range(len(self.processes)))
+        error = None
+        try:
+            while running:
+                kind, index, payload = self._get(running)
+                if kind == 'done':
+                    running.discard(index)
+                    error = error or pickle.loads(payload)
+                    continue
+                yield from pickle.loads(payload)
+        finally:
+            # iteration was abandoned: the remaining processes are no longer needed
+            for process in self.processes:
+                if running and process.is_alive():
+                    process.terminate()
+                process.join()
+        if error is not None:
+            raise error
+
+
+def start_pipeline(main, shards, maxsize=QUEUE_SIZE):
+    """``Pipeline`` of the only shard in the job process, or a ``ProcessPipeline`` of several."""
+    if len(shards) == 1:
+        return Pipeline(main, *shards[0], maxsize=maxsize).start()
+    return ProcessPipeline(main, shards, maxsize=maxsize).start()
+
+
+async def gather_devices(emit, collect, devices, workers, *args):
+    """Run ``collect(device, *args, transport=transport)`` for every device, at most ``workers`` at a time.
+
+    All devices share one ``Transport``.
+    """
+    semaphore = asyncio.Semaphore(workers)
+
+    async with Transport() as transport:
+        async def worker(device):
+            async with semaphore:
+                await emit(await collect(device, *args, transport=transport))
+
+        await asyncio.gather(*(worker(device) for device in devices))
+
+
+class WalkError(Exception):
+    """An agent answered a walk with OIDs that do not increase."""
+
+
+def oid_key(oid):
+    """OID as a tuple of integers, ordered like the agent orders them."""
+    return tuple(int(subid) for subid in oid.strip('.').split('.'))
+
+
+class Agent:
+    """SNMP parameters and statistics of one agent during a run.
+
+    All sessions to the agent share it, so the statistics cover every walk made to the
+    device. Sessions go through ``transport`` when it is given, through sockets of their
+    own otherwise. ``stats()`` is returned to the job, which keeps the history between runs
+    and chooses the parameters for the next one.
+    """
+
+    __slots__ = (
+        'host', 'timeout', 'retries', 'max_repetitions', 'pdus', 'varbinds', 'timeouts', 'rtt', 'failed', 'phases',
+        'transport',
+    )
+
+    def __init__(self, host, params=None, transport=None):
+        params = params or DEFAULT_PARAMS
+        self.host = host
+        self.timeout = params['timeout']
+        self.retries = params['retries']
+        self.max_repetitions = params['max_repetitions']
+        self.pdus = self.varbinds = self.timeouts = 0
+        self.rtt = 0.0
+        self.failed = False
+        # phase -> [seconds, PDUs, varbinds]
+        self.phases = {}
+        self.transport = transport
+
+    def session(self, community):
+        if self.transport is not None:
+            return self.transport.session(
+                self.host, SNMP_PORT, community, self.timeout, self.retries, self.max_repetitions,
+            )
+        return aiosnmp.Snmp(
+            host=self.host,
+            port=SNMP_PORT,
+            community=community,
+            timeout=self.timeout,
+            retries=self.retries,
+            max_repetitions=self.max_repetitions,
+        )
+
+    def error(self, error):
+        """Account a failed request: timeouts are counted, marking the agent failed is up to the caller."""
+        # aiosnmp raises its SnmpTimeoutError, a builtin TimeoutError, not asyncio.TimeoutError before 3.11
+        if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+            self.timeouts += 1
+
+    async def request(self, phase, method, *args, **kwargs):
+        started = time.monotonic()
+        varbinds = await method(*args, **kwargs)
+        rtt = time.monotonic() - started
+        self.rtt += rtt
+        self.pdus += 1
+        self.varbinds += len(varbinds)
+        totals = self.phases.get(phase)
+        if totals is None:
+            totals = self.phases[phase] = [0.0, 0, 0]
+        totals[0] += rtt
+        totals[1] += 1
+        totals[2] += len(varbinds)
+        return varbinds
+
+    async def get(self, snmp, oids):
+        return await self.request(SNMP_PHASES.get(oids[0], 'other'), snmp.get, oids)
+
+    async def walk_chunks(self, snmp, oid):
+        """Walk a subtree with GETBULK, yielding the ``(oid, value)`` pairs of every response.
+
+        max-repetitions is halved when the agent answers tooBig. A response that does not
+        advance past the OID it was requested for (an agent that repeats rows or goes back)
+        fails the walk with ``WalkError``, so the incomplete table is never taken for a whole one.
+        """
+        base_oid = oid if oid.startswith('.') else f'.{oid}'
+        prefix = f'{base_oid}.'
+        phase = SNMP_PHASES.get(base_oid, 'other')
+        next_oid = base_oid
+        while True:
+            try:
+                varbinds = await self.request(phase, snmp.get_bulk, next_oid, max_repetitions=self.max_repetitions)
+            except SnmpErrorTooBig:
+                if self.max_repetitions <= MIN_REPETITIONS:
+                    raise
+                self.max_repetitions = max(MIN_REPETITIONS, self.max_repetitions // 2)
+                continue
+            chunk = []
+            for varbind in varbinds:
+                if varbind.value is None or not varbind.oid.startswith(prefix):
+                    break
+                chunk.append((varbind.oid, varbind.value))
+            if chunk and oid_key(chunk[-1][0]) <= oid_key(next_oid):
+                raise WalkError(f'{self.host}: {chunk[-1][0]} does not follow {next_oid}')
+            if chunk:
+                yield chunk
+            if not varbinds or len(chunk) < len(varbinds):
+                return
+            next_oid = chunk[-1][0]
+
+    async def walk(self, snmp, oid):
+        result = {}
+        async for chunk in self.walk_chunks(snmp, oid):
+            result.update(chunk)
+        return result
+
+    def stats(self):
+        return {
+            'pdus': self.pdus,
+            'varbinds': self.varbinds,
+            'timeouts': self.timeouts,
+            'rtt': self.rtt,
+            'max_repetitions': self.max_repetitions,
+            'failed': self.failed,
+            'phases': {
+                phase: {'seconds': seconds, 'pdus': pdus, 'varbinds': varbinds}
+                for phase, (seconds, pdus, varbinds) in self.phases.items()
+            },
+        }
+
+
+async def walk_ifnames(agent, snmp, stamp):
+    """Walk ifName unless the agent still matches ``stamp`` of a cached ifIndex mapping.
+
+    Returns ``(stamp, ifnames)``: the ``(boottime, ifTableLastChange)`` stamp of the agent and
+    the ifName walk, or ``None`` instead of the walk when the cached mapping is still valid.
+    """
+    try:
+        uptime, last_change = [
+            varbind.value for varbind in await agent.get(snmp, [OID_SYS_UPTIME, OID_IF_TABLE_LAST_CHANGE])
+        ]
+    except (TimeoutError, asyncio.TimeoutError):
+        raise
+    except Exception:
+        uptime = last_change = None
+    if not isinstance(uptime, int) or not isinstance(last_change, int):
+        return (None, await agent.walk(snmp, OID_IF_NAME))
+    current = (time.time() - uptime / 100, last_change)
+    if stamp is not None and abs(stamp[0] - current[0]) < BOOTTIME_TOLERANCE and stamp[1] == current[1]:
+        return (stamp, None)
+    return (current, await agent.walk(snmp, OID_IF_NAME))
+
+
+async def collect_unused_ports(device, community, stamps, params, transport=None):
+    """Collect uptime, interface names and last output of a switch over one SNMP session.
+
+    ``stamps`` maps devices to stamps of their cached ifIndex mappings (see ``walk_ifnames``);
+    the ``OID_IF_NAME`` item of the result is the ``(stamp, ifnames)`` pair. ``params`` maps
+    devices to their SNMP parameters. Returns ``(device, results or error, agent stats)``.
+    """
+    agent = Agent(device, params.get(device), transport)
+    try:
+        async with agent.session(community) as snmp:
+            results = {}
+            results[OID_SNMP_ENGINE_TIME] = await agent.walk(snmp, OID_SNMP_ENGINE_TIME)
+            results[OID_IF_NAME] = await walk_ifnames(agent, snmp, stamps.get(device))
+            results[OID_LOC_IF_LAST_OUTPUT] = await agent.walk(snmp, OID_LOC_IF_LAST_OUTPUT)
+            return (device, results, agent.stats())
+    except Exception as error:
+        agent.error(error)
+        agent.failed = True
+        return (device, error, agent.stats())
+
+
+class FdbRows:
+    """Rows of dot1dTpFdbPort (``<MAC in decimal> = bridge port``) as ``(MAC, bridge port)`` integers."""
+
+    __slots__ = ('macs', 'ports')
+
+    def __init__(self):
+        self.macs = array('Q')
+        self.ports = array('L')
+
+    def add(self, oid, bridge_port):
+        self.macs.append(mac_from_oid(oid))
+        self.ports.append(bridge_port)
+
+    def __len__(self):
+        return len(self.macs)
+
+    def __iter__(self):
+        return zip(self.macs, self.ports)
+
+
+class QFdbRows:
+    """Rows of dot1qTpFdbPort (``<FDB id>.<MAC in decimal> = bridge port``) as ``(FDB id, MAC, bridge port)``."""
+
+    __slots__ = ('fdb_ids', 'macs', 'ports')
+
+    def __init__(self):
+        self.fdb_ids = array('L')
+        self.macs = array('Q')
+        self.ports = array('L')
+
+    def add(self, oid, bridge_port):
+        self.fdb_ids.append(int(oid.rsplit('.', 7)[1]))
+        self.macs.append(mac_from_oid(oid))
+        self.ports.append(bridge_port)
+
+    def __len__(self):
+        return len(self.macs)
+
+    def __iter__(self):
+        return zip(self.fdb_ids, self.macs, self.ports)
+
+
+class ArpRows:
+    """Rows of atPhysAddress (``<ifIndex>.1.<IP> = MAC``) as ``(IP, MAC)`` integers."""
+
+    __slots__ = ('addresses', 'macs')
+
+    def __init__(self):
+        self.addresses = array('L')
+        self.macs = array('Q')
+
+    def add(self, oid, mac):
+        _, o1, o2, o3, o4 = oid.rsplit('.', 4)
+        self.addresses.append(int(o1) << 24 | int(o2) << 16 | int(o3) << 8 | int(o4))
+        self.macs.append(mac_from_bytes(mac))
+
+    def __len__(self):
+        return len(self.macs)
+
+    def __iter__(self):
+        return zip(self.addresses, self.macs)
+
+
+async def emit_rows(emit, agent, snmp, oid, rows_class, item):
+    """Walk ``oid`` and emit its rows collected into ``rows_class`` in chunks, as ``item(rows)``.
+
+    Only one chunk of a walk is held in memory, never the whole walk.
+    """
+    rows = rows_class()
+    async for chunk in agent.walk_chunks(snmp, oid):
+        add = rows.add
+        for index, value in chunk:
+            add(index, value)
+        if len(rows) >= CHUNK_ROWS:
+            await emit(item(rows))
+            rows = rows_class()
+    if rows:
+        await emit(item(rows))
+
+
+async def collect_switch_fdb(emit, semaphore, agent, community, vlans, stamp):
+    """Collect interface names of a switch, then bridge ports and FDB of every VLAN.
+
+    Every ``community@vlan`` context is walked in its own task as soon as a worker slot
+    is free. Bridge ports of a VLAN are emitted as ``('bridge', device, (vlan, bridge_ports))``,
+    then its FDB follows in ``FdbRows`` chunks as ``('fdb', device, (vlan, rows))``.
+    A failed walk is emitted as ``('fdb', device, (vlan, error))``; a context that does not
+    answer at all is a VLAN missing on the switch, not a failure of the agent.
+    """
+    device = agent.host
+    async with semaphore:
+        try:
+            async with agent.session(community) as snmp:
+                ifnames = await walk_ifnames(agent, snmp, stamp)
+        except Exception as error:
+            agent.error(error)
+            agent.failed = True
+            await emit(('ifnames', device, error))
+            return
+        await emit(('ifnames', device, ifnames))
+
+    async def collect_vlan(vlan):
+        async with semaphore:
+            bridge_ports = None
+            try:
+                async with agent.session(f'{community}@{vlan}') as snmp:
+                    bridge_ports = await agent.walk(snmp, OID_DOT1D_BASE_PORT_IFINDEX)
+                    await emit(('bridge', device, (vlan, bridge_ports)))
+                    await emit_rows(
+                        emit, agent, snmp, OID_DOT1D_TP_FDB_PORT, FdbRows,
+                        lambda rows: ('fdb', device, (vlan, rows)),
+                    )
+            except Exception as error:
+                if bridge_ports is not None:
+                    agent.error(error)
+                await emit(('fdb', device, (vlan, error)))
+
+    await asyncio.gather(*(collect_vlan(vlan) for vlan in vlans))
+
+
+async def collect_switch_qbridge(emit, semaphore, agent, community, stamp):
+    """Collect interface names, bridge ports and the FDB of all VLANs of a switch with Q-BRIDGE-MIB.
+
+    dot1qTpFdbPort returns MACs of every VLAN at once, indexed by FDB id; dot1qVlanFdbId
+    maps FDB ids to VLANs on switches where they differ. All walks share one session.
+    Bridge ports and FDB ids are emitted as ``('qbridge', device, (bridge_ports, fdb_ids))``,
+    then the FDB in ``QFdbRows`` chunks as ``('qfdb', device, rows)``.
+    """
+    device = agent.host
+    ifnames = None
+    async with semaphore:
+        try:
+            async with agent.session(community) as snmp:
+                ifnames = await walk_ifnames(agent, snmp, stamp)
+                await emit(('ifnames', device, ifnames))
+                bridge_ports = await agent.walk(snmp, OID_DOT1D_BASE_PORT_IFINDEX)
+                fdb_ids = await agent.walk(snmp, OID_DOT1Q_VLAN_FDB_ID)
+                await emit(('qbridge', device, (bridge_ports, fdb_ids)))
+                await emit_rows(
+                    emit, agent, snmp, OID_DOT1Q_TP_FDB_PORT, QFdbRows,
+                    lambda rows: ('qfdb', device, rows),
+                )
+        except Exception as error:
+            agent.error(error)
+            agent.failed = ifnames is None
+            await emit(('ifnames' if ifnames is None else 'qfdb', device, error))
+
+
+async def collect_router_arp(emit, semaphore, agent, community):
+    """Collect the ARP table of a router in ``ArpRows`` chunks as ``('arp', device, rows)``."""
+    device = agent.host
+    async with semaphore:
+        try:
+            async with agent.session(community) as snmp:
+                await emit_rows(
+                    emit, agent, snmp, OID_AT_PHYS_ADDRESS, ArpRows,
+                    lambda rows: ('arp', device, rows),
+                )
+        except Exception as error:
+            agent.error(error)
+            agent.failed = True
+            await emit(('arp', device, error))
+
+
+async def gather_mac_on_ports(emit, switches, routers, community, workers):
+    """Walk FDB of all switches and ARP of all routers under one ``workers`` budget.
+
+    ``switches`` is a list of ``(device, vlans, qbridge, stamp, params)`` tuples, ``routers``
+    is a list of ``(device, params)`` pairs. Switches with ``qbridge`` set are walked once with
+    Q-BRIDGE-MIB instead of once per VLAN; ``stamp`` belongs to the cached ifIndex mapping of
+    the switch (see ``walk_ifnames``), ``params`` are SNMP parameters of the agent.
+    There is no synchronisation point between devices or VLANs. After all walks of a device
+    its agent statistics are emitted as a ``('stats', device, stats)`` item. All walks of all
+    devices share one ``Transport``.
+    """
+    semaphore = asyncio.Semaphore(workers)
+
+    async with Transport() as transport:
+        async def collect_switch(device, vlans, qbridge, stamp, params):
+            agent = Agent(device, params, transport)
+            if qbridge:
+                await collect_switch_qbridge(emit, semaphore, agent, community, stamp)
+            else:
+                await collect_switch_fdb(emit, semaphore, agent, community, vlans, stamp)
+            await emit(('stats', device, agent.stats()))
+
+        async def collect_router(device, params):
+            agent = Agent(device, params, transport)
+            await collect_router_arp(emit, semaphore, agent, community)
+            await emit(('stats', device, agent.stats()))
+
+        await asyncio.gather(
+            *(collect_switch(*switch) for switch in switches),
+            *(collect_router(*router) for router in routers),
+        )
@@ -0,0 +1,71 @@
+"""Reverse DNS lookups of the MAC job with a PTR cache persisted between runs."""
+
+import asyncio
+import time
+from ipaddress import ip_address
+
+import aiodns
+from django.core.cache import cache
+
+CACHE_KEY = 'nautobot_porthistory_plugin:ptr:{address}'
+# names are kept for the TTL of the PTR answer; POSITIVE_TTL when pycares reports none
+POSITIVE_TTL = 60 * 60 * 24
+# NXDOMAIN / no PTR record
+NEGATIVE_TTL = 60 * 60 * 4
+# timeouts and server failures are retried on the next run, but not within the same hour
+ERROR_TTL = 60 * 60
+
+
+class PtrCache:
+    """PTR names of IP addresses: ``name`` (``None`` when there is no PTR record) until ``expires``."""
+
+    def __init__(self, addresses):
+        self.keys = {address: CACHE_KEY.format(address=address) for address in addresses}
+        self.entries = cache.get_many(list(self.keys.values()))
+        self.changed = {}
+
+    def pending(self):
+        """Addresses without a cached answer or with an expired one."""
+        now = time.time()
+        return [
+            address for address, key in self.keys.items()
+            if key not in self.entries or self.entries[key]['expires'] <= now
+        ]
+
+    def get(self, address):
+        entry = self.entries.get(self.keys[address])
+        return entry['name'] if entry else None
+
+    def set(self, address, name, ttl):
+        key = self.keys[address]
+        self.entries[key] = self.changed[key] = {'name': name, 'expires': time.time() + ttl}
+
+    def save(self):
+        if self.changed:
+            cache.set_many(self.changed, max(POSITIVE_TTL, NEGATIVE_TTL, ERROR_TTL))
+            self.changed = {}
+
+
+async def resolve_ptr(emit, addresses, workers):
+    """Resolve PTR names of ``addresses``, emitting ``(address, name or None, ttl)`` for each.
+
+    ``name`` is ``None`` with NEGATIVE_TTL when the address has no PTR record and with
+    ERROR_TTL when the lookup failed.
+    """
+    resolver = aiodns.DNSResolver()
+    semaphore = asyncio.Semaphore(workers)
+
+    async def resolve(address):
+        async with semaphore:
+            try:
+                reply = await resolver.query(ip_address(address).reverse_pointer, 'PTR')
+            except aiodns.error.DNSError as error:
+                if error.args and error.args[0] in (aiodns.error.ARES_ENOTFOUND, aiodns.error.ARES_ENODATA):
+                    await emit((address, None, NEGATIVE_TTL))
+                else:
+                    await emit((address, None, ERROR_TTL))
+                return
+            ttl = reply.ttl if getattr(reply, 'ttl', -1) > 0 else POSITIVE_TTL
+            await emit((address, reply.name.rstrip('.').lower() or None, ttl))
+
+    await asyncio.gather(*(resolve(address) for address in addresses))
@@ -1,9 +1,11 @@
+from string import hexdigits
+
 import django_filters
 from nautobot.dcim.models import Device
 from nautobot.utilities.filters import BaseFilterSet, MultiValueCharFilter
 from django.db.models import Q
 
-from nautobot_porthistory_plugin.models import MAConPorts
+from nautobot_porthistory_plugin.models import MAConPorts, MACHistory
 
 class PortHistoryFilterSet(BaseFilterSet):
     """Filter for MAConPorts"""
@@ -36,11 +38,15 @@ class PortHistoryFilterSet(BaseFilterSet):
         ]
 
     def search(self, queryset, mac, value):
+        # ищем по индексированным ключам: весь MAC, начало MAC (OUI) или его конец
         if not value.strip():
             return queryset
-        mac = ''.join(ch for ch in value if ch.isalnum())
-        mac = ':'.join(mac[i:i+2] for i in range(0,len(mac),2))
-        return queryset.filter(Q(mac__icontains=mac))
+        key = ''.join(ch for ch in value if ch in hexdigits).upper()
+        if not key:
+            return queryset.none()
+        if len(key) >= 12:
+            return queryset.filter(mac_key=key[:12])
+        return queryset.filter(Q(mac_key__startswith=key) | Q(mac_key_reversed__startswith=key[::-1]))
 
     def filter_site(self, queryset, name, id_list):
         if not id_list:
@@ -56,3 +62,22 @@ class PortHistoryFilterSet(BaseFilterSet):
         if not id_list:
             return queryset
         return queryset.filter(Q(vlan__id__in=id_list) )
+
+class MACHistoryFilterSet(PortHistoryFilterSet):
+    """Filter for MACHistory"""
+
+    seen_at = django_filters.DateTimeFilter(method="filter_seen_at", label="Seen at")
+
+    class Meta:
+        """Meta attributes for filter."""
+
+        model = MACHistory
+
+        fields = [
+            'vlan'
+        ]
+
+    def filter_seen_at(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.seen_at(value)
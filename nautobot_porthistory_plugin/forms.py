@@ -2,10 +2,10 @@ from django import forms
 
 from nautobot.dcim.models import Region, Site, Device
 from nautobot.ipam.models import VLAN
-from nautobot.utilities.forms import BootstrapMixin, DynamicModelMultipleChoiceField
+from nautobot.utilities.forms import BootstrapMixin, DateTimePicker, DynamicModelMultipleChoiceField
 from nautobot.extras.forms import CustomFieldFilterForm
 
-from nautobot_porthistory_plugin.models import MAConPorts
+from nautobot_porthistory_plugin.models import MAConPorts, MACHistory
 
 class PortHistoryFilterForm(BootstrapMixin, forms.Form):
     """Filter form to filter searches for MAC."""
@@ -31,3 +31,9 @@ class PortHistoryFilterForm(BootstrapMixin, forms.Form):
         query_params={"site": "$site"},
     )
 
+class MACHistoryFilterForm(PortHistoryFilterForm):
+    """Filter form to filter MAC history, e.g. where a MAC was at some moment."""
+
+    model = MACHistory
+    field_order = ["q", "seen_at", "site", "device_id", "vlan"]
+    seen_at = forms.DateTimeField(required=False, label="Seen at", widget=DateTimePicker())
@@ -0,0 +1,71 @@
+"""Persistent per-device cache of ifIndex to Interface mappings shared by the porthistory jobs."""
+
+import hashlib
+
+from django.core.cache import cache
+from netutils.interface import canonical_interface_name
+
+CACHE_KEY = 'nautobot_porthistory_plugin:ifindexes:{device_id}'
+CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+
+class IfIndexCache:
+    """ifIndex (int) -> Interface id mapping of every device in an inventory.
+
+    A cached mapping is used as long as the agent was not rebooted, its ifTable did not
+    change and the device's interfaces in Nautobot are the same; only then the collector
+    may skip the ifName walk.
+    """
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.keys = {
+            device_ip: CACHE_KEY.format(device_id=device.device.pk)
+            for device_ip, device in inventory.items()
+        }
+        self.digests = {
+            device_ip: self.digest(device)
+            for device_ip, device in inventory.items()
+        }
+        self.entries = cache.get_many(list(self.keys.values()))
+        self.changed = {}
+
+    @staticmethod
+    def digest(device):
+        names = sorted(f'{intf.id}:{name}' for name, intf in device.interfaces.items())
+        return hashlib.md5('\n'.join(names).encode()).hexdigest()
+
+    def stamp(self, device_ip):
+        """Return the stamp of a usable cached mapping, or ``None`` when ifName has to be walked."""
+        entry = self.entries.get(self.keys[device_ip])
+        if entry and entry['digest'] == self.digests[device_ip]:
+            return entry['stamp']
+        return None
+
+    def resolve(self, device_ip, stamp, ifnames):
+        """Fill ``ifindexes`` of a device from an ifName walk or, when ``ifnames`` is None, from the cache."""
+        device = self.inventory[device_ip]
+        key = self.keys[device_ip]
+        if ifnames is None:
+            interfaces = {intf.id: intf for intf in device.interfaces.values()}
+            for ifindex, interface_id in self.entries[key]['ifindexes'].items():
+                if interface_id in interfaces:
+                    device.ifindexes[int(ifindex)] = interfaces[interface_id]
+            return
+
+        for index, index_result in ifnames.items():
+            ifindex = int(index.rsplit('.', 1)[1])
+            canonical_intf_name = canonical_interface_name(index_result.decode("utf-8"))
+            if canonical_intf_name in device.interfaces:
+                device.ifindexes[ifindex] = device.interfaces[canonical_intf_name]
+        if stamp is not None:
+            self.changed[key] = {
+                'stamp': stamp,
+                'digest': self.digests[device_ip],
+                'ifindexes': {ifindex: intf.id for ifindex, intf in device.ifindexes.items()},
+            }
+
+    def save(self):
+        if self.changed:
+            cache.set_many(self.changed, CACHE_TIMEOUT)
+            self.changed = {}
@@ -0,0 +1,67 @@
+"""Inventory of polled devices shared by the porthistory jobs."""
+
+from django.db.models import Count
+
+from nautobot.dcim.models import Device, Interface
+
+NAPALM_DRIVER = 'cisco_iosxe'
+
+
+class InventoryDevice:
+    """A polled device, its interfaces by name and the data collected from it during a run."""
+
+    __slots__ = ('device', 'interfaces', 'ifindexes', 'vlans', 'uptime', 'boottime')
+
+    def __init__(self, device):
+        self.device = device
+        self.interfaces = {}
+        self.ifindexes = {}
+        self.vlans = ()
+        self.uptime = None
+        self.boottime = None
+
+
+def polled_devices(role_slugs, status):
+    """Devices of the given roles that the jobs poll: with the supported platform and a primary IPv4 address."""
+    return Device.objects.filter(
+        device_role__slug__in=role_slugs,
+        status=status,
+        platform__napalm_driver=NAPALM_DRIVER,
+        primary_ip4__isnull=False,
+    )
+
+
+def count_devices_by_site(role_slugs, status, sites=None):
+    """Number of polled devices of the given roles per site id, with one aggregate query."""
+    nb_devices = polled_devices(role_slugs, status)
+    if sites is not None:
+        nb_devices = nb_devices.filter(site__in=sites)
+    return dict(nb_devices.order_by().values_list('site_id').annotate(count=Count('id')))
+
+
+def load_inventory(role_slugs, status, sites=None, with_interfaces=True, addresses=None):
+    """Load active devices of the given roles with a primary IPv4 address, keyed by management IP.
+
+    Devices (with platform, primary IP and site) are fetched with one query, and interfaces
+    of all of them with one more. ``sites`` restricts the devices to a list of sites,
+    ``addresses`` to a list of management IPs.
+    """
+    nb_devices = polled_devices(role_slugs, status).select_related('platform', 'primary_ip4', 'site')
+    if sites is not None:
+        nb_devices = nb_devices.filter(site__in=sites)
+    if addresses is not None:
+        nb_devices = nb_devices.filter(primary_ip4__host__in=list(addresses))
+
+    inventory = {}
+    by_id = {}
+    for nb_device in nb_devices:
+        primary_ip = str(nb_device.primary_ip4).split('/')[0]
+        inventory[primary_ip] = by_id[nb_device.id] = InventoryDevice(nb_device)
+
+    if with_interfaces and by_id:
+        interfaces = Interface.objects.filter(device_id__in=list(by_id)).only('id', 'name', 'device_id', '_custom_field_data')
+        for intf in interfaces:
+            device = by_id[intf.device_id]
+            intf.device = device.device
+            device.interfaces[intf.name] = intf
+    return inventory
@@ -1,26 +1,69 @@
-from django.contrib.contenttypes.models import ContentType
-
-from nautobot.dcim.models import Device, DeviceRole, Site, Interface, Cable
-from nautobot.ipam.models import VLAN, IPAddress, Prefix
-from nautobot.extras.jobs import Job, ObjectVar
+from nautobot.dcim.models import Site
+from nautobot.ipam.models import VLAN, IPAddress
+from nautobot.extras.choices import JobResultStatusChoices, LogLevelChoices
+from nautobot.extras.jobs import Job, ObjectVar, MultiObjectVar, ChoiceVar, IntegerVar
 from nautobot.extras.models import Status
 from django.conf import settings
-
-from nautobot_porthistory_plugin.models import UnusedPorts, MAConPorts
-
-import asyncio
-import aiosnmp
-from ipaddress import IPv4Network, IPv4Address
-import aiodns
+from django.utils import timezone
+
+from nautobot_porthistory_plugin.models import UnusedPorts, MAConPorts, MACHistory
+from nautobot_porthistory_plugin.writers import BulkWriter, BATCH_SIZE
+from nautobot_porthistory_plugin.prefixes import PrefixIndex, format_ipv4
+from nautobot_porthistory_plugin.topology import get_cabled_interfaces
+from nautobot_porthistory_plugin.inventory import load_inventory, count_devices_by_site
+from nautobot_porthistory_plugin.ifindexes import IfIndexCache
+from nautobot_porthistory_plugin.macs import mac_fields
+from nautobot_porthistory_plugin.agents import AgentProfiles
+from nautobot_porthistory_plugin.panels import invalidate_panels
+from nautobot_porthistory_plugin.dns import PtrCache, resolve_ptr
+from nautobot_porthistory_plugin.metrics import RunMetrics
+from nautobot_porthistory_plugin.shards import partition_sites, launch_shard, wait_shards, shard_logs
+from nautobot_porthistory_plugin.collector import (
+    Pipeline, start_pipeline, split_evenly, split_workers, process_count,
+    gather_devices, gather_mac_on_ports, collect_unused_ports,
+    OID_SNMP_ENGINE_TIME, OID_IF_NAME, OID_LOC_IF_LAST_OUTPUT,
+)
 
 from collections import defaultdict
-from netutils.interface import canonical_interface_name
 from datetime import datetime, timedelta
 
 name = "System"
-loop = asyncio.get_event_loop()
 
-class UnusedPortsUpdate(Job):
+# время последнего output вычисляется от момента опроса, поэтому при каждом запуске
+# немного "плавает" - такие изменения в базу не пишем
+LAST_OUTPUT_TOLERANCE = timedelta(minutes=5)
+
+# столько MAC адресов опрошенных коммутаторов MAC job сверяет с базой и записывает за один раз
+MAC_BATCH_ROWS = 5000
+
+def selected_sites(data):
+    # сайты запуска: выбранный БЮ и/или список БЮ шарда; None - все
+    sites = list(data.get('sites') or [])
+    if data.get('site'):
+        sites.append(data['site'])
+    return sites or None
+
+def run_scope(sites):
+    # метки отчета о производительности: весь парк или список БЮ шарда
+    return ','.join(sorted(site.slug for site in sites)) if sites else 'all'
+
+class MetricsMixin:
+
+    def finish_metrics(self):
+        # отчет по этапам прикладываем к JobResult и сохраняем для /metrics
+        report = self.metrics.report()
+        self.results['performance'] = report
+        self.metrics.save(report)
+        phases = ', '.join(f"{phase} {totals['seconds']:.1f} с/{totals['queries']} SQL" for phase, totals in report['phases'].items())
+        snmp = ', '.join(f"{phase} {totals['pdus']} PDU" for phase, totals in report['snmp'].items())
+        self.log_info(message=f'Этапы: {phases}; SNMP: {snmp}')
+
+    def post_run(self):
+        # счетчик SQL снимаем с соединения и тогда, когда run() прервался с ошибкой
+        if getattr(self, 'metrics', None) is not None:
+            self.metrics.close()
+
+class UnusedPortsUpdate(MetricsMixin, Job):
 
     class Meta:
         name = "Обновление информации о неподключенных интерфейсах"
@@ -33,44 +76,11 @@ class UnusedPortsUpdate(Job):
         required=False
     )
 
-    async def bulk_snmp(self, device, oid_list, community):
-        oid_results = {}
-        try:
-            async with aiosnmp.Snmp(
-                host=device,
-                port=161,
-                community=community,
-                timeout=5,
-                retries=3,
-                max_repetitions=10,
-            ) as snmp:
-                oid_bulk_result = {}
-                for oid in oid_list:
-                    reply = await snmp.bulk_walk(oid)
-                    for index in reply:
-                        oid_bulk_result[index.oid] = index.value
-                    oid_results[oid] = oid_bulk_result
-
-                return (device, oid_results)
-
-        except Exception as error:
-            return (device, error)
-        return (device, None)
-
-    async def bulk_snmp_with_semaphore(self, semaphore, function, *args, **kwargs):
-        async with semaphore:
-            return await function(*args, **kwargs)
-
-    async def async_bulk_snmp(self, devices, oid_list, community, workers):
-        semaphore = asyncio.Semaphore(workers)
-        coroutines = [
-            self.bulk_snmp_with_semaphore(semaphore, self.bulk_snmp, device, oid_list, community)
-            for device in devices
-        ]
-        result = []
-        for future in asyncio.as_completed(coroutines):
-            result.append(await future)
-        return result
+    sites = MultiObjectVar(
+        model=Site,
+        label='Несколько БЮ',
+        required=False
+    )
 
     def round_datetime(self, date):
         date_tuple = date.timetuple()
@@ -91,104 +101,115 @@ class UnusedPortsUpdate(Job):
         MIN_IDLE_DAYS = PLUGIN_CFG.get('min_idle_days', 14)
         SWITCHES_ROLE_SLUG = PLUGIN_CFG['switches_role_slug']
         WORKERS = PLUGIN_CFG['workers']
+        PROCESSES = PLUGIN_CFG.get('processes', 1)
+        sites = selected_sites(data)
+        self.metrics = RunMetrics('unused_ports', run_scope(sites))
+        self.metrics.phase('inventory')
         STATUS_ACTIVE = Status.objects.get(slug='active')
 
-        # сгенерируем справочник устройств
-        devices = [] #этот список передадим в модуль snmp
-        device_dict = defaultdict(dict)
-        device_role = DeviceRole.objects.filter(slug__in=SWITCHES_ROLE_SLUG)
-        if data['site']:
-            nb_devices = Device.objects.filter(site=data['site'], device_role__in=device_role, status=STATUS_ACTIVE)
-        else:
-            nb_devices = Device.objects.filter(device_role__in=device_role, status=STATUS_ACTIVE)
-            
-        for nb_device in nb_devices:
-            if nb_device.platform and nb_device.platform.napalm_driver and nb_device.platform.napalm_driver == 'cisco_iosxe' and nb_device.primary_ip4:
-                primary_ip = str(nb_device.primary_ip4).split('/')[0]
-                devices.append(primary_ip)
-                device_dict[primary_ip]['device'] = nb_device
-                device_dict[primary_ip]['interfaces'] = {}
-                device_dict[primary_ip]['ifindexes'] = {}
-                device_interfaces = Interface.objects.filter(device_id=nb_device)
-                for intf in device_interfaces:
-                    device_dict[primary_ip]['interfaces'][intf.name] = [intf]
-
-        # получим uptime оборудования по SNMP (в секундах)
-        # и занесем эту информацию в справочник
-        oid_list = ['.1.3.6.1.6.3.10.2.1.3']
-        results = asyncio.run(self.async_bulk_snmp(devices, oid_list, COMMUNITY, WORKERS))
-        for device_ip, device_result in results:
+        # сгенерируем справочник устройств и их интерфейсов
+        devices = load_inventory(SWITCHES_ROLE_SLUG, STATUS_ACTIVE, sites=sites)
+
+        # загрузим одним запросом уже известные неиспользуемые порты опрашиваемых устройств,
+        # изменения будем вычислять в памяти и записывать пачками
+        unused_ports = {
+            port.interface_id: port
+            for port in UnusedPorts.objects.filter(
+                interface__device__in=[device.device for device in devices.values()]
+            )
+        }
+        writer = BulkWriter(UnusedPorts, ['last_output', 'updated'])
+
+        # соответствие ifIndex -> интерфейс берем из кэша, пока коммутатор не перезагружался
+        # и не менялась его ifTable; иначе заново опрашиваем ifName
+        ifindex_cache = IfIndexCache(devices)
+        stamps = {device_ip: ifindex_cache.stamp(device_ip) for device_ip in devices}
+
+        # коммутаторы, которые не отвечали на прошлых запусках, пропускаем до истечения паузы,
+        # остальные опрашиваем с таймаутом и max-repetitions, подобранными по прошлым опросам
+        agent_profiles = AgentProfiles(devices)
+        down = [device_ip for device_ip in devices if agent_profiles.is_down(device_ip)]
+        if down:
+            self.log_warning(message=f'Пропущено недоступных по SNMP устройств: {len(down)}')
+        params = {device_ip: agent_profiles.params(device_ip) for device_ip in devices}
+
+        # опросим каждый коммутатор в одной SNMP-сессии: uptime (в секундах), названия и индексы
+        # интерфейсов, время последнего output. Результат по устройству обрабатываем сразу,
+        # как только закончен его опрос, не дожидаясь остальных.
+        # При processes > 1 устройства и бюджет workers делятся между процессами опроса
+        polled = [device_ip for device_ip in devices if device_ip not in down]
+        processes = process_count(PROCESSES, polled)
+        self.metrics.phase('snmp')
+        pipeline = start_pipeline(gather_devices, [
+            (collect_unused_ports, part, workers, COMMUNITY, stamps, params)
+            for part, workers in zip(split_evenly(polled, processes), split_workers(WORKERS, processes))
+        ])
+        output = ''
+        changed_devices = []
+        for device_ip, device_result, stats in pipeline:
+            agent_profiles.record(device_ip, stats)
+            device = devices[device_ip]
+            self.metrics.device(device.device.name, stats)
             if type(device_result) != dict:
-                self.log_warning(obj=device_dict[device_ip]['device'],message=f'не удалось получить информацию по SNMP - {device_result}')
-                continue
-            for oid, oid_result in device_result.items():
-                for uptime in oid_result.values():
-                    device_dict[device_ip]['uptime'] = uptime
-                    boottime = datetime.now() - timedelta(seconds=uptime)
-                    device_dict[device_ip]['boottime'] = boottime
-    
-        # получим названия интерфейсов и их индексы с оборудования по SNMP
-        # и занесем эту информацию в справочник
-        oid_list = ['.1.3.6.1.2.1.31.1.1.1.1']
-        results = asyncio.run(self.async_bulk_snmp(devices, oid_list, COMMUNITY, WORKERS))
-        for device_ip, device_result in results:
-            if type(device_result) != dict or 'uptime' not in device_dict[device_ip]:
+                self.log_warning(obj=device.device,message=f'не удалось получить информацию по SNMP - {device_result}')
                 continue
-            for oid, oid_result in device_result.items():
-                for index, index_result in oid_result.items():
-                    ifindex = index.split('.')[-1]
-                    canonical_intf_name = canonical_interface_name(index_result.decode("utf-8"))
-                    if canonical_intf_name in device_dict[device_ip]['interfaces']:
-                        device_dict[device_ip]['ifindexes'][ifindex] = canonical_intf_name
-
-        # получим время последнего output по SNMP
-        oid_list = ['.1.3.6.1.4.1.9.2.2.1.1.4']
-        results = asyncio.run(self.async_bulk_snmp(devices, oid_list, COMMUNITY, WORKERS))
-        output = ''
-        for device_ip, device_result in results:
-            if type(device_result) != dict or 'uptime' not in device_dict[device_ip]:
+            now = timezone.now()
+            for uptime in device_result[OID_SNMP_ENGINE_TIME].values():
+                device.uptime = uptime
+                device.boottime = now - timedelta(seconds=uptime)
+            if device.uptime is None:
                 continue
-            nb_device = device_dict[device_ip]['device']
-            boottime = device_dict[device_ip]['boottime']
-            uptime = device_dict[device_ip]['uptime']
+
+            stamp, ifnames = device_result[OID_IF_NAME]
+            ifindex_cache.resolve(device_ip, stamp, ifnames)
+
+            nb_device = device.device
+            boottime = device.boottime
+            uptime = device.uptime
             output += f'{nb_device.name} - power on {boottime}\n'
             unused_port_count = 0
-            for oid, oid_result in device_result.items():
-                for index, time_from_last_output in oid_result.items():
-                    ifindex = index.split('.')[-1]
-                    if ifindex in device_dict[device_ip]['ifindexes']:
-                        intf_name = device_dict[device_ip]['ifindexes'][ifindex]
-                        nb_interface = device_dict[device_ip]['interfaces'][intf_name][0]
-                        if time_from_last_output < 0 or time_from_last_output / 1000 > uptime - 300:
-                            unused_port_count += 1
-                            unused_port, created = UnusedPorts.objects.get_or_create(
-                                interface=nb_interface,
-                                defaults={
-                                    'last_output': boottime
-                                }
-                            )
-                            unused_port.save()
-                        else:
-                            last_output = datetime.now() - timedelta(seconds=round(time_from_last_output/1000))
-                            if 1000 * 60 * 60 * 24 * MIN_IDLE_DAYS > time_from_last_output:
-                                # прошло меньше MIN_IDLE_DAYS дней
-                                UnusedPorts.objects.filter(interface=nb_interface).delete()
-                            else:
-                                unused_port_count += 1
-                                unused_port, created = UnusedPorts.objects.get_or_create(
-                                    interface=nb_interface,
-                                    defaults={
-                                        'last_output': last_output
-                                    }
-                                )
-                                if not created:
-                                    unused_port.last_output = last_output
-                                    unused_port.save()
+            writes = writer.created + writer.updated + writer.deleted + len(writer)
+            for index, time_from_last_output in device_result[OID_LOC_IF_LAST_OUTPUT].items():
+                ifindex = int(index.rsplit('.', 1)[1])
+                if ifindex not in device.ifindexes:
+                    continue
+                nb_interface = device.ifindexes[ifindex]
+                unused_port = unused_ports.get(nb_interface.id)
+                if time_from_last_output < 0 or time_from_last_output / 1000 > uptime - 300:
+                    # с момента включения output не было - время уже известного порта не меняем
+                    unused_port_count += 1
+                    if not unused_port:
+                        writer.create(UnusedPorts(interface=nb_interface, last_output=boottime))
+                    continue
+                if 1000 * 60 * 60 * 24 * MIN_IDLE_DAYS > time_from_last_output:
+                    # прошло меньше MIN_IDLE_DAYS дней
+                    if unused_port:
+                        writer.delete(unused_port.pk)
+                    continue
+                unused_port_count += 1
+                last_output = now - timedelta(seconds=round(time_from_last_output/1000))
+                if not unused_port:
+                    writer.create(UnusedPorts(interface=nb_interface, last_output=last_output))
+                elif abs(unused_port.last_output - last_output) > LAST_OUTPUT_TOLERANCE:
+                    unused_port.last_output = last_output
+                    unused_port.updated = now
+                    writer.update(unused_port)
             output += f'неиспользуемых в течении {MIN_IDLE_DAYS} дн. портов - {unused_port_count}\n'
+            if writer.created + writer.updated + writer.deleted + len(writer) != writes:
+                changed_devices.append(nb_device.pk)
+
+        self.metrics.phase('db_write')
+        writer.flush()
+        # панель неиспользуемых портов на странице устройства перестроится только у измененных устройств
+        invalidate_panels('unused_ports', changed_devices)
+        ifindex_cache.save()
+        agent_profiles.save()
+        self.log_info(message=f'Неиспользуемые порты: добавлено {writer.created}, обновлено {writer.updated}, удалено {writer.deleted}')
+        self.finish_metrics()
 
         return output
 
-class MAConPortsUpdate(Job):
+class MAConPortsUpdate(MetricsMixin, Job):
 
     class Meta:
         name = "Обновление информации о подключенных устройствах"
@@ -202,45 +223,173 @@ class MAConPortsUpdate(Job):
         required=False
     )
 
+    sites = MultiObjectVar(
+        model=Site,
+        label='Несколько БЮ',
+        required=False
+    )
 
-    async def bulk_snmp(self, device, oid_list, community):
-        oid_results = {}
-        try:
-            async with aiosnmp.Snmp(
-                host=device,
-                port=161,
-                community=community,
-                timeout=5,
-                retries=3,
-                max_repetitions=10,
-            ) as snmp:
-                oid_bulk_result = {}
-                for oid in oid_list:
-                    reply = await snmp.bulk_walk(oid)
-                    for index in reply:
-                        oid_bulk_result[index.oid] = index.value
-                    oid_results[oid] = oid_bulk_result
-
-                return (device, oid_results)
-
-        except Exception as error:
-            return (device, error)
-        return (device, None)
-
-    async def bulk_snmp_with_semaphore(self, semaphore, function, *args, **kwargs):
-        async with semaphore:
-            return await function(*args, **kwargs)
-
-    async def async_bulk_snmp(self, devices, oid_list, community, workers):
-        semaphore = asyncio.Semaphore(workers)
-        coroutines = [
-            self.bulk_snmp_with_semaphore(semaphore, self.bulk_snmp, device, oid_list, community)
-            for device in devices
-        ]
-        result = []
-        for future in asyncio.as_completed(coroutines):
-            result.append(await future)
-        return result
+
+    def bridge_ports(self, device, bridge_ports_result, cabled_interfaces):
+        # bridge port (int) -> интерфейс, линки между свичами и порты с flag-ignore-mac пропускаем
+        bridge_ports = {}
+        for index, index_result in bridge_ports_result.items():
+            if index_result in device.ifindexes:
+                nb_interface = device.ifindexes[index_result]
+                if (nb_interface.id not in cabled_interfaces
+                        and not nb_interface._custom_field_data.get('flag-ignore-mac')):
+                    bridge_ports[int(index.rsplit('.', 1)[1])] = nb_interface
+        return bridge_ports
+
+    def drop_macs(self, port_mac_relation, bridge_ports, condition):
+        # убираем MAC адреса, полученные до обрыва опроса, чтобы неполная таблица не удалила остальные
+        for nb_interface in set(bridge_ports.values()):
+            port_mac_relation[nb_interface.id] = [
+                vlan_and_mac for vlan_and_mac in port_mac_relation[nb_interface.id]
+                if not condition(vlan_and_mac)
+            ]
+
+    def match_device(self, device, port_mac_relation, arp, prefix_index, mac_on_ports):
+        # сопоставим MAC адреса опрошенного коммутатора с ARP таблицами и префиксами VLAN
+        nb_device = device.device
+        site = nb_device.site_id
+        mac_on_device = ip_on_device = 0
+        for intf in device.interfaces.values():
+            for nb_vlan, mac in port_mac_relation.pop(intf.id, ()):
+                mac_on_device += 1
+                addresses = arp[site].get(mac)
+                match = prefix_index.lookup(nb_vlan.id, addresses) if addresses else None
+                if match:
+                    ip_on_device += 1
+                    address, prefixlen, vrf_id = match
+                    address = (vrf_id, f'{format_ipv4(address)}/{prefixlen}')
+                else:
+                    address = None
+                mac_on_ports[(nb_vlan.id, mac)] = (intf, nb_device, nb_vlan, address)
+        return f'device {nb_device} : MAC count - {mac_on_device}, IP count - {ip_on_device}\n'
+
+    def write_macs(self, mac_on_ports, polled):
+        # запишем пачку MAC адресов коммутаторов polled: IP адреса, MAC на портах и историю
+        now = self.now
+        nb_addresses = self.nb_addresses
+
+        # загрузим еще не известные IP адреса (пачками по BATCH_SIZE), недостающие создадим одним bulk_create
+        addresses = {address for *_, address in mac_on_ports.values() if address}
+        hosts = list({
+            address_with_prefix.split('/')[0] for vrf_id, address_with_prefix in addresses
+            if (vrf_id, address_with_prefix.split('/')[0]) not in nb_addresses
+        })
+        for i in range(0, len(hosts), BATCH_SIZE):
+            for nb_address in IPAddress.objects.filter(host__in=hosts[i:i + BATCH_SIZE]):
+                nb_addresses.setdefault((nb_address.vrf_id, nb_address.host), nb_address)
+        for vrf_id, address_with_prefix in addresses:
+            key = (vrf_id, address_with_prefix.split('/')[0])
+            nb_address = nb_addresses.get(key)
+            if nb_address is None:
+                nb_address = nb_addresses[key] = IPAddress(
+                    address=address_with_prefix,
+                    vrf_id=vrf_id,
+                    status=self.status_static,
+                )
+                self.ip_writer.create(nb_address)
+                self.log_success(obj=nb_address, message=f'Добавлен IP адрес')
+                self.ip_for_nslookup[key[1]].append(nb_address)
+            elif nb_address.status_id != self.status_dhcp.id and nb_address not in self.ip_for_nslookup[key[1]]:
+                self.ip_for_nslookup[key[1]].append(nb_address)
+        self.ip_writer.flush()
+
+        # известные MAC адреса опрошенных устройств и строки MAC адресов пачки, стоявших на других устройствах,
+        # и вычислим, что нужно создать, изменить и удалить
+        # (пара (влан, MAC) уникальна, mac_key - MAC в hex без разделителей)
+        nb_mac_on_ports = {}
+        for mac in MAConPorts.objects.filter(device__in=[device.device for device in polled]).select_related('interface', 'ipaddress'):
+            nb_mac_on_ports[(mac.vlan_id, int(mac.mac_key, 16))] = mac
+        elsewhere = [key for key in mac_on_ports if key not in nb_mac_on_ports]
+        for i in range(0, len(elsewhere), BATCH_SIZE):
+            keys = elsewhere[i:i + BATCH_SIZE]
+            for mac in MAConPorts.objects.filter(
+                        vlan_id__in={vlan_id for vlan_id, _ in keys}, mac_key__in={f'{mac_int:012X}' for _, mac_int in keys},
+                    ).select_related('interface', 'ipaddress'):
+                nb_mac_on_ports.setdefault((mac.vlan_id, int(mac.mac_key, 16)), mac)
+
+        mac_writer = self.mac_writer
+        # панели интерфейсов опрошенных устройств и IP адресов, чьи строки изменились или продлились
+        changed_interfaces = {intf.id for device in polled for intf in device.interfaces.values()}
+        changed_ipaddresses = set()
+        for key, (intf, nb_device, nb_vlan, address) in mac_on_ports.items():
+            nb_address = nb_addresses[(address[0], address[1].split('/')[0])] if address else None
+            if nb_address:
+                changed_ipaddresses.add(nb_address.id)
+            mac = nb_mac_on_ports.pop(key, None)
+            if mac is None:
+                mac_writer.create(MAConPorts(
+                    vlan=nb_vlan,
+                    **mac_fields(key[1]),
+                    interface=intf,
+                    device=nb_device,
+                    ipaddress=nb_address,
+                ))
+                continue
+            updated = False
+            changed_interfaces.add(mac.interface_id)
+            if mac.ipaddress_id:
+                changed_ipaddresses.add(mac.ipaddress_id)
+            if nb_address and mac.ipaddress_id != nb_address.id:
+                self.log_info(obj=nb_address, message=f'Устройство с MAC {mac.mac} поменяло IP {mac.ipaddress} -> {nb_address}')
+                mac.ipaddress = nb_address
+                updated = True
+            if mac.interface_id != intf.id:
+                self.log_info(obj=intf, message=f'MAC {mac.mac} переехал с порта "{mac.interface}"')
+                mac.interface = intf
+                mac.device = nb_device
+                updated = True
+            if updated:
+                mac.updated = now
+                mac_writer.update(mac)
+            else:
+                mac_writer.touch(mac.pk)
+
+        # MAC адреса, которые пропали с опрошенных интерфейсов
+        polled_interfaces = {intf.id for intf, *_ in mac_on_ports.values()}
+        for mac in nb_mac_on_ports.values():
+            if mac.interface_id in polled_interfaces:
+                mac_writer.delete(mac.pk)
+                if mac.ipaddress_id:
+                    changed_ipaddresses.add(mac.ipaddress_id)
+        mac_writer.flush()
+        invalidate_panels('mac_on_port', changed_interfaces)
+        invalidate_panels('ports_with_ipaddress', changed_ipaddresses)
+
+        # история: открытый интервал (последний по (влан, MAC), виденный не раньше HISTORY_GAP назад)
+        # продлеваем, если MAC на том же порту и с тем же IP; иначе открываем новый интервал
+        open_intervals = {}
+        keys = list(mac_on_ports)
+        for i in range(0, len(keys), BATCH_SIZE):
+            for pk, vlan_id, mac_key, interface_id, ipaddress_id in MACHistory.objects.filter(
+                        vlan_id__in={vlan_id for vlan_id, _ in keys[i:i + BATCH_SIZE]},
+                        mac_key__in={f'{mac:012X}' for _, mac in keys[i:i + BATCH_SIZE]},
+                        last_seen__gte=now - self.history_gap,
+                    ).order_by('last_seen').values_list('pk', 'vlan_id', 'mac_key', 'interface_id', 'ipaddress_id'):
+                open_intervals[(vlan_id, int(mac_key, 16))] = (pk, interface_id, ipaddress_id)
+
+        history_writer = self.history_writer
+        for key, (intf, nb_device, nb_vlan, address) in mac_on_ports.items():
+            nb_address = nb_addresses[(address[0], address[1].split('/')[0])] if address else None
+            interval = open_intervals.get(key)
+            # если IP в этот раз не найден, интервал не разрываем
+            if interval and interval[1] == intf.id and (nb_address is None or interval[2] == nb_address.id):
+                history_writer.touch(interval[0])
+            else:
+                history_writer.create(MACHistory(
+                    vlan=nb_vlan,
+                    **mac_fields(key[1]),
+                    interface=intf,
+                    device=nb_device,
+                    ipaddress=nb_address,
+                    first_seen=now,
+                    last_seen=now,
+                ))
+        history_writer.flush()
 
     def run(self, data, commit):
         # запускать job могут только пользователи is_superuser
@@ -253,281 +402,383 @@ class MAConPortsUpdate(Job):
         SWITCHES_ROLE_SLUG = PLUGIN_CFG['switches_role_slug']
         ROUTERS_ROLE_SLUG = PLUGIN_CFG['routers_role_slug']
         WORKERS = PLUGIN_CFG['workers']
+        PROCESSES = PLUGIN_CFG.get('processes', 1)
+        QBRIDGE_PLATFORMS = PLUGIN_CFG.get('qbridge_platforms', [])
+        HISTORY_GAP = timedelta(hours=PLUGIN_CFG.get('history_gap_hours', 24))
         STATUS_ACTIVE = Status.objects.get(slug='active')
         STATUS_STATIC = Status.objects.get(slug='static')
         STATUS_DHCP = Status.objects.get(slug='dhcp')
 
-        device_role = DeviceRole.objects.filter(slug__in=SWITCHES_ROLE_SLUG)
-
-        devices = defaultdict(dict)
-        devices_list = []
-        vlans = defaultdict(list)
-
-        # построим список всех связей, чтобы потом исключить из результатов линки между свичами
-        cable_set = defaultdict(set)
-        all_cables = Cable.objects.all()
-        for cable in all_cables:
-            if cable.termination_a_type == ContentType.objects.get(app_label='dcim', model='interface'):
-                if not data['site'] or cable.termination_a.device.site == data['site']:
-                    cable_set[cable.termination_a.device.name].add(cable.termination_a.name)
-            if cable.termination_b_type == ContentType.objects.get(app_label='dcim', model='interface'):
-                if not data['site'] or cable.termination_b.device.site == data['site']:
-                    cable_set[cable.termination_b.device.name].add(cable.termination_b.name)
+        # получим id всех интерфейсов с кабелями, чтобы потом исключить из результатов линки между свичами
+        # (индекс кэшируется и сбрасывается при изменении кабелей)
+        sites = selected_sites(data)
+        self.metrics = RunMetrics('mac_on_ports', run_scope(sites))
+        self.metrics.phase('cable_graph')
+        cabled_interfaces = get_cabled_interfaces(sites[0] if sites and len(sites) == 1 else None)
         self.log_info(message=f'Получен граф связей коммутаторов')
+        self.metrics.phase('inventory')
 
         # сгенерируем справочник вланов с разбивкой по сайтам
+        # и словарь (site_id, vid) -> VLAN, чтобы больше не обращаться к базе за вланами
         vlans_by_site = defaultdict(list)
-        if data['site']:
-            nb_vlans = VLAN.objects.filter(site=data['site'], status=STATUS_ACTIVE, _custom_field_data={'flag-porthistory':True})
-        else:
-            nb_vlans = VLAN.objects.filter(status=STATUS_ACTIVE, _custom_field_data={'flag-porthistory':True})
+        vlan_map = {}
+        nb_vlans = VLAN.objects.filter(status=STATUS_ACTIVE, _custom_field_data={'flag-porthistory':True})
+        if sites:
+            nb_vlans = nb_vlans.filter(site__in=sites)
         for nb_vlan in nb_vlans:
-            vlans_by_site[nb_vlan.site.name].append(nb_vlan.vid)
-
-        # сгенерируем справочник устройств
-        for site in vlans_by_site:
-            site_id = Site.objects.get(name=site)
-            nb_devices_in_site = Device.objects.filter(
-                site=site_id, 
-                device_role__in=device_role, 
-                status=STATUS_ACTIVE,
-            )
-            for nb_device in nb_devices_in_site:
-                if (nb_device.platform and 
-                            nb_device.platform.napalm_driver and 
-                            nb_device.platform.napalm_driver == 'cisco_iosxe' and 
-                            nb_device.primary_ip4):
-
-                    primary_ip = str(nb_device.primary_ip4).split('/')[0]
-                    devices_list.append(primary_ip)
-                    device = devices[primary_ip] = {}
-                    device['device'] = nb_device
-                    device['site'] = nb_device.site
-                    device['interfaces'] = {}
-                    device['ifindexes'] = {}
-                    device['bridge_ports'] = {}
-                    device['vlans'] = vlans_by_site[site]
-                    for intf in Interface.objects.filter(device_id=nb_device):
-                        device['interfaces'][intf.name] = intf
-                    for vlan in vlans_by_site[site]:
-                        vlans[vlan].append(primary_ip)
-
-        # получим названия интерфейсов и их индексы с оборудования по SNMP
-        oid_list = ['.1.3.6.1.2.1.31.1.1.1.1']
-        results = asyncio.run(self.async_bulk_snmp(devices_list, oid_list, COMMUNITY, WORKERS))
-        self.log_info(message=f'Получены индексы интерфейсов с коммутатоорв')
-        for device_ip, device_result in results:
-            if type(device_result) != dict:
-                self.log_warning(obj=devices[device_ip]['device'],message=f'не удалось получить информацию по SNMP')
-                del devices[device_ip]
-                devices_list.remove(device_ip)
-                continue
-            for oid, oid_result in device_result.items():
-                for index, index_result in oid_result.items():
-                    ifindex = index.split('.')[-1]
-                    canonical_intf_name = canonical_interface_name(index_result.decode("utf-8"))
-                    if canonical_intf_name in devices[device_ip]['interfaces']:
-                        devices[device_ip]['ifindexes'][ifindex] = canonical_intf_name
-
-        # пройдемся по списку вланов и получим с устройства таблицу MAC адресов для каждого влана
-        # MAC адреса в десятичном формате
-
-        port_mac_relation = defaultdict(list)
+            vlans_by_site[nb_vlan.site_id].append(nb_vlan.vid)
+            vlan_map[(nb_vlan.site_id, nb_vlan.vid)] = nb_vlan
 
-        for vlan, devices_dict in vlans.items():
-            community_with_vlan = f'{COMMUNITY}@{vlan}'
-            devices_list = [device for device in devices_dict if device in devices_list]
-
-            # получим bridge ports с оборудования по SNMP (зависит от VLAN)
-            oid_list = ['.1.3.6.1.2.1.17.1.4.1.2']
-            results = asyncio.run(self.async_bulk_snmp(devices_list, oid_list, community_with_vlan, WORKERS))
-            self.log_info(message=f'Получена информация по bridge ports со всех коммутаторов для VLAN {vlan}')
-            for device_ip, device_result in results:
-                if type(device_result) != dict:
-                    # скорее всего, такого VLAN нет на этом устройстве
-                    continue
-                for oid, oid_result in device_result.items():
-                    for index, index_result in oid_result.items():
-                        bridge_port = index.split('.')[-1]
-                        ifindex = str(index_result)
-                        if ifindex in devices[device_ip]['ifindexes']:
-                            ifname = devices[device_ip]['ifindexes'][ifindex]
-                            nb_interface = devices[device_ip]['interfaces'][ifname]
-                            devices[device_ip]['bridge_ports'][bridge_port] = nb_interface
-            else:
-                oid_list = ['.1.3.6.1.2.1.17.4.3.1.2']
-
-                results = asyncio.run(self.async_bulk_snmp(devices_list, oid_list, community_with_vlan, WORKERS))
-                self.log_info(message=f'Получена таблица MAC со всех коммутаторов для VLAN {vlan}')
-                for device_ip, device_result in results:
-                    nb_device = devices[device_ip]['device']
-                    nb_vlan = VLAN.objects.get(vid=vlan, site_id=nb_device.site.id)
-                    if type(device_result) != dict:
-                        continue
-                    for oid, oid_result in device_result.items():
-                        for mac_dec, bridge_port in oid_result.items():
-                            if str(bridge_port) in devices[device_ip]['bridge_ports']:
-                                if (devices[device_ip]['bridge_ports'][str(bridge_port)].name not in cable_set[nb_device.name]
-                                        and not devices[device_ip]['bridge_ports'][str(bridge_port)]._custom_field_data.get('flag-ignore-mac')):
-                                    # преобразуем MAC из десятичного формата в шестнадцатеричный
-                                    mac_hex = ''.join(['{0:x}'.format(int(i)).zfill(2) for i in mac_dec.split('.')[-6:]]).upper()
-                                    port_mac_relation[devices[device_ip]['bridge_ports'][str(bridge_port)].id].append({
-                                        'vlan': nb_vlan,
-                                        'mac': mac_hex,
-                                        })
+        # сгенерируем справочник устройств и их интерфейсов в сайтах с такими вланами
+        devices = load_inventory(SWITCHES_ROLE_SLUG, STATUS_ACTIVE, sites=list(vlans_by_site))
+        for device in devices.values():
+            device.vlans = vlans_by_site[device.device.site_id]
 
         # подготовим список L3 устройств
-        routers = defaultdict(dict)
-        routers_list = []
-        device_role = DeviceRole.objects.filter(slug__in=ROUTERS_ROLE_SLUG)
-        for site in vlans_by_site:
-            site_id = Site.objects.get(name=site)
-            nb_devices_in_site = Device.objects.filter(
-                site=site_id, 
-                device_role__in=device_role, 
-                status=STATUS_ACTIVE,
+        routers = load_inventory(ROUTERS_ROLE_SLUG, STATUS_ACTIVE, sites=list(vlans_by_site), with_interfaces=False)
+
+        # опросим по SNMP все коммутаторы и маршрутизаторы одновременно:
+        # с коммутатора - названия интерфейсов и их индексы (если они не взяты из кэша), затем для каждого влана
+        # (community@vlan) bridge ports и таблицу MAC адресов;
+        # с коммутаторов платформ из qbridge_platforms таблицу MAC всех вланов одним проходом по Q-BRIDGE-MIB,
+        # с маршрутизатора - ARP-таблицу.
+        # Вланы всех устройств опрашиваются параллельно, результат обрабатываем по мере получения
+
+        # таблицы MAC обрабатываем по мере получения: MAC адреса коммутатора копятся, только пока он опрашивается
+        # (до его статистики SNMP), затем сопоставляются с ARP таблицами и пачками по MAC_BATCH_ROWS пишутся
+        # в базу, пока остальные устройства еще опрашиваются. Память растет с числом одновременно
+        # опрашиваемых коммутаторов и размером пачки, а не с размером всего парка.
+        # интерфейс -> [(VLAN, MAC числом)], сайт -> MAC -> [IP адреса числами]
+        port_mac_relation = defaultdict(list)
+        arp = defaultdict(lambda: defaultdict(list))
+        # bridge ports, полученные до таблиц MAC: (устройство, влан) -> (VLAN, bridge ports)
+        # и для Q-BRIDGE-MIB устройство -> (bridge ports, FDB id -> влан)
+        vlan_bridge_ports = {}
+        qbridge = {}
+
+        ifindex_cache = IfIndexCache(devices)
+        # недоступные на прошлых запусках устройства пропускаем до истечения паузы (их данные не удаляются),
+        # остальные опрашиваем с параметрами SNMP, подобранными по прошлым опросам
+        agent_profiles = AgentProfiles(list(devices) + list(routers))
+        down = [device_ip for device_ip in agent_profiles.keys if agent_profiles.is_down(device_ip)]
+        if down:
+            self.log_warning(message=f'Пропущено недоступных по SNMP устройств: {len(down)}')
+        switches = [
+            (
+                device_ip,
+                device.vlans,
+                device.device.platform.slug in QBRIDGE_PLATFORMS,
+                ifindex_cache.stamp(device_ip),
+                agent_profiles.params(device_ip),
             )
-            for nb_device in nb_devices_in_site:
-                if (nb_device.platform and 
-                            nb_device.platform.napalm_driver and 
-                            nb_device.platform.napalm_driver == 'cisco_iosxe' and 
-                            nb_device.primary_ip4):
-
-                    primary_ip = str(nb_device.primary_ip4).split('/')[0]
-                    routers_list.append(primary_ip)
-                    router = routers[primary_ip] = {}
-                    router['site'] = nb_device.site.name
-                    router['device'] = nb_device
-
-        arp = defaultdict(dict)
-        # получим ARP-таблицу с оборудования по SNMP
-        oid_list = ['.1.3.6.1.2.1.3.1.1.2']
-        results = asyncio.run(self.async_bulk_snmp(routers_list, oid_list, COMMUNITY, WORKERS))
-        self.log_info(message=f'Получена ARP таблица со всех маршрутизаторов')
-        for device_ip, device_result in results:
-            site = routers[device_ip]['site']
-            arp[site] = defaultdict(list)
-            if type(device_result) != dict:
-                self.log_warning(obj=routers[device_ip]['device'],message=f'не удалось получить информацию по SNMP')
-                continue
-            for oid, oid_result in device_result.items():
-                for index, index_result in oid_result.items():
-                    snmp_address = '.'.join(index.split('.')[-4:])
-                    snmp_mac = ''.join(["{0:x}".format(int(i)).zfill(2) for i in index_result]).upper()
-                    arp[site][snmp_mac].append(snmp_address)
+            for device_ip, device in devices.items()
+            if device_ip not in down
+        ]
+        routers_polled = [
+            (device_ip, agent_profiles.params(device_ip))
+            for device_ip in routers
+            if device_ip not in down
+        ]
+        for device_ip in down:
+            devices.pop(device_ip, None)
+        processes = process_count(PROCESSES, switches)
+        # устройства с ошибкой опроса удаляются из devices, а их статистика SNMP приходит последней
+        device_names = {device_ip: device.device.name for device_ip, device in [*devices.items(), *routers.items()]}
+
+        # загрузим одним запросом префиксы всех вланов для поиска IP адреса MAC-а по ARP таблице
+        prefix_index = PrefixIndex.from_vlans(nb_vlans)
+
+        self.metrics.phase('snmp')
+        # ARP таблицы нужны раньше таблиц MAC, поэтому маршрутизаторы опрашиваются отдельным конвейером
+        # (им хватает воркера на устройство), и его результаты принимаем первыми. Коммутаторы тем временем
+        # опрашиваются, пока их результаты не заполнят ограниченную очередь. Процессы опроса коммутаторов
+        # запускаются раньше потока опроса маршрутизаторов: процесс не стоит форкать с работающим потоком
+        router_workers = max(1, min(len(routers_polled), WORKERS // 2))
+        switch_workers = max(1, WORKERS - router_workers) if routers_polled else WORKERS
+        fdb_pipeline = start_pipeline(gather_mac_on_ports, [
+            (switches_part, [], COMMUNITY, workers)
+            for switches_part, workers in zip(split_evenly(switches, processes), split_workers(switch_workers, processes))
+        ])
+        arp_pipeline = start_pipeline(gather_mac_on_ports, [([], routers_polled, COMMUNITY, router_workers)])
+        for kind, device_ip, device_result in arp_pipeline:
+            if kind == 'stats':
+                agent_profiles.record(device_ip, device_result)
+                self.metrics.device(device_names[device_ip], device_result)
+
+            elif kind == 'arp':
+                site = routers[device_ip].device.site_id
+                if isinstance(device_result, Exception):
+                    self.log_warning(obj=routers[device_ip].device,message=f'не удалось получить информацию по SNMP')
+                    continue
+                # IP адрес и MAC храним целыми числами
+                for address, mac in device_result:
+                    arp[site][mac].append(address)
+        self.log_info(message=f'Получены ARP таблицы со всех маршрутизаторов')
 
         output = ''
-
-        ip_for_nslookup = []
-        for device in devices.values():
-            nb_device = device['device']
-            site = nb_device.site.name
-            output += f'device {nb_device} :'
-            mac_on_device = ip_on_device = name_on_device = 0
-            for intf in device['interfaces'].values():
-                if len(port_mac_relation[intf.id]) > 0:
-                    MAConPorts.objects.filter(interface=intf).delete()
-                for vlan_and_mac in port_mac_relation[intf.id]:
-                    mac_on_device += 1
-                    nb_prefixes = Prefix.objects.filter(vlan_id=vlan_and_mac['vlan'].id)
-                    addresses = arp[site].get(vlan_and_mac['mac'])
-                    address_with_prefix = ''
-                    if nb_prefixes and addresses:
-                        for nb_prefix in nb_prefixes:
-                            for address in addresses:
-                                if IPv4Address(address) in IPv4Network(str(nb_prefix)):
-                                    prefixlen = str(nb_prefix).split('/')[-1]
-                                    address_with_prefix = f'{address}/{prefixlen}'
-                                    break
-                            else:
-                                continue
-                            break
-                    if address_with_prefix:
-                        ip_on_device += 1
-                        nb_address, created = IPAddress.objects.get_or_create(
-                            address=address_with_prefix,
-                            vrf=nb_prefix.vrf,
-                            defaults={
-                                'status': STATUS_STATIC
-                            }
-                        )
-                        if created:
-                            self.log_success(obj=nb_address, message=f'Добавлен IP адрес')
-                            ip_for_nslookup.append(address_with_prefix)
-                        elif nb_address.status != STATUS_DHCP:
-                            ip_for_nslookup.append(address_with_prefix)
-                    else:
-                        nb_address = None
-                    mac, created = MAConPorts.objects.get_or_create(
-                        vlan=vlan_and_mac['vlan'],
-                        mac=vlan_and_mac['mac'],
-                        defaults={
-                            'interface': intf,
-                            'device': nb_device,
-                            'ipaddress': nb_address,
-                        }
-                    )
-                    if not created:
-                        updated = False
-                        if nb_address and mac.ipaddress != nb_address:
-                            self.log_info(obj=nb_address, message=f'Устройство с MAC {mac.mac} поменяло IP {mac.ipaddress} -> {nb_address}')
-                            mac.ipaddress = nb_address
-                            updated = True
-                        if mac.interface != intf:
-                            self.log_info(obj=intf, message=f'MAC {mac.mac} переехал с порта "{mac.interface}"')
-                            mac.interface = intf
-                            mac.device = nb_device
-                            updated = True
-                        if updated:
-                            mac.save()
-
-            output += f" MAC count - {mac_on_device}, IP count - {ip_on_device}\n"
-
-        self.log_info(message=f'Определим имена хостов по IP адресам')
-        resolver = aiodns.DNSResolver(loop=loop)
-
-        async def nslookup(ip):
-            results = {}
-            try:
-                reply = await resolver.gethostbyaddr(ip.split('/')[0])
-                return (ip, reply)
-            except Exception as error:
-                return (ip, error)
-            return (ip, None)
-
-        async def nslookup_with_semaphore(semaphore, function, *args, **kwargs):
-            async with semaphore:
-                return await function(*args, **kwargs)
-
-        async def async_nslookup(addresses, workers):
-            semaphore = asyncio.Semaphore(workers)
-            coroutines = [
-                nslookup_with_semaphore(semaphore, nslookup, address)
-                for address in addresses
-            ]
-            result = []
-            for future in asyncio.as_completed(coroutines):
-                result.append(await future)
-            return result
-
-        names = loop.run_until_complete(async_nslookup(ip_for_nslookup, WORKERS))
+        self.now = timezone.now()
+        self.status_static = STATUS_STATIC
+        self.status_dhcp = STATUS_DHCP
+        self.history_gap = HISTORY_GAP
+        # известные и созданные IP адреса: (vrf_id, хост) -> IPAddress
+        self.nb_addresses = {}
+        # IP адреса для определения имени: хост -> объекты IPAddress (в разных VRF)
+        self.ip_for_nslookup = defaultdict(list)
+        self.ip_writer = BulkWriter(IPAddress, [])
+        # MAC адрес, только что добавленный приемником трапов, не ломает запись: его строку job обновит в следующий раз
+        self.mac_writer = BulkWriter(
+            MAConPorts, ['interface', 'device', 'ipaddress', 'updated'], touch_values={'updated': self.now}, ignore_conflicts=True,
+        )
+        self.history_writer = BulkWriter(MACHistory, [], touch_values={'last_seen': self.now})
+
+        # MAC адреса опрошенных коммутаторов, ждущие записи:
+        # (vlan_id, MAC числом) -> (интерфейс, устройство, VLAN, (vrf_id, IP адрес))
+        mac_on_ports = {}
+        polled = []
+        pending = set(devices)
+        for kind, device_ip, device_result in fdb_pipeline:
+            if kind == 'stats':
+                agent_profiles.record(device_ip, device_result)
+                self.metrics.device(device_names[device_ip], device_result)
+                # все таблицы коммутатора получены: сопоставим его MAC адреса с ARP и, набрав пачку, запишем
+                pending.discard(device_ip)
+                if device_ip not in devices:
+                    continue
+                self.metrics.phase('match')
+                output += self.match_device(devices[device_ip], port_mac_relation, arp, prefix_index, mac_on_ports)
+                polled.append(devices[device_ip])
+                for vlan in devices[device_ip].vlans:
+                    vlan_bridge_ports.pop((device_ip, vlan), None)
+                qbridge.pop(device_ip, None)
+                if len(mac_on_ports) >= MAC_BATCH_ROWS:
+                    self.metrics.phase('db_write')
+                    self.write_macs(mac_on_ports, polled)
+                    mac_on_ports = {}
+                    polled = []
+                self.metrics.phase('snmp')
+
+            elif kind == 'ifnames':
+                if isinstance(device_result, Exception):
+                    self.log_warning(obj=devices[device_ip].device,message=f'не удалось получить информацию по SNMP')
+                    del devices[device_ip]
+                    continue
+                stamp, ifnames = device_result
+                ifindex_cache.resolve(device_ip, stamp, ifnames)
+
+            elif kind == 'bridge':
+                vlan, bridge_ports_result = device_result
+                device = devices[device_ip]
+                vlan_bridge_ports[(device_ip, vlan)] = (
+                    vlan_map[(device.device.site_id, vlan)],
+                    self.bridge_ports(device, bridge_ports_result, cabled_interfaces),
+                )
+
+            elif kind == 'fdb':
+                vlan, device_result = device_result
+                if isinstance(device_result, Exception):
+                    # скорее всего, такого VLAN нет на этом устройстве; если же обрыв случился
+                    # посреди таблицы MAC, уже полученную часть отбрасываем
+                    if (device_ip, vlan) in vlan_bridge_ports:
+                        nb_vlan, bridge_ports = vlan_bridge_ports.pop((device_ip, vlan))
+                        self.drop_macs(port_mac_relation, bridge_ports, lambda vlan_and_mac: vlan_and_mac[0] is nb_vlan)
+                    continue
+                nb_vlan, bridge_ports = vlan_bridge_ports[(device_ip, vlan)]
+                for mac, bridge_port in device_result:
+                    if bridge_port in bridge_ports:
+                        port_mac_relation[bridge_ports[bridge_port].id].append((nb_vlan, mac))
+
+            elif kind == 'qbridge':
+                bridge_ports_result, fdb_ids_result = device_result
+                device = devices[device_ip]
+                # FDB id -> VLAN; если коммутатор не отдает dot1qVlanFdbId, FDB id совпадает с номером влана
+                qbridge[device_ip] = (
+                    self.bridge_ports(device, bridge_ports_result, cabled_interfaces),
+                    {fdb_id: int(index.rsplit('.', 1)[1]) for index, fdb_id in fdb_ids_result.items()},
+                )
+
+            elif kind == 'qfdb':
+                if isinstance(device_result, Exception):
+                    self.log_warning(obj=devices[device_ip].device,message=f'не удалось получить таблицу MAC (Q-BRIDGE-MIB) по SNMP')
+                    if device_ip in qbridge:
+                        bridge_ports, fdb_vlans = qbridge.pop(device_ip)
+                        self.drop_macs(port_mac_relation, bridge_ports, lambda vlan_and_mac: True)
+                    continue
+                device = devices[device_ip]
+                site_id = device.device.site_id
+                flagged_vlans = set(device.vlans)
+                bridge_ports, fdb_vlans = qbridge[device_ip]
+                for fdb_id, mac, bridge_port in device_result:
+                    if bridge_port not in bridge_ports:
+                        continue
+                    vlan = fdb_vlans.get(fdb_id) or fdb_id
+                    if vlan in flagged_vlans:
+                        port_mac_relation[bridge_ports[bridge_port].id].append((vlan_map[(site_id, vlan)], mac))
+
+        ifindex_cache.save()
+        agent_profiles.save()
+        self.log_info(message=f'Получены таблицы MAC со всех коммутаторов')
+
+        # коммутаторы, чья статистика не пришла, и последняя неполная пачка
+        self.metrics.phase('match')
+        for device_ip in pending:
+            if device_ip in devices:
+                output += self.match_device(devices[device_ip], port_mac_relation, arp, prefix_index, mac_on_ports)
+                polled.append(devices[device_ip])
+        self.metrics.phase('db_write')
+        if polled:
+            self.write_macs(mac_on_ports, polled)
+        self.log_info(message=f'MAC адреса на портах: добавлено {self.mac_writer.created}, обновлено {self.mac_writer.updated}, удалено {self.mac_writer.deleted}')
+        self.log_info(message=f'История MAC адресов: открыто интервалов {self.history_writer.created}, продлено {self.history_writer.touched}')
+
+        # имена хостов определяем заново только для адресов, для которых в кэше нет ответа
+        # или у него истек TTL (отсутствие PTR тоже кэшируется)
+        ip_for_nslookup = self.ip_for_nslookup
+        ptr_cache = PtrCache(ip_for_nslookup)
+        ptr_pending = ptr_cache.pending()
+        ptr_pipeline = Pipeline(resolve_ptr, ptr_pending, WORKERS, maxsize=0).start()
+
+        self.metrics.phase('dns')
+        # применим имена хостов: из DNS и из кэша, измененные dns_name запишем одним bulk_update
+        for address, name, ttl in ptr_pipeline:
+            ptr_cache.set(address, name, ttl)
+        ptr_cache.save()
+        dns_writer = BulkWriter(IPAddress, ['dns_name'])
         resolved = 0
-        for name in names:
-            output += f" result of aiodns - {name}\n"
-            try:
-                hostname = name[1].name
-                nb_address = IPAddress.objects.get(address=name[0])
-                if hostname and nb_address.dns_name != hostname:
+        for address, nb_ip_addresses in ip_for_nslookup.items():
+            hostname = ptr_cache.get(address)
+            if not hostname:
+                continue
+            resolved += 1
+            for nb_address in nb_ip_addresses:
+                if nb_address.dns_name != hostname:
                     old_hostname = nb_address.dns_name
                     nb_address.dns_name = hostname
-                    nb_address.save()
+                    dns_writer.update(nb_address)
                     self.log_success(obj=nb_address, message=f'Обновлено DNS name "{old_hostname}" -> "{hostname}"')
-                resolved +=1
-            except:
-                pass
-        self.log_info(message=f'Определено адресов: {resolved} из {len(ip_for_nslookup)}')
+        dns_writer.flush()
+        output += f'DNS: запрошено {len(ptr_pending)}, взято из кэша {len(ip_for_nslookup) - len(ptr_pending)}\n'
+        self.log_info(message=f'Определено адресов: {resolved} из {len(ip_for_nslookup)}, обновлено DNS name: {dns_writer.updated}')
+        self.finish_metrics()
+
+        return output
+
+class MACHistoryCleanup(Job):
+
+    class Meta:
+        name = "Очистка истории MAC адресов"
+        hidden = True
+
+    def run(self, data, commit):
+        # запускать job могут только пользователи is_superuser
+        if not self.request.user.is_superuser:
+            self.log_info(message='Неавторизованный запуск')
+            return
+
+        PLUGIN_CFG = settings.PLUGINS_CONFIG['nautobot_porthistory_plugin']
+        RETENTION_DAYS = PLUGIN_CFG.get('history_retention_days', 365)
+
+        # удаляем интервалы, закончившиеся раньше RETENTION_DAYS дней назад, пачками по BATCH_SIZE
+        # (выборка идет по индексу last_seen), чтобы не держать блокировку на всю таблицу
+        cutoff = timezone.now() - timedelta(days=RETENTION_DAYS)
+        deleted = 0
+        while True:
+            pks = list(MACHistory.objects.filter(last_seen__lt=cutoff).values_list('pk', flat=True)[:BATCH_SIZE])
+            if not pks:
+                break
+            MACHistory.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+        self.log_info(message=f'История MAC адресов: удалено интервалов старше {RETENTION_DAYS} дн. - {deleted}')
+
+class ShardedUpdate(Job):
+
+    class Meta:
+        name = "Параллельное обновление по БЮ"
+        hidden = True
+        # coordinator ждет свои шарды, поэтому его лимит больше лимита самих job
+        soft_time_limit = 3300
+        time_limit = 3600
+
+    job = ChoiceVar(
+        choices=(
+            ('unused_ports', 'Неподключенные интерфейсы'),
+            ('mac_on_ports', 'Подключенные устройства'),
+        ),
+        label='Job'
+    )
+
+    max_devices = IntegerVar(
+        label='Устройств в шарде',
+        description='Пусто - по шарду на каждый БЮ',
+        required=False,
+        min_value=1
+    )
+
+    def run(self, data, commit):
+        self.shards = []
+        # запускать job могут только пользователи is_superuser
+        if not self.request.user.is_superuser:
+            self.log_info(message='Неавторизованный запуск')
+            return
+
+        PLUGIN_CFG = settings.PLUGINS_CONFIG['nautobot_porthistory_plugin']
+        SWITCHES_ROLE_SLUG = PLUGIN_CFG['switches_role_slug']
+        MAX_DEVICES = data['max_devices'] or PLUGIN_CFG.get('shard_max_devices')
+        STATUS_ACTIVE = Status.objects.get(slug='active')
+
+        # MAC job опрашивает только сайты с отмеченными вланами
+        sites = None
+        if data['job'] == 'mac_on_ports':
+            sites = list(VLAN.objects.filter(
+                status=STATUS_ACTIVE, _custom_field_data={'flag-porthistory':True}
+            ).values_list('site_id', flat=True).distinct())
+        devices_by_site = count_devices_by_site(SWITCHES_ROLE_SLUG, STATUS_ACTIVE, sites=sites)
+        devices_by_site.pop(None, None)
+
+        self.job_class = UnusedPortsUpdate if data['job'] == 'unused_ports' else MAConPortsUpdate
+        self.shards = partition_sites(devices_by_site, MAX_DEVICES)
+        self.commit = commit
+        site_names = dict(Site.objects.filter(pk__in=list(devices_by_site)).values_list('pk', 'name'))
+        self.shard_names = [', '.join(site_names[site] for site in shard_sites) for shard_sites, _ in self.shards]
+        for (shard_sites, count), shard_name in zip(self.shards, self.shard_names):
+            if MAX_DEVICES and count > MAX_DEVICES:
+                self.log_warning(message=f'БЮ {shard_name}: устройств {count} больше {MAX_DEVICES}, выделен в отдельный шард')
+        self.log_info(message=f'{self.job_class.name}: устройств {sum(devices_by_site.values())}, шардов {len(self.shards)}')
+
+    def post_run(self):
+        # шарды запускаем после фиксации транзакции run(), иначе воркеры не увидят их JobResult
+        if not getattr(self, 'shards', None):
+            return
 
-        
+        job_results = [
+            launch_shard(self.job_class, shard_sites, self.request, self.commit)
+            for shard_sites, _ in self.shards
+        ]
+        self.log_info(message=f'Запущено шардов: {len(job_results)}')
+        job_results = wait_shards(job_results, self.Meta.soft_time_limit - 300)
+
+        # сводка: вывод шардов, их итоговые сообщения, предупреждения и ошибки
+        entries, levels = shard_logs(job_results)
+        output = ''
+        failed = 0
+        for job_result, shard_name in zip(job_results, self.shard_names):
+            if job_result.status != JobResultStatusChoices.STATUS_COMPLETED:
+                failed += 1
+                self.log_failure(message=f'Шард {shard_name}: {job_result.status}')
+            for entry in entries[job_result.pk]:
+                message = f'[{shard_name}] {entry.log_object}: {entry.message}' if entry.log_object else f'[{shard_name}] {entry.message}'
+                if entry.log_level == LogLevelChoices.LOG_FAILURE:
+                    self.log_failure(message=message)
+                elif entry.log_level == LogLevelChoices.LOG_WARNING:
+                    self.log_warning(message=message)
+                else:
+                    self.log_info(message=message)
+            shard_output = (job_result.data or {}).get('output', '').strip()
+            if shard_output:
+                output += f'=== {shard_name}\n{shard_output}\n'
+        counts = ', '.join(f'{level} {count}' for level, count in sorted(levels.items()))
+        self.log_info(message=f'Шардов завершено успешно: {len(job_results) - failed} из {len(job_results)}; записи журналов шардов: {counts}')
+        if failed:
+            self.job_result.set_status(JobResultStatusChoices.STATUS_FAILED)
         return output
 
-jobs = [UnusedPortsUpdate, MAConPortsUpdate]
\ No newline at end of file
+jobs = [UnusedPortsUpdate, MAConPortsUpdate, MACHistoryCleanup, ShardedUpdate]
\ No newline at end of file
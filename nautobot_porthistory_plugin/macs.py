@@ -0,0 +1,40 @@
+"""48-bit integer MAC addresses used by the collectors; text is produced only for database rows."""
+
+import re
+
+_SEPARATORS = re.compile(r'[\s:.-]')
+_MAC = re.compile('[0-9a-fA-F]{12}')
+
+
+def mac_from_oid(oid):
+    """MAC from the last six (decimal) components of an OID, e.g. an index of dot1dTpFdbPort."""
+    _, o1, o2, o3, o4, o5, o6 = oid.rsplit('.', 6)
+    return int(o1) << 40 | int(o2) << 32 | int(o3) << 24 | int(o4) << 16 | int(o5) << 8 | int(o6)
+
+
+def mac_from_bytes(value):
+    return int.from_bytes(value, 'big')
+
+
+def format_mac(mac):
+    """``0x000C2901020F`` -> ``'00:0C:29:01:02:0F'``, the format MAConPorts rows are stored in."""
+    text = f'{mac:012X}'
+    return f'{text[0:2]}:{text[2:4]}:{text[4:6]}:{text[6:8]}:{text[8:10]}:{text[10:12]}'
+
+
+def mac_fields(mac):
+    """Canonical text and the indexed search keys of a MAC, as model field values."""
+    key = f'{mac:012X}'
+    return {
+        'mac': format_mac(mac),
+        'mac_key': key,
+        'mac_key_reversed': key[::-1],
+    }
+
+
+def parse_mac(text):
+    """MAC as an integer from its text form in any common notation; ``ValueError`` if it is not a MAC."""
+    digits = _SEPARATORS.sub('', str(text))
+    if not _MAC.fullmatch(digits):
+        raise ValueError(f'Invalid MAC address: {text}')
+    return int(digits, 16)
@@ -0,0 +1,55 @@
+"""Trap receiver service: ``nautobot-server porthistory_traps``."""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from nautobot_porthistory_plugin.collector import Pipeline
+from nautobot_porthistory_plugin.trap_updates import TrapUpdater
+from nautobot_porthistory_plugin.traps import BATCH_SECONDS, TRAP_PORT, receive_traps
+
+
+class Command(BaseCommand):
+    help = 'Receive linkUp/linkDown and Cisco MAC-notification traps and apply them to MACs on ports and unused ports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', help='Address to listen on (default: trap_address of the plugin settings)')
+        parser.add_argument('--port', type=int, help='UDP port to listen on (default: trap_port of the plugin settings)')
+
+    def handle(self, *args, **options):
+        PLUGIN_CFG = settings.PLUGINS_CONFIG['nautobot_porthistory_plugin']
+        COMMUNITY = PLUGIN_CFG['snmp_community']
+        ADDRESS = options['address'] or PLUGIN_CFG.get('trap_address', '0.0.0.0')
+        PORT = options['port'] or PLUGIN_CFG.get('trap_port', TRAP_PORT)
+        # без явного списка принимаем трапы с community опроса
+        COMMUNITIES = PLUGIN_CFG.get('trap_communities') or [COMMUNITY]
+        BATCH = PLUGIN_CFG.get('trap_batch_seconds', BATCH_SECONDS)
+        HISTORY_GAP = timedelta(hours=PLUGIN_CFG.get('history_gap_hours', 24))
+
+        updater = TrapUpdater(PLUGIN_CFG['switches_role_slug'], HISTORY_GAP)
+        # прием и разбор трапов идет в фоне, в этом потоке только пачки событий применяются к базе
+        pipeline = Pipeline(receive_traps, ADDRESS, PORT, COMMUNITIES, COMMUNITY, BATCH)
+        self.stdout.write(f'Прием трапов на {ADDRESS}:{PORT}')
+        for events in pipeline:
+            # процесс работает долго: соединение с базой могло закрыться между пачками
+            close_old_connections()
+            try:
+                counts = updater.apply(events)
+            except Exception as error:
+                # пачка применяется в одной транзакции: база не изменилась, повторяем один раз на новом соединении
+                self.stderr.write(f'Не удалось применить пачку из {len(events)} событий, повтор: {error!r}')
+                close_old_connections()
+                try:
+                    counts = updater.apply(events)
+                except Exception as error:
+                    # эти изменения подберет следующий опрос MAC job
+                    self.stderr.write(f'Пачка из {len(events)} событий пропущена: {error!r}')
+                    continue
+            self.stdout.write(
+                f'Событий {len(events)}: MAC добавлено {counts["mac_created"]}, перемещено {counts["mac_updated"]}, '
+                f'удалено {counts["mac_deleted"]}; интервалов истории открыто {counts["history_created"]}, '
+                f'продлено {counts["history_extended"]}; неиспользуемых портов снято {counts["unused_deleted"]}; '
+                f'не найдено интерфейсов {counts["skipped"]}'
+            )
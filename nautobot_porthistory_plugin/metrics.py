@@ -0,0 +1,180 @@
+"""Performance reports of the porthistory jobs and their Prometheus metrics.
+
+A job run records the wall time and DB queries of its phases, the SNMP time of every kind of
+table and the SNMP statistics of every device. The report is attached to the JobResult and kept
+in the cache, where the generators of ``metrics`` (collected by the Nautobot /metrics endpoint
+of Nautobot 1.4+) read the latest report of every job and scope at scrape time.
+"""
+
+import time
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from prometheus_client.core import GaugeMetricFamily
+
+REPORT_KEY = 'nautobot_porthistory_plugin:metrics:{job}:{scope}'
+INDEX_KEY = 'nautobot_porthistory_plugin:metrics:index'
+# отчет запуска, который больше не повторялся, через неделю пропадает из метрик
+REPORT_TIMEOUT = 60 * 60 * 24 * 7
+
+
+class RunMetrics:
+    """Phases, DB queries and SNMP statistics of a job run.
+
+    ``phase(name)`` ends the current phase and starts the next one; queries of the job
+    connection are counted into the current phase until ``close()``.
+    """
+
+    def __init__(self, job, scope='all'):
+        self.job = job
+        self.scope = scope
+        self.started = time.monotonic()
+        self.phases = {}
+        self.snmp = {}
+        self.devices = {}
+        self.current = None
+        self.phase_started = None
+        connection.execute_wrappers.append(self)
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.current is not None:
+            self.phases[self.current]['queries'] += 1
+        return execute(sql, params, many, context)
+
+    def phase(self, name):
+        now = time.monotonic()
+        if self.current is not None:
+            self.phases[self.current]['seconds'] += now - self.phase_started
+        self.current = name
+        self.phase_started = now
+        self.phases.setdefault(name, {'seconds': 0.0, 'queries': 0})
+
+    def device(self, name, stats):
+        """Account SNMP ``stats`` of an agent (see ``collector.Agent.stats``) to the device ``name``."""
+        self.devices[name] = {
+            'latency': stats['rtt'] / stats['pdus'] if stats['pdus'] else None,
+            'seconds': stats['rtt'],
+            'pdus': stats['pdus'],
+            'varbinds': stats['varbinds'],
+            'timeouts': stats['timeouts'],
+            'failed': stats['failed'],
+        }
+        for phase, totals in stats.get('phases', {}).items():
+            snmp = self.snmp.setdefault(phase, {'seconds': 0.0, 'pdus': 0, 'varbinds': 0})
+            for key, value in totals.items():
+                snmp[key] += value
+
+    def close(self):
+        self.phase(None)
+        self.phases.pop(None, None)
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+
+    def report(self):
+        self.close()
+        return {
+            'job': self.job,
+            'scope': self.scope,
+            'finished': timezone.now().isoformat(),
+            'seconds': time.monotonic() - self.started,
+            'queries': sum(phase['queries'] for phase in self.phases.values()),
+            'phases': self.phases,
+            'snmp': self.snmp,
+            'devices': self.devices,
+        }
+
+    def save(self, report):
+        """Keep ``report`` as the latest one of the job and scope for the metrics endpoint."""
+        cache.set(REPORT_KEY.format(job=self.job, scope=self.scope), report, REPORT_TIMEOUT)
+        entry = (self.job, self.scope)
+        # индекс не атомарен: параллельные шарды перечитывают его, пока не увидят свою запись
+        for _ in range(3):
+            index = cache.get(INDEX_KEY) or []
+            if entry in index:
+                break
+            cache.set(INDEX_KEY, index + [entry], None)
+
+
+def latest_reports():
+    index = [tuple(entry) for entry in cache.get(INDEX_KEY) or []]
+    keys = {REPORT_KEY.format(job=job, scope=scope): (job, scope) for job, scope in index}
+    reports = cache.get_many(list(keys))
+    return [reports[key] for key in keys if key in reports]
+
+
+def metric_jobs():
+    """Duration, phases and SNMP time of the latest run of every job and scope."""
+    duration = GaugeMetricFamily(
+        'porthistory_job_duration_seconds', 'Duration of the latest job run', labels=['job', 'scope'],
+    )
+    finished = GaugeMetricFamily(
+        'porthistory_job_finished_timestamp_seconds', 'End of the latest job run', labels=['job', 'scope'],
+    )
+    phase_seconds = GaugeMetricFamily(
+        'porthistory_job_phase_seconds', 'Wall time of a phase of the latest job run', labels=['job', 'scope', 'phase'],
+    )
+    phase_queries = GaugeMetricFamily(
+        'porthistory_job_phase_db_queries', 'DB queries of a phase of the latest job run', labels=['job', 'scope', 'phase'],
+    )
+    snmp_seconds = GaugeMetricFamily(
+        'porthistory_job_snmp_seconds', 'Total SNMP request time of a kind of table', labels=['job', 'scope', 'phase'],
+    )
+    snmp_pdus = GaugeMetricFamily(
+        'porthistory_job_snmp_pdus', 'SNMP responses of a kind of table', labels=['job', 'scope', 'phase'],
+    )
+    snmp_varbinds = GaugeMetricFamily(
+        'porthistory_job_snmp_varbinds', 'SNMP varbinds of a kind of table', labels=['job', 'scope', 'phase'],
+    )
+    for report in latest_reports():
+        labels = [report['job'], report['scope']]
+        duration.add_metric(labels, report['seconds'])
+        finished.add_metric(labels, datetime.fromisoformat(report['finished']).timestamp())
+        for phase, totals in report['phases'].items():
+            phase_seconds.add_metric(labels + [phase], totals['seconds'])
+            phase_queries.add_metric(labels + [phase], totals['queries'])
+        for phase, totals in report['snmp'].items():
+            snmp_seconds.add_metric(labels + [phase], totals['seconds'])
+            snmp_pdus.add_metric(labels + [phase], totals['pdus'])
+            snmp_varbinds.add_metric(labels + [phase], totals['varbinds'])
+    yield from (duration, finished, phase_seconds, phase_queries, snmp_seconds, snmp_pdus, snmp_varbinds)
+
+
+def metric_devices():
+    """SNMP statistics of every device in the latest run of every job and scope.
+
+    A device polled by runs of several scopes (all sites and a single site) has a series per scope.
+    """
+    latency = GaugeMetricFamily(
+        'porthistory_device_snmp_latency_seconds', 'Mean SNMP response time', labels=['job', 'scope', 'device'],
+    )
+    seconds = GaugeMetricFamily(
+        'porthistory_device_snmp_seconds', 'Total SNMP request time', labels=['job', 'scope', 'device'],
+    )
+    pdus = GaugeMetricFamily(
+        'porthistory_device_snmp_pdus', 'SNMP responses', labels=['job', 'scope', 'device'],
+    )
+    varbinds = GaugeMetricFamily(
+        'porthistory_device_snmp_varbinds', 'SNMP varbinds', labels=['job', 'scope', 'device'],
+    )
+    timeouts = GaugeMetricFamily(
+        'porthistory_device_snmp_timeouts', 'SNMP requests that timed out', labels=['job', 'scope', 'device'],
+    )
+    failed = GaugeMetricFamily(
+        'porthistory_device_snmp_failed', 'Device did not answer', labels=['job', 'scope', 'device'],
+    )
+    for report in latest_reports():
+        for device, stats in report['devices'].items():
+            labels = [report['job'], report['scope'], device]
+            if stats['latency'] is not None:
+                latency.add_metric(labels, stats['latency'])
+            seconds.add_metric(labels, stats['seconds'])
+            pdus.add_metric(labels, stats['pdus'])
+            varbinds.add_metric(labels, stats['varbinds'])
+            timeouts.add_metric(labels, stats['timeouts'])
+            failed.add_metric(labels, int(stats['failed']))
+    yield from (latency, seconds, pdus, varbinds, timeouts, failed)
+
+
+metrics = [metric_jobs, metric_devices]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.13 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import nautobot.dcim.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nautobot_porthistory_plugin', '0002_maconports'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MACHistory',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('mac', nautobot.dcim.fields.MACAddressCharField()),
+                ('first_seen', models.DateTimeField()),
+                ('last_seen', models.DateTimeField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dcim.device')),
+                ('interface', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dcim.interface')),
+                ('ipaddress', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ipam.ipaddress')),
+                ('vlan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ipam.vlan')),
+            ],
+            options={
+                'verbose_name_plural': 'MAC history on switches ports',
+                'ordering': ['-last_seen'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='machistory',
+            index=models.Index(fields=['mac', 'last_seen'], name='porthistory_mac_last_seen'),
+        ),
+        migrations.AddIndex(
+            model_name='machistory',
+            index=models.Index(fields=['interface', 'last_seen'], name='porthistory_intf_last_seen'),
+        ),
+        migrations.AddIndex(
+            model_name='machistory',
+            index=models.Index(fields=['last_seen'], name='porthistory_last_seen'),
+        ),
+    ]
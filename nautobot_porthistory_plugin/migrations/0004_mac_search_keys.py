@@ -0,0 +1,71 @@
+# Generated by Django 3.1.13 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Count
+
+from nautobot_porthistory_plugin.macs import mac_fields, parse_mac
+
+BATCH_SIZE = 1000
+
+
+def canonicalize_macs(apps, schema_editor):
+    # приводим MAC к каноническому виду и заполняем ключи поиска
+    for model_name in ('MAConPorts', 'MACHistory'):
+        model = apps.get_model('nautobot_porthistory_plugin', model_name)
+        batch = []
+        for row in model.objects.only('pk', 'mac').iterator(chunk_size=BATCH_SIZE):
+            for name, value in mac_fields(parse_mac(row.mac)).items():
+                setattr(row, name, value)
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, ['mac', 'mac_key', 'mac_key_reversed'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ['mac', 'mac_key', 'mac_key_reversed'])
+
+
+def remove_duplicate_macs(apps, schema_editor):
+    # из дублей (vlan, mac) оставляем последнюю обновленную запись
+    MAConPorts = apps.get_model('nautobot_porthistory_plugin', 'MAConPorts')
+    duplicates = MAConPorts.objects.values('vlan_id', 'mac_key').annotate(count=Count('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        pks = list(MAConPorts.objects.filter(
+            vlan_id=duplicate['vlan_id'], mac_key=duplicate['mac_key'],
+        ).order_by('-updated').values_list('pk', flat=True))
+        MAConPorts.objects.filter(pk__in=pks[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nautobot_porthistory_plugin', '0003_machistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='maconports',
+            name='mac_key',
+            field=models.CharField(default='', editable=False, max_length=12),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='maconports',
+            name='mac_key_reversed',
+            field=models.CharField(default='', editable=False, max_length=12),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='machistory',
+            name='mac_key',
+            field=models.CharField(default='', editable=False, max_length=12),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='machistory',
+            name='mac_key_reversed',
+            field=models.CharField(default='', editable=False, max_length=12),
+            preserve_default=False,
+        ),
+        migrations.RunPython(canonicalize_macs, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_macs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.13 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nautobot_porthistory_plugin', '0004_mac_search_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='maconports',
+            name='mac_key',
+            field=models.CharField(db_index=True, editable=False, max_length=12),
+        ),
+        migrations.AlterField(
+            model_name='maconports',
+            name='mac_key_reversed',
+            field=models.CharField(db_index=True, editable=False, max_length=12),
+        ),
+        migrations.AlterField(
+            model_name='machistory',
+            name='mac_key',
+            field=models.CharField(db_index=True, editable=False, max_length=12),
+        ),
+        migrations.AlterField(
+            model_name='machistory',
+            name='mac_key_reversed',
+            field=models.CharField(db_index=True, editable=False, max_length=12),
+        ),
+        migrations.AddConstraint(
+            model_name='maconports',
+            constraint=models.UniqueConstraint(fields=('vlan', 'mac'), name='porthistory_unique_vlan_mac'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.13 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nautobot_porthistory_plugin', '0005_mac_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='maconports',
+            index=models.Index(fields=['updated', 'id'], name='porthistory_updated_id'),
+        ),
+    ]
@@ -5,6 +5,8 @@ from django.db import models
 from nautobot.core.models import BaseModel
 from nautobot.dcim.fields import MACAddressCharField
 
+from nautobot_porthistory_plugin.macs import mac_fields, parse_mac
+
 class UnusedPorts(BaseModel):
     # Дата/время последнего output на порту коммутатора 
 
@@ -19,11 +21,27 @@ class UnusedPorts(BaseModel):
     def __str__(self):
         return f'{self.interface.name} - {self.last_output}'
 
-class MAConPorts(BaseModel):
+class MACSearchModel(BaseModel):
+    # MAC в каноническом виде (00:0C:29:01:02:FF) и ключи поиска по нему: 12 hex-цифр в прямом
+    # и обратном порядке, чтобы поиск по началу (OUI) и по концу MAC шел по индексу
+
+    mac = MACAddressCharField(blank=False, verbose_name="MAC Address")
+    mac_key = models.CharField(max_length=12, db_index=True, editable=False)
+    mac_key_reversed = models.CharField(max_length=12, db_index=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # bulk_create/bulk_update save() не вызывают - там поля заполняются через mac_fields()
+        for name, value in mac_fields(parse_mac(self.mac)).items():
+            setattr(self, name, value)
+        super().save(*args, **kwargs)
+
+class MAConPorts(MACSearchModel):
     # MAC и IP на порту коммутатора 
 
     updated = models.DateTimeField(auto_now=True)
-    mac = MACAddressCharField(blank=False, verbose_name="MAC Address")
     vlan = models.ForeignKey(
         to="ipam.VLAN",
         on_delete=models.CASCADE,
@@ -52,3 +70,62 @@ class MAConPorts(BaseModel):
 
     class Meta:
         verbose_name_plural = 'MAC and IP on switches ports'
+        constraints = [
+            models.UniqueConstraint(fields=['vlan', 'mac'], name='porthistory_unique_vlan_mac'),
+        ]
+        indexes = [
+            models.Index(fields=['updated', 'id'], name='porthistory_updated_id'),
+        ]
+
+class MACHistoryQuerySet(models.QuerySet):
+
+    def seen_at(self, moment):
+        """Интервалы, в которые MAC был на порту в момент ``moment``."""
+        return self.filter(first_seen__lte=moment, last_seen__gte=moment)
+
+    def seen_between(self, start, end):
+        """Интервалы, пересекающиеся с периодом ``start`` - ``end``."""
+        return self.filter(first_seen__lte=end, last_seen__gte=start)
+
+class MACHistory(MACSearchModel):
+    # Интервал присутствия MAC (с IP) на порту коммутатора: каждый запуск сбора продлевает
+    # открытый интервал, при переезде MAC или смене IP начинается новый
+
+    vlan = models.ForeignKey(
+        to="ipam.VLAN",
+        on_delete=models.CASCADE,
+        blank=False,
+    )
+    ipaddress = models.ForeignKey(
+        to="ipam.IPAddress",
+        on_delete=models.SET_NULL,
+        default=None,
+        blank=True,
+        null=True,
+    )
+    interface = models.ForeignKey(
+        to="dcim.Interface",
+        on_delete=models.CASCADE,
+        blank=False,
+    )
+    device = models.ForeignKey(
+        to="dcim.Device",
+        on_delete=models.CASCADE,
+        blank=False,
+    )
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField()
+
+    objects = MACHistoryQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.mac} - {self.interface} ({self.first_seen} - {self.last_seen})'
+
+    class Meta:
+        verbose_name_plural = 'MAC history on switches ports'
+        ordering = ['-last_seen']
+        indexes = [
+            models.Index(fields=['mac', 'last_seen'], name='porthistory_mac_last_seen'),
+            models.Index(fields=['interface', 'last_seen'], name='porthistory_intf_last_seen'),
+            models.Index(fields=['last_seen'], name='porthistory_last_seen'),
+        ]
@@ -7,4 +7,8 @@ menu_items = (
         link = 'plugins:nautobot_porthistory_plugin:history',  # A reverse compatible link to follow.
         link_text = 'MAC and IP on switches ports',  # Text to display to user.
     ),
+    PluginMenuItem(
+        link = 'plugins:nautobot_porthistory_plugin:mac_history',
+        link_text = 'MAC history on switches ports',
+    ),
 )
@@ -0,0 +1,182 @@
+"""Keyset pagination and estimated row counts for listings of large plugin tables."""
+
+import re
+from datetime import datetime, timedelta, timezone
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django_tables2.rows import BoundRows
+
+from nautobot.utilities.paginator import EnhancedPaginator
+
+# ниже этого числа строк оценка из статистики БД не используется - точный COUNT(*) и так быстрый
+ESTIMATE_THRESHOLD = 100000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# направление, смещение страницы, позиция (микросекунды от EPOCH) и pk граничной строки
+CURSOR = re.compile(r'[ab]\d+_-?\d+_[0-9a-fA-F-]+')
+
+
+def estimate_count(queryset):
+    """Row count of the model table from the database statistics, or ``None`` when it is not available."""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'mysql':
+        sql = 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    if not row or not row[0] or row[0] < ESTIMATE_THRESHOLD:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(EnhancedPaginator):
+    """Paginator that takes the row count of an unfiltered listing from the database statistics."""
+
+    def __init__(self, object_list, per_page, queryset=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.queryset = queryset
+
+    @cached_property
+    def count(self):
+        if self.queryset is not None and not self.queryset.query.where:
+            estimated = estimate_count(self.queryset)
+            if estimated is not None:
+                return estimated
+        return super().count
+
+
+class KeysetPage:
+    """A page of a keyset listing with the interface of ``EnhancedPage`` used by the paginator template.
+
+    Page "numbers" are cursors: ``a`` (rows after) or ``b`` (rows before) followed by the offset of
+    the page, used only to show the row numbers, and the ordering key of the boundary row. They
+    travel in the usual page parameter, so the stock paginator template links to them.
+    """
+
+    def __init__(self, object_list, paginator, offset, has_previous, has_next, first, last):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = None
+        self.offset = offset
+        self._has_previous = has_previous
+        self._has_next = has_next
+        self.first = first
+        self.last = last
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    def previous_page_number(self):
+        return self.paginator.cursor('b', self.offset, self.first)
+
+    def next_page_number(self):
+        return self.paginator.cursor('a', self.offset + len(self), self.last)
+
+    def smart_pages(self):
+        return []
+
+    def start_index(self):
+        return self.offset + 1 if len(self) else 0
+
+    def end_index(self):
+        return self.offset + len(self)
+
+
+class KeysetPaginator(EstimatedCountPaginator):
+    """Paginate a queryset by ``ordering`` (a timestamp field, then pk), newest first, without OFFSET.
+
+    Every page is one indexed range query of ``per_page + 1`` rows, whatever its position.
+    """
+
+    def __init__(self, object_list, per_page, queryset, table, ordering='updated', **kwargs):
+        super().__init__(object_list, per_page, queryset=queryset, **kwargs)
+        self.table = table
+        self.ordering = ordering
+
+    def cursor(self, direction, offset, row):
+        position = (getattr(row, self.ordering) - EPOCH) // timedelta(microseconds=1)
+        return f'{direction}{max(offset, 0)}_{position}_{row.pk}'
+
+    @classmethod
+    def is_cursor(cls, page):
+        return isinstance(page, str) and CURSOR.fullmatch(page) is not None
+
+    def page(self, number):
+        queryset = self.queryset
+        ordering = self.ordering
+        direction, offset = None, 0
+        if self.is_cursor(number):
+            direction, offset, position, pk = number[0], *number[1:].split('_')
+            offset = int(offset)
+            value = EPOCH + timedelta(microseconds=int(position))
+            if direction == 'a':
+                queryset = queryset.filter(Q(**{f'{ordering}__lt': value}) | Q(**{ordering: value, 'pk__lt': pk}))
+            else:
+                queryset = queryset.filter(Q(**{f'{ordering}__gt': value}) | Q(**{ordering: value, 'pk__gt': pk}))
+                offset = max(offset - self.per_page, 0)
+        if direction == 'b':
+            rows = list(queryset.order_by(ordering, 'pk')[:self.per_page + 1])
+            more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_previous, has_next = more, True
+        else:
+            rows = list(queryset.order_by(f'-{ordering}', '-pk')[:self.per_page + 1])
+            more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous, has_next = direction is not None, more
+        if not has_previous:
+            offset = 0
+        return KeysetPage(
+            BoundRows(data=rows, table=self.table),
+            self,
+            offset,
+            has_previous,
+            has_next,
+            rows[0] if rows else None,
+            rows[-1] if rows else None,
+        )
+
+
+class KeysetPaginationMixin:
+    """Table mixin: keyset pages when the listing is not sorted by a column, estimated counts always.
+
+    Sorting by a column falls back to numbered (OFFSET) pages of ``EstimatedCountPaginator``.
+    ``RequestConfig`` passes on only integer page numbers, so a cursor is read from the page
+    parameter of the request the table is configured with.
+    """
+
+    keyset_ordering = 'updated'
+
+    def paginate(self, paginator_class=EnhancedPaginator, per_page=None, page=1, *args, **kwargs):
+        per_page = per_page or self._meta.per_page
+        request = getattr(self, 'request', None)
+        if request is not None and KeysetPaginator.is_cursor(request.GET.get(self.prefixed_page_field)):
+            page = request.GET[self.prefixed_page_field]
+        queryset = self.data.data
+        if not self.order_by and (str(page) == '1' or KeysetPaginator.is_cursor(page)):
+            self.paginator = KeysetPaginator(self.rows, per_page, queryset, self, self.keyset_ordering, **kwargs)
+        else:
+            self.paginator = EstimatedCountPaginator(self.rows, per_page, queryset=queryset, **kwargs)
+            if KeysetPaginator.is_cursor(page):
+                page = 1
+        self.page = self.paginator.page(page)
+        return self
@@ -0,0 +1,23 @@
+"""Cache of the device, interface and IP address panels, invalidated by the porthistory jobs."""
+
+from django.core.cache import cache
+
+PANEL_KEY = 'nautobot_porthistory_plugin:panel:{name}:{pk}'
+PANEL_TIMEOUT = 60 * 60 * 24
+
+
+def get_panel(name, pk, build):
+    """Return the cached panel ``name`` of the object ``pk``, building and caching it with ``build()`` on a miss."""
+    key = PANEL_KEY.format(name=name, pk=pk)
+    panel = cache.get(key)
+    if panel is None:
+        panel = build()
+        cache.set(key, panel, PANEL_TIMEOUT)
+    return panel
+
+
+def invalidate_panels(name, pks):
+    """Drop cached panels ``name`` of the objects ``pks`` after a job changed their rows."""
+    keys = [PANEL_KEY.format(name=name, pk=pk) for pk in pks]
+    for i in range(0, len(keys), 1000):
+        cache.delete_many(keys[i:i + 1000])
@@ -0,0 +1,56 @@
+"""VLAN to prefix index used to match ARP entries with IP addresses."""
+
+from collections import defaultdict
+from ipaddress import IPv4Address
+
+
+def format_ipv4(address):
+    return f'{address >> 24}.{address >> 16 & 255}.{address >> 8 & 255}.{address & 255}'
+
+
+class PrefixIndex:
+    """IPv4 prefixes of every VLAN stored as integer network/mask pairs.
+
+    Prefixes of a VLAN are sorted longest first, so the first match is the longest
+    prefix match. A lookup makes no database queries and creates no ipaddress objects.
+    """
+
+    __slots__ = ('prefixes',)
+
+    def __init__(self, prefixes):
+        """``prefixes`` is an iterable of ``(vlan_id, network, prefix_length, vrf_id)`` with an integer network."""
+        by_vlan = defaultdict(list)
+        for vlan_id, network, prefix_length, vrf_id in prefixes:
+            mask = (0xFFFFFFFF << (32 - prefix_length)) & 0xFFFFFFFF
+            by_vlan[vlan_id].append((network & mask, mask, prefix_length, vrf_id))
+        self.prefixes = {
+            vlan_id: tuple(sorted(vlan_prefixes, key=lambda prefix: -prefix[2]))
+            for vlan_id, vlan_prefixes in by_vlan.items()
+        }
+
+    @classmethod
+    def from_vlans(cls, vlans):
+        """Load IPv4 prefixes of ``vlans`` (queryset or list of VLAN ids) with one query."""
+        from nautobot.ipam.models import Prefix
+
+        prefixes = []
+        rows = Prefix.objects.filter(vlan__in=vlans).values_list('vlan_id', 'network', 'prefix_length', 'vrf_id')
+        for vlan_id, network, prefix_length, vrf_id in rows:
+            network = str(network)
+            if ':' not in network:
+                prefixes.append((vlan_id, int(IPv4Address(network)), prefix_length, vrf_id))
+        return cls(prefixes)
+
+    def __len__(self):
+        return sum(len(vlan_prefixes) for vlan_prefixes in self.prefixes.values())
+
+    def lookup(self, vlan_id, addresses):
+        """Return ``(address, prefix_length, vrf_id)`` for the first of ``addresses`` inside a prefix of the VLAN.
+
+        ``addresses`` are integer IPv4 addresses; ``None`` is returned when nothing matches.
+        """
+        for network, mask, prefix_length, vrf_id in self.prefixes.get(vlan_id, ()):
+            for address in addresses:
+                if address & mask == network:
+                    return (address, prefix_length, vrf_id)
+        return None
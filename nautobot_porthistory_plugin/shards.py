@@ -0,0 +1,84 @@
+"""Site-sharded fan-out of the collection jobs: partitioning, launching and merging shard runs."""
+
+import time
+from collections import Counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, Q
+from nautobot.extras.choices import JobResultStatusChoices, LogLevelChoices
+from nautobot.extras.jobs import run_job
+from nautobot.extras.models import Job as JobModel, JobLogEntry, JobResult
+
+# как часто coordinator проверяет состояние запущенных шардов, секунд
+POLL_INTERVAL = 10
+
+# из журналов шардов переносим итоговые сообщения (без объекта) и все предупреждения и ошибки
+MERGED_LEVELS = (LogLevelChoices.LOG_WARNING, LogLevelChoices.LOG_FAILURE)
+
+
+def partition_sites(devices_by_site, max_devices=None):
+    """Split sites into shards: lists of site ids with the total number of their devices.
+
+    Without ``max_devices`` every site is a shard of its own. Otherwise sites are packed
+    largest first into the first shard with room for them (first-fit decreasing), so that
+    a shard has at most ``max_devices`` devices; a larger site is never split and makes
+    a shard of its own.
+    """
+    sites = sorted(devices_by_site.items(), key=lambda item: (-item[1], str(item[0])))
+    if not max_devices:
+        return [([site], count) for site, count in sites]
+    shards = []
+    for site, count in sites:
+        for shard in shards:
+            if shard[1] + count <= max_devices:
+                shard[0].append(site)
+                shard[1] += count
+                break
+        else:
+            shards.append([[site], count])
+    return [(shard_sites, count) for shard_sites, count in shards]
+
+
+def launch_shard(job_class, sites, request, commit):
+    """Enqueue a run of ``job_class`` restricted to ``sites`` as a separate JobResult, like a run from the UI.
+
+    Must be called outside of the transaction of the running job (from ``post_run``),
+    otherwise the worker that picks up the shard does not see its JobResult yet.
+    """
+    job_model = JobModel.objects.get_for_class_path(job_class.class_path)
+    return JobResult.enqueue_job(
+        run_job,
+        job_model.class_path,
+        ContentType.objects.get(app_label='extras', model='job'),
+        request.user,
+        data={'site': None, 'sites': [str(site) for site in sites]},
+        request=request,
+        commit=commit,
+    )
+
+
+def wait_shards(job_results, timeout):
+    """Wait until all shard runs finish or ``timeout`` seconds pass; return the JobResults refreshed."""
+    pks = [job_result.pk for job_result in job_results]
+    deadline = time.monotonic() + timeout
+    while True:
+        job_results = list(JobResult.objects.filter(pk__in=pks))
+        running = [
+            job_result for job_result in job_results
+            if job_result.status not in JobResultStatusChoices.TERMINAL_STATE_CHOICES
+        ]
+        if not running or time.monotonic() >= deadline:
+            order = {pk: i for i, pk in enumerate(pks)}
+            return sorted(job_results, key=lambda job_result: order[job_result.pk])
+        time.sleep(POLL_INTERVAL)
+
+
+def shard_logs(job_results):
+    """Log entries of the shard runs worth repeating in the coordinator log and counts of all entries by level."""
+    entries = {job_result.pk: [] for job_result in job_results}
+    logs = JobLogEntry.objects.filter(job_result__in=list(entries))
+    levels = Counter(dict(logs.order_by().values_list('log_level').annotate(count=Count('id'))))
+    merged = logs.filter(Q(log_level__in=MERGED_LEVELS) | Q(log_object__isnull=True) | Q(log_object=''))
+    for entry in merged.order_by('created'):
+        entries[entry.job_result_id].append(entry)
+    return entries, levels
@@ -25,3 +25,9 @@ def create_custom_fields_for_porthistory(sender, apps, **kwargs):
         },
     )
     cf_for_interface.content_types.set([ContentType.objects.get_for_model(Interface)])
+
+def invalidate_cable_index(sender, **kwargs):
+    """Drop the cached index of cabled interfaces when a cable is saved or deleted."""
+    from nautobot_porthistory_plugin.topology import invalidate_cabled_interfaces
+
+    invalidate_cabled_interfaces()
@@ -3,8 +3,9 @@ from django_tables2.utils import A
 from nautobot.utilities.tables import BaseTable, ToggleColumn
 
 from nautobot_porthistory_plugin import models
+from nautobot_porthistory_plugin.pagination import KeysetPaginationMixin
 
-class PortHistoryTable(BaseTable):
+class PortHistoryTable(KeysetPaginationMixin, BaseTable):
     pk = ToggleColumn()
     device = tables.Column(linkify=True)
     interface = tables.LinkColumn(orderable=False)
@@ -24,3 +25,25 @@ class PortHistoryTable(BaseTable):
             'ipaddress',
             'updated',
         )
+
+class MACHistoryTable(BaseTable):
+    pk = ToggleColumn()
+    device = tables.Column(linkify=True)
+    interface = tables.LinkColumn(orderable=False)
+    vlan = tables.LinkColumn()
+    ipaddress = tables.Column(linkify=True, verbose_name="IPv4 Address")
+
+    class Meta(BaseTable.Meta):  # pylint: disable=too-few-public-methods
+        """Meta attributes."""
+
+        model = models.MACHistory
+        fields = (
+            'pk',
+            'device',
+            'interface',
+            'vlan',
+            'mac',
+            'ipaddress',
+            'first_seen',
+            'last_seen',
+        )
@@ -1,7 +1,10 @@
 from nautobot.extras.plugins import PluginTemplateExtension
 from django.conf import settings
+from django.utils import timezone
+from django.utils.safestring import mark_safe
 
 from .models import UnusedPorts, MAConPorts
+from .panels import get_panel
 
 
 
@@ -17,15 +20,19 @@ class DeviceUnusedPorts(PluginTemplateExtension):
         device = self.context['object']
 
         if device.device_role.slug in SWITCHES_ROLE_SLUG:
-            device_intefaces = device.interfaces.values_list("id", flat=True)
-            unused_ports = UnusedPorts.objects.filter(interface_id__in=device_intefaces)
+            # строки порта кэшируются до следующего изменения job-ом, одним запросом без загрузки моделей
+            unused_ports = get_panel('unused_ports', device.pk, lambda: list(
+                UnusedPorts.objects.filter(interface__device=device).values_list('interface__name', 'last_output', 'updated')
+            ))
             unused_ports_with_delta = []
-            for port in unused_ports:
+            # строки без изменений job не перезаписывает, поэтому простой порта считаем от текущего времени
+            now = timezone.now()
+            for interface_name, last_output, updated in unused_ports:
                 unused_ports_with_delta.append({
-                    'interface_name': port.interface.name,
-                    'last_output': port.last_output.strftime("%d.%m.%Y %H:%M"),
-                    'updated': port.updated.strftime("%d.%m.%Y %H:%M"),
-                    'delta': str(port.updated - port.last_output).split()[0]
+                    'interface_name': interface_name,
+                    'last_output': last_output.strftime("%d.%m.%Y %H:%M"),
+                    'updated': updated.strftime("%d.%m.%Y %H:%M"),
+                    'delta': str(now - last_output).split()[0]
                 })
             return self.render('unused_ports.html', extra_context={
                 'unused_ports': unused_ports_with_delta,
@@ -45,21 +52,26 @@ class MAConInterface(PluginTemplateExtension):
         interface = self.context['object']
 
         if interface.device.device_role.slug in SWITCHES_ROLE_SLUG:
-            nb_mac_on_ports = MAConPorts.objects.filter(interface=interface)
-            mac_on_ports = []
-            for mac in nb_mac_on_ports:
-                mac_on_ports.append({
-                    'mac': mac.mac,
-                    'vlan': mac.vlan,
-                    'ipaddress': mac.ipaddress,
-                    'updated': mac.updated.strftime("%d.%m.%Y %H:%M"),
-                })
-            return self.render('mac_on_port.html', extra_context={
-                'mac_on_ports': mac_on_ports,
-            })
+            return mark_safe(get_panel('mac_on_port', interface.pk, lambda: str(self.render_mac_on_port(interface))))
         else:
             return ''
 
+    def render_mac_on_port(self, interface):
+        nb_mac_on_ports = MAConPorts.objects.filter(interface=interface).select_related(
+            'vlan', 'ipaddress',
+        ).only('mac', 'updated', 'vlan', 'ipaddress')
+        mac_on_ports = []
+        for mac in nb_mac_on_ports:
+            mac_on_ports.append({
+                'mac': mac.mac,
+                'vlan': mac.vlan,
+                'ipaddress': mac.ipaddress,
+                'updated': mac.updated.strftime("%d.%m.%Y %H:%M"),
+            })
+        return self.render('mac_on_port.html', extra_context={
+            'mac_on_ports': mac_on_ports,
+        })
+
 class InterfaceWithIP(PluginTemplateExtension):
     """Template extension to display Interfaces on the right side of the page."""
 
@@ -70,7 +82,12 @@ class InterfaceWithIP(PluginTemplateExtension):
         SWITCHES_ROLE_SLUG = PLUGIN_CFG['switches_role_slug']
         ipaddress = self.context['object']
 
-        nb_ports_with_ipaddress = MAConPorts.objects.filter(ipaddress=ipaddress)
+        return mark_safe(get_panel('ports_with_ipaddress', ipaddress.pk, lambda: str(self.render_ports_with_ipaddress(ipaddress))))
+
+    def render_ports_with_ipaddress(self, ipaddress):
+        nb_ports_with_ipaddress = MAConPorts.objects.filter(ipaddress=ipaddress).select_related(
+            'vlan', 'interface__device',
+        ).only('mac', 'updated', 'vlan', 'interface__name', 'interface__label', 'interface__device')
         ports_with_ipaddress = []
         for mac in nb_ports_with_ipaddress:
             ports_with_ipaddress.append({
@@ -0,0 +1,416 @@
+"""Simulator of SNMPv2c agents of switches and routers for tests and benchmarks of the jobs.
+
+Every simulated agent listens on its own address (any ``127.0.0.0/8`` address works on Linux
+without configuration), so the collectors talk to it exactly as to a real device. Tables are
+synthetic and computed on request from a few parameters, never stored row by row: thousands
+of agents with large FDB and ARP tables take almost no memory.
+
+A switch serves sysUpTime, ifTableLastChange, snmpEngineTime, ifName and locIfLastOutput with
+the plain community, and dot1dBasePortIfIndex and dot1dTpFdbPort of a VLAN with
+``community@vlan``. A router serves atPhysAddress. Latency and loss of responses are
+configurable per agent. ``send_trap`` generates the traps a switch sends.
+"""
+
+import asyncio
+import multiprocessing
+import random
+import socket
+import threading
+import time
+from bisect import bisect_right
+
+from aiosnmp.asn1 import Number
+from aiosnmp.asn1_rust import Decoder
+from aiosnmp.message import SnmpMessage, SnmpV2Trap, SnmpVarbind, SnmpVersion
+
+from nautobot_porthistory_plugin.collector import (
+    OID_AT_PHYS_ADDRESS, OID_DOT1D_BASE_PORT_IFINDEX, OID_DOT1D_TP_FDB_PORT, OID_IF_NAME,
+    OID_IF_TABLE_LAST_CHANGE, OID_LOC_IF_LAST_OUTPUT, OID_SNMP_ENGINE_TIME, OID_SYS_UPTIME,
+)
+
+GET_REQUEST = 0
+GET_NEXT_REQUEST = 1
+GET_BULK_REQUEST = 5
+
+# responses larger than this are truncated (GETBULK) like by an agent with a small buffer
+MAX_RESPONSE = 8192
+
+IDLE_OUTPUT_MS = 20 * 24 * 60 * 60 * 1000
+ACTIVE_OUTPUT_MS = 1000
+
+
+# BER encoding of the few types the agents answer with
+
+def _length(length):
+    if length < 0x80:
+        return bytes((length,))
+    octets = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((0x80 | len(octets),)) + octets
+
+
+def _tlv(tag, content):
+    return bytes((tag,)) + _length(len(content)) + content
+
+
+def _subids(subids):
+    content = bytearray()
+    for subid in subids:
+        chunk = [subid & 0x7F]
+        subid >>= 7
+        while subid:
+            chunk.append(0x80 | subid & 0x7F)
+            subid >>= 7
+        content.extend(reversed(chunk))
+    return bytes(content)
+
+
+def oid_content(oid):
+    return _subids((oid[0] * 40 + oid[1],) + tuple(oid[2:]))
+
+
+def integer(value, tag=0x02):
+    return _tlv(tag, value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True))
+
+
+def timeticks(value):
+    return integer(value, 0x43)
+
+
+def octets(value):
+    return _tlv(0x04, value.encode() if isinstance(value, str) else value)
+
+
+NO_SUCH_OBJECT = b'\x80\x00'
+END_OF_MIB_VIEW = b'\x82\x00'
+
+
+def parse_oid(oid):
+    return tuple(int(subid) for subid in oid.strip('.').split('.'))
+
+
+def sim_mac(device, vlan_index, i):
+    """MAC of the ``i``-th FDB entry of VLAN number ``vlan_index`` of simulated switch ``device``."""
+    return 0x02 << 40 | device << 20 | vlan_index << 16 | i
+
+
+def mac_octets(mac):
+    return tuple(mac.to_bytes(6, 'big'))
+
+
+class Table:
+    """Rows ``base.index(i) = value(i)`` for ``i`` in ``range(length)``, sorted by index."""
+
+    __slots__ = ('base', 'content', 'length', 'index', 'value')
+
+    def __init__(self, base, length, index, value):
+        self.base = parse_oid(base)
+        self.content = oid_content(self.base)
+        self.length = length
+        self.index = index
+        self.value = value
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return self.index(i)
+
+    def oid(self, i):
+        return _tlv(0x06, self.content + _subids(self.index(i)))
+
+    def find(self, suffix):
+        i = bisect_right(self, suffix) - 1
+        return i if i >= 0 and self.index(i) == suffix else None
+
+    def after(self, suffix):
+        i = bisect_right(self, suffix)
+        return i if i < self.length else None
+
+
+def scalar(oid, value):
+    base = parse_oid(oid)
+    return Table('.'.join(map(str, base[:-1])), 1, lambda i: base[-1:], lambda i: value())
+
+
+class Agent:
+    """An SNMP agent: ``contexts`` maps communities to lists of tables sorted by their base OID."""
+
+    def __init__(self, address, contexts, latency=0.0, loss=0.0, seed=0):
+        self.address = address
+        self.contexts = {
+            community: sorted(tables, key=lambda table: table.base) for community, tables in contexts.items()
+        }
+        self.latency = latency
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    def get(self, tables, oid):
+        for table in tables:
+            length = len(table.base)
+            if oid[:length] == table.base:
+                i = table.find(oid[length:])
+                if i is not None:
+                    return table.oid(i), table.value(i)
+        return _tlv(0x06, oid_content(oid)), NO_SUCH_OBJECT
+
+    def next(self, tables, oid):
+        for table in tables:
+            length = len(table.base)
+            head = oid[:length]
+            if head < table.base:
+                i = 0 if table.length else None
+            elif head == table.base:
+                i = table.after(oid[length:])
+            else:
+                continue
+            if i is not None:
+                return table.base + table.index(i), table.oid(i), table.value(i)
+        return None
+
+    def respond(self, data):
+        """Response to the request datagram ``data``, or ``None`` when it is not answered."""
+        decoder = Decoder(data)
+        decoder.enter()
+        _, version = decoder.read()
+        _, community = decoder.read()
+        tables = self.contexts.get(community.decode())
+        if tables is None:
+            return None
+        pdu_type = decoder.peek().number
+        decoder.enter()
+        _, request_id = decoder.read()
+        _, non_repeaters = decoder.read()
+        _, max_repetitions = decoder.read()
+        oids = []
+        decoder.enter()
+        while not decoder.eof():
+            decoder.enter()
+            _, oid = decoder.read()
+            decoder.read()
+            decoder.exit()
+            oids.append(parse_oid(oid))
+        self.requests += 1
+
+        varbinds = []
+        size = 0
+        if pdu_type == GET_REQUEST:
+            varbinds = [self.get(tables, oid) for oid in oids]
+        elif pdu_type in (GET_NEXT_REQUEST, GET_BULK_REQUEST):
+            repetitions = max_repetitions if pdu_type == GET_BULK_REQUEST else 1
+            for oid in oids:
+                for _ in range(max(repetitions, 1)):
+                    row = self.next(tables, oid)
+                    if row is None:
+                        varbinds.append((_tlv(0x06, oid_content(oid)), END_OF_MIB_VIEW))
+                        break
+                    oid, name, value = row
+                    size += len(name) + len(value) + 4
+                    if size > MAX_RESPONSE and varbinds:
+                        break
+                    varbinds.append((name, value))
+        else:
+            return None
+
+        varbind_list = b''.join(_tlv(0x30, name + value) for name, value in varbinds)
+        pdu = _tlv(0xA2, integer(request_id) + integer(0) + integer(0) + _tlv(0x30, varbind_list))
+        return _tlv(0x30, integer(version) + octets(community) + pdu)
+
+
+class _AgentProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        agent = self.agent
+        if agent.loss and agent.random.random() < agent.loss:
+            return
+        try:
+            response = agent.respond(data)
+        except Exception:
+            return
+        if response is None:
+            return
+        if agent.latency:
+            asyncio.get_running_loop().call_later(agent.latency, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+
+class Simulator:
+    """Serve ``agents`` on ``port`` from a background event loop; use as a context manager."""
+
+    def __init__(self, agents, port):
+        self.agents = agents
+        self.port = port
+        self.loop = None
+        self.transports = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.ready = threading.Event()
+        self.error = None
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            for agent in self.agents:
+                transport, _ = self.loop.run_until_complete(self.loop.create_datagram_endpoint(
+                    lambda agent=agent: _AgentProtocol(agent),
+                    local_addr=(agent.address, self.port),
+                ))
+                self.transports.append(transport)
+        except Exception as error:
+            self.error = error
+        self.ready.set()
+        if self.error is None:
+            self.loop.run_forever()
+        for transport in self.transports:
+            transport.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+        return self
+
+    def stop(self):
+        if self.loop is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def requests(self):
+        return sum(agent.requests for agent in self.agents)
+
+
+def _serve(agents, port, status):
+    simulator = Simulator(agents, port)
+    try:
+        simulator.start()
+    except Exception as error:
+        status.put(repr(error))
+        return
+    status.put(None)
+    simulator.thread.join()
+
+
+class SimulatorProcess:
+    """``Simulator`` in a forked process, so that a benchmark does not pay for the agents' CPU time."""
+
+    def __init__(self, agents, port):
+        context = multiprocessing.get_context('fork')
+        self.status = context.Queue()
+        self.process = context.Process(target=_serve, args=(agents, port, self.status), daemon=True)
+
+    def start(self):
+        self.process.start()
+        error = self.status.get()
+        if error is not None:
+            self.process.join()
+            raise RuntimeError(f'simulator did not start: {error}')
+        return self
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def switch(address, community, number, interfaces=48, vlans=(), fdb_size=0, idle_every=4, uptime=100 * 86400, **kwargs):
+    """A simulated access switch.
+
+    Ports ``1..interfaces`` are ``GigabitEthernet1/0/<n>`` with ifIndex and bridge port ``n``;
+    every ``idle_every``-th port has had no output for 20 days. Every VLAN of ``vlans`` has
+    ``fdb_size`` MACs ``sim_mac(number, <position of the VLAN>, i)`` spread over the ports.
+    """
+    booted = time.time() - uptime
+    ports = lambda i: (i + 1,)
+    contexts = {
+        community: [
+            scalar(OID_SYS_UPTIME, lambda: timeticks(int((time.time() - booted) * 100))),
+            scalar(OID_IF_TABLE_LAST_CHANGE, lambda: timeticks(100)),
+            scalar(f'{OID_SNMP_ENGINE_TIME}.0', lambda: integer(int(time.time() - booted))),
+            Table(OID_IF_NAME, interfaces, ports, lambda i: octets(f'GigabitEthernet1/0/{i + 1}')),
+            Table(
+                OID_LOC_IF_LAST_OUTPUT, interfaces, ports,
+                lambda i: integer(IDLE_OUTPUT_MS if (i + 1) % idle_every == 0 else ACTIVE_OUTPUT_MS),
+            ),
+        ],
+    }
+    for vlan_index, vlan in enumerate(vlans):
+        first = sim_mac(number, vlan_index, 0)
+        contexts[f'{community}@{vlan}'] = [
+            Table(OID_DOT1D_BASE_PORT_IFINDEX, interfaces, ports, lambda i: integer(i + 1)),
+            Table(
+                OID_DOT1D_TP_FDB_PORT, fdb_size,
+                lambda i, first=first: mac_octets(first + i),
+                lambda i: integer(i % interfaces + 1),
+            ),
+        ]
+    return Agent(address, contexts, **kwargs)
+
+
+def router(address, community, arp=(), **kwargs):
+    """A simulated router with ARP entries ``arp``: ``(first IP, first MAC, count)`` ranges sorted by IP."""
+    starts = []
+    total = 0
+    for ip, mac, count in arp:
+        starts.append(total)
+        total += count
+
+    def entry(i):
+        n = bisect_right(starts, i) - 1
+        ip, mac, count = arp[n]
+        return ip + i - starts[n], mac + i - starts[n]
+
+    contexts = {
+        community: [
+            Table(
+                OID_AT_PHYS_ADDRESS, total,
+                lambda i: (1, 1) + tuple(entry(i)[0].to_bytes(4, 'big')),
+                lambda i: octets(entry(i)[1].to_bytes(6, 'big')),
+            ),
+        ],
+    }
+    return Agent(address, contexts, **kwargs)
+
+
+def send_trap(address, port, community, trap_oid, varbinds=(), uptime=100 * 8640000, source=None):
+    """Send an SNMPv2c trap ``trap_oid`` with ``(oid, value)`` varbinds from ``source``."""
+    message = SnmpMessage(SnmpVersion.v2c, community, SnmpV2Trap([
+        SnmpVarbind('.1.3.6.1.2.1.1.3.0', uptime, Number.TimeTicks),
+        SnmpVarbind('.1.3.6.1.6.3.1.1.4.1.0', trap_oid.lstrip('.'), Number.ObjectIdentifier),
+        *(SnmpVarbind(oid, value) for oid, value in varbinds),
+    ]))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        if source is not None:
+            sock.bind((source, 0))
+        sock.sendto(message.encode(), (address, port))
+
+
+def mac_changed_msg(changes):
+    """cmnHistMacChangedMsg of ``(learnt, VLAN, MAC, bridge port)`` records."""
+    return b''.join(
+        bytes((1 if learnt else 2,)) + vlan.to_bytes(2, 'big') + mac.to_bytes(6, 'big') + port.to_bytes(2, 'big')
+        for learnt, vlan, mac, port in changes
+    ) + b'\x00'
@@ -0,0 +1,86 @@
+import json
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from nautobot.dcim.models import Device, DeviceRole, DeviceType, Interface, Manufacturer, Site
+from nautobot.extras.models import Status
+from nautobot.ipam.models import VLAN, IPAddress
+from nautobot.users.models import ObjectPermission
+
+from nautobot_porthistory_plugin.macs import mac_fields
+from nautobot_porthistory_plugin.models import MAConPorts
+
+MAC = 0x000C290102FF
+
+
+class LookupAPITestCase(TestCase):
+
+    def setUp(self):
+        active = Status.objects.get(slug='active')
+        manufacturer = Manufacturer.objects.create(name='Lookup', slug='lookup')
+        device_type = DeviceType.objects.create(manufacturer=manufacturer, model='Lookup switch', slug='lookup-switch')
+        role = DeviceRole.objects.create(name='Lookup switch', slug='lookup-switch')
+        site = Site.objects.create(name='Lookup', slug='lookup', status=active)
+        device = Device.objects.create(
+            name=f'lookup-{uuid.uuid4().hex[:8]}', device_type=device_type, device_role=role, site=site, status=active,
+        )
+        interface = Interface.objects.create(device=device, name='GigabitEthernet1/0/1', type='1000base-t')
+        vlan = VLAN.objects.create(site=site, vid=10, name='lookup-10', status=active)
+        self.ipaddress = IPAddress.objects.create(address='10.0.0.1/24', dns_name='PC-1.Example.com', status=active)
+        self.row = MAConPorts.objects.create(
+            vlan=vlan, **mac_fields(MAC), interface=interface, device=device, ipaddress=self.ipaddress,
+        )
+        self.url = reverse('plugins-api:nautobot_porthistory_plugin-api:lookup')
+        self.client = APIClient()
+
+    def login(self, *models, superuser=False):
+        user = get_user_model().objects.create_user(username=f'lookup-{uuid.uuid4().hex[:8]}', is_superuser=superuser)
+        if models:
+            permission = ObjectPermission.objects.create(name=f'lookup-{uuid.uuid4().hex[:8]}', actions=['view'])
+            permission.object_types.set([ContentType.objects.get_for_model(model) for model in models])
+            permission.users.add(user)
+        self.client.force_authenticate(user)
+
+    def lookup(self, **data):
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_lookup(self):
+        self.login(superuser=True)
+        [row] = self.lookup(macs=['000c.2901.02ff'])
+        self.assertEqual((row['match'], row['query'], row['id']), ('mac', '000c.2901.02ff', str(self.row.pk)))
+        self.assertEqual(row['ipaddress']['address'], '10.0.0.1/24')
+        [row] = self.lookup(ips=['10.0.0.1'])
+        self.assertEqual((row['match'], row['query']), ('ip', '10.0.0.1'))
+        # DNS имя ищется без учета регистра
+        [row] = self.lookup(hostnames=['pc-1.EXAMPLE.com.'])
+        self.assertEqual((row['match'], row['query']), ('hostname', 'pc-1.EXAMPLE.com.'))
+        # строка, найденная по нескольким признакам, выдается один раз
+        self.assertEqual(len(self.lookup(macs=['00:0C:29:01:02:FF'], ips=['10.0.0.1/32'])), 1)
+
+    def test_ipaddress_permission(self):
+        # без права на IP адреса по ним не ищем и не показываем их в строках
+        self.login(MAConPorts)
+        [row] = self.lookup(macs=['00:0C:29:01:02:FF'])
+        self.assertIsNone(row['ipaddress'])
+        self.assertEqual(self.lookup(ips=['10.0.0.1'], hostnames=['pc-1.example.com']), [])
+
+        self.login(MAConPorts, IPAddress)
+        [row] = self.lookup(ips=['10.0.0.1'])
+        self.assertEqual(row['ipaddress']['dns_name'], 'PC-1.Example.com')
+
+    def test_permission_required(self):
+        self.login(IPAddress)
+        response = self.client.post(self.url, {'macs': ['00:0C:29:01:02:FF']}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_validation(self):
+        self.login(superuser=True)
+        response = self.client.post(self.url, {'macs': ['not a mac']}, format='json')
+        self.assertEqual(response.status_code, 400)
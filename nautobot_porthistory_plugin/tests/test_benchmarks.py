@@ -0,0 +1,327 @@
+import asyncio
+import json
+import os
+import resource
+import time
+import tracemalloc
+import uuid
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from nautobot.dcim.models import Device, DeviceRole, DeviceType, Interface, Manufacturer, Platform, Site
+from nautobot.extras.models import JobResult, Status
+from nautobot.ipam.models import VLAN, IPAddress, Prefix
+
+from nautobot_porthistory_plugin import collector
+from nautobot_porthistory_plugin.agents import CACHE_KEY as AGENT_KEY
+from nautobot_porthistory_plugin.collector import (
+    Pipeline, ProcessPipeline, gather_devices, gather_mac_on_ports, collect_unused_ports, split_evenly, start_pipeline,
+)
+from nautobot_porthistory_plugin.dns import NEGATIVE_TTL
+from nautobot_porthistory_plugin.inventory import NAPALM_DRIVER
+from nautobot_porthistory_plugin.jobs import MAConPortsUpdate, UnusedPortsUpdate
+from nautobot_porthistory_plugin.models import MAConPorts, UnusedPorts
+from nautobot_porthistory_plugin.tests.simulator import Simulator, SimulatorProcess, parse_oid, router, sim_mac, switch
+from nautobot_porthistory_plugin.transport import Transport
+
+SIMULATOR_PORT = int(os.environ.get('PORTHISTORY_SIMULATOR_PORT', 16161))
+COMMUNITY = 'bench'
+INTERFACES = 48
+VLANS = (10, 20)
+FDB_SIZE = 20
+DEVICES_PER_SITE = 50
+
+# бюджеты по умолчанию: время (с), пик памяти под tracemalloc (MiB), запросы к БД;
+# переопределяются JSON-ом в PORTHISTORY_BENCH_BUDGETS, например {"mac_on_ports:5000": {"seconds": 600}}
+BUDGETS = {
+    ('unused_ports', 10): {'seconds': 30, 'memory': 256, 'queries': 60},
+    ('unused_ports', 1000): {'seconds': 120, 'memory': 512, 'queries': 300},
+    ('unused_ports', 5000): {'seconds': 600, 'memory': 2048, 'queries': 1200},
+    ('mac_on_ports', 10): {'seconds': 60, 'memory': 256, 'queries': 150},
+    ('mac_on_ports', 1000): {'seconds': 300, 'memory': 1024, 'queries': 800},
+    ('mac_on_ports', 5000): {'seconds': 1200, 'memory': 4096, 'queries': 3500},
+}
+
+
+def budget(job, devices):
+    limits = dict(BUDGETS.get((job, devices), BUDGETS[(job, 10)]))
+    overrides = json.loads(os.environ.get('PORTHISTORY_BENCH_BUDGETS') or '{}')
+    limits.update(overrides.get(f'{job}:{devices}', {}))
+    return limits
+
+
+def bench_sizes():
+    return [int(size) for size in os.environ.get('PORTHISTORY_BENCH_DEVICES', '10').split(',')]
+
+
+def address(group, n):
+    return f'127.{group + n // 250}.{n % 250 + 1}.1'
+
+
+class SimulatorTestCase(SimpleTestCase):
+    """The collectors against simulated agents, without the database."""
+
+    def test_unused_ports(self):
+        agents = [switch(address(10, n), COMMUNITY, n) for n in range(3)]
+        with mock.patch.object(collector, 'SNMP_PORT', SIMULATOR_PORT), Simulator(agents, SIMULATOR_PORT):
+            results = list(Pipeline(gather_devices, collect_unused_ports, [agent.address for agent in agents], 10, COMMUNITY, {}, {}))
+        self.assertEqual(len(results), 3)
+        for device, result, stats in results:
+            self.assertIsInstance(result, dict)
+            stamp, ifnames = result[collector.OID_IF_NAME]
+            self.assertEqual(len(ifnames), INTERFACES)
+            self.assertEqual(len(result[collector.OID_LOC_IF_LAST_OUTPUT]), INTERFACES)
+            self.assertFalse(stats['failed'])
+
+    def test_mac_on_ports(self):
+        agents = [switch(address(10, n), COMMUNITY, n, vlans=VLANS, fdb_size=300) for n in range(2)]
+        agents.append(router(address(20, 0), COMMUNITY, arp=[(0x0A000001, sim_mac(0, 0, 0), 300)]))
+        switches = [(agent.address, VLANS, False, None, None) for agent in agents[:2]]
+        fdb = arp = 0
+        with mock.patch.object(collector, 'SNMP_PORT', SIMULATOR_PORT), Simulator(agents, SIMULATOR_PORT):
+            for kind, device, result in Pipeline(gather_mac_on_ports, switches, [(agents[2].address, None)], COMMUNITY, 10):
+                if kind == 'fdb':
+                    self.assertNotIsInstance(result[1], Exception)
+                    fdb += len(result[1])
+                elif kind == 'arp':
+                    self.assertNotIsInstance(result, Exception)
+                    arp += len(result)
+        self.assertEqual(fdb, 2 * len(VLANS) * 300)
+        self.assertEqual(arp, 300)
+
+    def test_loss(self):
+        # потерянные ответы повторяются по retries, опрос завершается без ошибок
+        agents = [switch(address(10, 0), COMMUNITY, 0, loss=0.2, seed=1)]
+        params = {agents[0].address: {'timeout': 0.2, 'retries': 10, 'max_repetitions': 10}}
+        with mock.patch.object(collector, 'SNMP_PORT', SIMULATOR_PORT), Simulator(agents, SIMULATOR_PORT):
+            [(device, result, stats)] = list(Pipeline(gather_devices, collect_unused_ports, [agents[0].address], 1, COMMUNITY, {}, params))
+        self.assertIsInstance(result, dict)
+        self.assertGreater(stats['rtt'] / stats['pdus'], 0)
+
+    def test_shared_socket(self):
+        # ответы всех агентов через один сокет достаются запросам своих агентов
+        agents = [switch(address(10, n), COMMUNITY, n, interfaces=n + 1) for n in range(50)]
+
+        async def walk_all():
+            async with Transport(sockets=1) as transport:
+                walks = [
+                    collector.Agent(agent.address, transport=transport).walk(
+                        transport.session(agent.address, SIMULATOR_PORT, COMMUNITY, 1, 3, 10), collector.OID_IF_NAME,
+                    )
+                    for agent in agents
+                ]
+                return await asyncio.gather(*walks)
+
+        with Simulator(agents, SIMULATOR_PORT):
+            results = asyncio.run(walk_all())
+        self.assertEqual([len(ifnames) for ifnames in results], [n + 1 for n in range(50)])
+
+    def test_process_pipeline(self):
+        # коммутаторы и маршрутизатор делятся между двумя процессами опроса
+        agents = [switch(address(10, n), COMMUNITY, n, vlans=VLANS, fdb_size=300) for n in range(4)]
+        agents.append(router(address(20, 0), COMMUNITY, arp=[(0x0A000001, sim_mac(0, 0, 0), 300)]))
+        switches = [(agent.address, VLANS, False, None, None) for agent in agents[:4]]
+        routers = [(agents[4].address, None)]
+        fdb = arp = 0
+        stats = set()
+        with mock.patch.object(collector, 'SNMP_PORT', SIMULATOR_PORT), Simulator(agents, SIMULATOR_PORT):
+            pipeline = start_pipeline(gather_mac_on_ports, [
+                (switches_part, routers_part, COMMUNITY, 5)
+                for switches_part, routers_part in zip(split_evenly(switches, 2), split_evenly(routers, 2))
+            ])
+            self.assertIsInstance(pipeline, ProcessPipeline)
+            for kind, device, result in pipeline:
+                if kind == 'fdb':
+                    self.assertNotIsInstance(result[1], Exception)
+                    fdb += len(result[1])
+                elif kind == 'arp':
+                    self.assertNotIsInstance(result, Exception)
+                    arp += len(result)
+                elif kind == 'stats':
+                    self.assertFalse(result['failed'])
+                    stats.add(device)
+        self.assertEqual(fdb, 4 * len(VLANS) * 300)
+        self.assertEqual(arp, 300)
+        self.assertEqual(stats, {agent.address for agent in agents})
+
+    def test_abandoned_pipeline(self):
+        # задание, бросившее итерацию, не оставляет за собой поток, цикл и сокеты
+        agents = [switch(address(10, n), COMMUNITY, n, vlans=VLANS, fdb_size=300) for n in range(10)]
+        switches = [(agent.address, VLANS, False, None, None) for agent in agents]
+        with mock.patch.object(collector, 'SNMP_PORT', SIMULATOR_PORT), Simulator(agents, SIMULATOR_PORT):
+            pipeline = Pipeline(gather_mac_on_ports, switches, [], COMMUNITY, 10, maxsize=1)
+            results = iter(pipeline)
+            next(results)
+            results.close()
+        self.assertFalse(pipeline.thread.is_alive())
+        self.assertTrue(pipeline.loop.is_closed())
+
+    def test_walk_does_not_loop(self):
+        # агент, который на любой GETBULK отвечает одной и той же строкой
+        agent = switch(address(10, 0), COMMUNITY, 0)
+        first = agent.next
+        agent.next = lambda tables, oid: first(tables, parse_oid(collector.OID_IF_NAME))
+
+        async def walk():
+            walker = collector.Agent(agent.address)
+            async with walker.session(COMMUNITY) as snmp:
+                return await asyncio.wait_for(walker.walk(snmp, collector.OID_IF_NAME), 10)
+
+        # обрыв опроса, а не неполная таблица: job оставит прежние строки устройства
+        with mock.patch.object(collector, 'SNMP_PORT', SIMULATOR_PORT), Simulator([agent], SIMULATOR_PORT):
+            with self.assertRaises(collector.WalkError):
+                asyncio.run(walk())
+
+
+async def no_ptr(emit, addresses, workers):
+    for address in addresses:
+        await emit((address, None, NEGATIVE_TTL))
+
+
+@skipUnless(os.environ.get('PORTHISTORY_BENCH'), 'benchmarks run with PORTHISTORY_BENCH=1')
+class JobBenchmark(TestCase):
+    """Both collection jobs end to end against a simulated fleet of PORTHISTORY_BENCH_DEVICES switches.
+
+    Sizes default to 10 devices; 1000 and 5000 are run with PORTHISTORY_BENCH_DEVICES=10,1000,5000.
+    Every run measures wall time, the peak of memory allocated during the job (traced with
+    tracemalloc, so it does not include forked polling processes and the time includes the
+    tracing overhead) and DB queries of the job, and fails when one of them exceeds its budget.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # по сокету на каждого агента симулятора
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        needed = max(bench_sizes()) * 2 + 1024
+        if soft != resource.RLIM_INFINITY and soft < needed:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username=f'bench-{uuid.uuid4().hex[:8]}', is_superuser=True)
+        self.active = Status.objects.get(slug='active')
+        manufacturer = Manufacturer.objects.create(name='Bench', slug='bench')
+        self.device_type = DeviceType.objects.create(manufacturer=manufacturer, model='Bench switch', slug='bench-switch')
+        self.switch_role = DeviceRole.objects.create(name='Bench switch', slug='bench-switch')
+        self.router_role = DeviceRole.objects.create(name='Bench router', slug='bench-router')
+        self.platform = Platform.objects.create(name='Bench IOS-XE', slug='bench-ios-xe', napalm_driver=NAPALM_DRIVER)
+        plugin_settings = dict(
+            settings.PLUGINS_CONFIG['nautobot_porthistory_plugin'],
+            switches_role_slug=['bench-switch'],
+            routers_role_slug=['bench-router'],
+            snmp_community=COMMUNITY,
+        )
+        plugins_config = dict(settings.PLUGINS_CONFIG, nautobot_porthistory_plugin=plugin_settings)
+        self.settings_override = override_settings(PLUGINS_CONFIG=plugins_config)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def build_fleet(self, size, group):
+        """Create ``size`` switches (and a router per site) in Nautobot; return their simulated agents."""
+        agents = []
+        devices = []
+        routers = []
+        sites = []
+        for s in range((size + DEVICES_PER_SITE - 1) // DEVICES_PER_SITE):
+            site = Site.objects.create(name=f'Bench {size} {s}', slug=f'bench-{size}-{s}', status=self.active)
+            sites.append(site)
+            for k, vid in enumerate(VLANS):
+                vlan = VLAN.objects.create(
+                    site=site, vid=vid, name=f'bench-{vid}', status=self.active,
+                    _custom_field_data={'flag-porthistory': True},
+                )
+                Prefix.objects.create(prefix=f'{group}.{s}.{k * 128}.0/17', site=site, vlan=vlan, status=self.active)
+            arp = []
+            for k in range(len(VLANS)):
+                network = int.from_bytes(bytes((group, s, k * 128, 0)), 'big')
+                for j, n in enumerate(range(s * DEVICES_PER_SITE, min(size, (s + 1) * DEVICES_PER_SITE))):
+                    arp.append((network + 1 + j * FDB_SIZE, sim_mac(n, k, 0), FDB_SIZE))
+            router_address = f'127.{group + 100}.{s + 1}.1'
+            agents.append(router(router_address, COMMUNITY, arp=arp))
+            routers.append((Device(
+                name=f'bench-{size}-rt-{s}', device_type=self.device_type, device_role=self.router_role,
+                platform=self.platform, site=site, status=self.active,
+            ), router_address))
+
+        for n in range(size):
+            agents.append(switch(address(group, n), COMMUNITY, n, interfaces=INTERFACES, vlans=VLANS, fdb_size=FDB_SIZE))
+            devices.append((Device(
+                name=f'bench-{size}-sw-{n}', device_type=self.device_type, device_role=self.switch_role,
+                platform=self.platform, site=sites[n // DEVICES_PER_SITE], status=self.active,
+            ), address(group, n)))
+
+        devices += routers
+        Device.objects.bulk_create([device for device, _ in devices], batch_size=1000)
+        addresses = [IPAddress(address=f'{ip}/32', status=self.active) for _, ip in devices]
+        IPAddress.objects.bulk_create(addresses, batch_size=1000)
+        for (device, _), ip in zip(devices, addresses):
+            device.primary_ip4 = ip
+        Device.objects.bulk_update([device for device, _ in devices], ['primary_ip4'], batch_size=1000)
+        Interface.objects.bulk_create([
+            Interface(device=device, name=f'GigabitEthernet1/0/{port}', type='1000base-t')
+            for device, _ in devices[:size]
+            for port in range(1, INTERFACES + 1)
+        ], batch_size=5000)
+        # профили агентов с прошлых прогонов не должны помечать симулированные устройства недоступными
+        cache.delete_many([AGENT_KEY.format(host=agent.address) for agent in agents])
+        return agents
+
+    def run_job(self, job_class):
+        job = job_class()
+        job.request = RequestFactory().post('/')
+        job.request.user = self.user
+        job.request.id = uuid.uuid4()
+        job.job_result = JobResult.objects.create(
+            name=job.class_path,
+            obj_type=ContentType.objects.get(app_label='extras', model='job'),
+            user=self.user,
+            job_id=uuid.uuid4(),
+        )
+        try:
+            job.run(data={'site': None, 'sites': None}, commit=True)
+        finally:
+            job.post_run()
+        return job
+
+    def measure(self, name, size, job_class):
+        # tracemalloc видит только выделенное после старта: объекты, созданные тестом раньше, в пик не входят
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            job = self.run_job(job_class)
+        finally:
+            elapsed = time.perf_counter() - started
+            memory = tracemalloc.get_traced_memory()[1] / (1 << 20)
+            tracemalloc.stop()
+        queries = job.results['performance']['queries']
+        report = f'{name} on {size} devices: {elapsed:.2f}s, peak {memory:.0f} MiB, {queries} DB queries; ' + ', '.join(
+            f"{phase} {totals['seconds']:.2f}s/{totals['queries']}q" for phase, totals in job.results['performance']['phases'].items()
+        )
+        limits = budget(name, size)
+        self.assertLessEqual(elapsed, limits['seconds'], f'over the time budget: {report}')
+        self.assertLessEqual(memory, limits['memory'], f'over the memory budget: {report}')
+        self.assertLessEqual(queries, limits['queries'], f'over the DB query budget: {report}')
+        return job
+
+    def test_benchmark(self):
+        for group, size in enumerate(sorted(bench_sizes())):
+            with self.subTest(devices=size):
+                agents = self.build_fleet(size, 10 + group * 30)
+                with mock.patch.object(collector, 'SNMP_PORT', SIMULATOR_PORT), \
+                        mock.patch('nautobot_porthistory_plugin.jobs.resolve_ptr', no_ptr), \
+                        SimulatorProcess(agents, SIMULATOR_PORT):
+                    self.measure('unused_ports', size, UnusedPortsUpdate)
+                    self.assertEqual(
+                        UnusedPorts.objects.filter(interface__device__name__startswith=f'bench-{size}-').count(),
+                        size * (INTERFACES // 4),
+                    )
+                    self.measure('mac_on_ports', size, MAConPortsUpdate)
+                    self.assertEqual(
+                        MAConPorts.objects.filter(device__name__startswith=f'bench-{size}-').count(),
+                        size * len(VLANS) * FDB_SIZE,
+                    )
@@ -0,0 +1,147 @@
+import os
+import random
+import time
+import tracemalloc
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from nautobot_porthistory_plugin.collector import (
+    OID_AT_PHYS_ADDRESS, OID_DOT1D_TP_FDB_PORT, OID_DOT1Q_TP_FDB_PORT, ArpRows, FdbRows, QFdbRows,
+)
+from nautobot_porthistory_plugin.macs import format_mac, parse_mac
+
+
+def random_fdb(entries, bridge_ports, seed=0):
+    """Varbinds of a dot1dTpFdbPort table of ``entries`` random MACs on ``bridge_ports`` ports."""
+    rnd = random.Random(seed)
+    varbinds = []
+    for mac in rnd.sample(range(1 << 48), entries):
+        octets = '.'.join(str(mac >> shift & 255) for shift in (40, 32, 24, 16, 8, 0))
+        varbinds.append((f'{OID_DOT1D_TP_FDB_PORT}.{octets}', rnd.randrange(1, bridge_ports + 1)))
+    return varbinds
+
+
+def parse_text(varbinds):
+    # как раньше: MAC строкой из десятичных октетов OID
+    return [
+        (':'.join(['{0:x}'.format(int(i)).zfill(2) for i in oid.split('.')[-6:]]).upper(), bridge_port)
+        for oid, bridge_port in varbinds
+    ]
+
+
+class FdbRowsTestCase(SimpleTestCase):
+
+    def test_rows(self):
+        fdb = FdbRows()
+        fdb.add(f'{OID_DOT1D_TP_FDB_PORT}.0.12.41.1.2.255', 5)
+        self.assertEqual(list(fdb), [(0x000C290102FF, 5)])
+
+        qfdb = QFdbRows()
+        qfdb.add(f'{OID_DOT1Q_TP_FDB_PORT}.10.0.12.41.1.2.255', 7)
+        self.assertEqual(list(qfdb), [(10, 0x000C290102FF, 7)])
+
+        arp = ArpRows()
+        arp.add('.1.3.6.1.2.1.3.1.1.2.5.1.10.0.0.1', b'\x00\x0c\x29\x01\x02\xff')
+        self.assertEqual(list(arp), [(0x0A000001, 0x000C290102FF)])
+
+    def test_format_mac(self):
+        self.assertEqual(format_mac(0x000C290102FF), '00:0C:29:01:02:FF')
+        self.assertEqual(parse_mac('00:0c:29:01:02:ff'), 0x000C290102FF)
+        self.assertEqual(parse_mac('000c.2901.02ff'), 0x000C290102FF)
+        self.assertEqual(parse_mac('00-0C-29-01-02-FF '), 0x000C290102FF)
+        for text in ('not a mac', 'Gi1/0/1', '00:0c:29:01:02', '00:0c:29:01:02:ff:00'):
+            with self.assertRaises(ValueError):
+                parse_mac(text)
+
+    def test_matches_text_parsing(self):
+        # сверим разбор с прежним текстовым, включая крайние MAC адреса
+        varbinds = random_fdb(2000, 48) + [
+            (f'{OID_DOT1D_TP_FDB_PORT}.0.0.0.0.0.0', 1),
+            (f'{OID_DOT1D_TP_FDB_PORT}.255.255.255.255.255.255', 48),
+        ]
+        fdb = FdbRows()
+        for oid, bridge_port in varbinds:
+            fdb.add(oid, bridge_port)
+        self.assertEqual(len(fdb), len(varbinds))
+        self.assertEqual([(format_mac(mac), bridge_port) for mac, bridge_port in fdb], parse_text(varbinds))
+
+        qfdb = QFdbRows()
+        for fdb_id, (oid, bridge_port) in enumerate(varbinds, 1):
+            qfdb.add(f'{OID_DOT1Q_TP_FDB_PORT}.{fdb_id}.{oid[len(OID_DOT1D_TP_FDB_PORT) + 1:]}', bridge_port)
+        self.assertEqual(
+            [(fdb_id, format_mac(mac), bridge_port) for fdb_id, mac, bridge_port in qfdb],
+            [(fdb_id, mac, bridge_port) for fdb_id, (mac, bridge_port) in enumerate(parse_text(varbinds), 1)],
+        )
+
+        arp = ArpRows()
+        for n, (mac, _) in enumerate(fdb):
+            arp.add(f'{OID_AT_PHYS_ADDRESS}.5.1.10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}', mac.to_bytes(6, 'big'))
+        self.assertEqual(list(arp), [((10 << 24) + n, mac) for n, (mac, _) in enumerate(fdb)])
+
+
+@skipUnless(os.environ.get('PORTHISTORY_BENCH'), 'benchmarks run with PORTHISTORY_BENCH=1')
+class FdbRowsBenchmark(SimpleTestCase):
+    """Parsing of a 1M-entry FDB: OID -> value dict with text MACs against ``FdbRows``.
+
+    The time budget (seconds) can be changed with PORTHISTORY_BENCH_FDB_ROWS_BUDGET.
+    """
+
+    ENTRIES = 1000000
+    BRIDGE_PORTS = 48
+
+    def setUp(self):
+        self.varbinds = random_fdb(self.ENTRIES, self.BRIDGE_PORTS)
+        self.bridge_ports = {port: f'interface {port}' for port in range(1, self.BRIDGE_PORTS + 1)}
+
+    def parse_text(self):
+        # как раньше: словарь OID -> значение на всю таблицу, MAC строкой, bridge port строкой
+        fdb = dict(self.varbinds)
+        bridge_ports = {str(port): interface for port, interface in self.bridge_ports.items()}
+        port_mac_relation = []
+        for mac_dec, bridge_port in fdb.items():
+            if str(bridge_port) in bridge_ports:
+                mac_hex = ':'.join(['{0:x}'.format(int(i)).zfill(2) for i in mac_dec.split('.')[-6:]]).upper()
+                port_mac_relation.append({'vlan': 1, 'mac': mac_hex})
+        return port_mac_relation
+
+    def parse_rows(self):
+        rows = FdbRows()
+        add = rows.add
+        for oid, bridge_port in self.varbinds:
+            add(oid, bridge_port)
+        bridge_ports = self.bridge_ports
+        port_mac_relation = []
+        for mac, bridge_port in rows:
+            if bridge_port in bridge_ports:
+                port_mac_relation.append((1, mac))
+        return port_mac_relation
+
+    def measure(self, parse):
+        started = time.perf_counter()
+        result = parse()
+        elapsed = time.perf_counter() - started
+        del result
+        tracemalloc.start()
+        result = parse()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, elapsed, peak
+
+    def test_benchmark(self):
+        budget = float(os.environ.get('PORTHISTORY_BENCH_FDB_ROWS_BUDGET', 10))
+
+        text_result, text_time, text_peak = self.measure(self.parse_text)
+        rows_result, rows_time, rows_peak = self.measure(self.parse_rows)
+
+        self.assertLess(rows_time, budget)
+        self.assertLess(rows_time, text_time, f'integer rows {rows_time:.3f}s, text {text_time:.3f}s')
+        self.assertLess(
+            rows_peak, text_peak,
+            f'integer rows peak {rows_peak / 2 ** 20:.1f} MiB, text peak {text_peak / 2 ** 20:.1f} MiB',
+        )
+
+        # обе выборки совпадают
+        self.assertEqual(len(rows_result), len(text_result))
+        for (vlan, mac), row in zip(rows_result[:2000], text_result[:2000]):
+            self.assertEqual(format_mac(mac), row['mac'])
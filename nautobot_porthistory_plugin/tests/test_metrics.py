@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from nautobot_porthistory_plugin.metrics import RunMetrics, metric_devices, metric_jobs
+
+STATS = {'rtt': 0.5, 'pdus': 10, 'varbinds': 100, 'timeouts': 1, 'failed': False, 'phases': {
+    'fdb': {'seconds': 0.5, 'pdus': 10, 'varbinds': 100},
+}}
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MetricsTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        # запуски по всем сайтам и по одному сайту опрашивают одно и то же устройство
+        for scope in ('all', 'site-a'):
+            metrics = RunMetrics('mac_on_ports', scope)
+            metrics.phase('snmp')
+            metrics.device('switch-1', STATS)
+            metrics.save(metrics.report())
+
+    def series(self, families):
+        return {
+            family.name: [tuple(sample.labels.values()) for sample in family.samples]
+            for family in families
+        }
+
+    def test_overlapping_scopes(self):
+        for families in (metric_jobs(), metric_devices()):
+            for name, samples in self.series(families).items():
+                # повторяющийся набор меток ломает разбор /metrics в Prometheus
+                self.assertEqual(len(samples), len(set(samples)), name)
+        devices = self.series(metric_devices())
+        self.assertEqual(
+            sorted(devices['porthistory_device_snmp_pdus']),
+            [('mac_on_ports', 'all', 'switch-1'), ('mac_on_ports', 'site-a', 'switch-1')],
+        )
+        jobs = self.series(metric_jobs())
+        self.assertEqual(
+            sorted(jobs['porthistory_job_snmp_pdus']),
+            [('mac_on_ports', 'all', 'fdb'), ('mac_on_ports', 'site-a', 'fdb')],
+        )
@@ -0,0 +1,102 @@
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from nautobot.dcim.models import Device, DeviceRole, DeviceType, Interface, Manufacturer, Site
+from nautobot.extras.models import Status
+from nautobot.ipam.models import VLAN
+
+from nautobot_porthistory_plugin.macs import mac_fields
+from nautobot_porthistory_plugin.models import MAConPorts
+from nautobot_porthistory_plugin.pagination import EstimatedCountPaginator, KeysetPaginator, estimate_count
+from nautobot_porthistory_plugin.tables import PortHistoryTable
+
+MAC = 0x000C29010200
+ROWS = 10
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def setUp(self):
+        active = Status.objects.get(slug='active')
+        manufacturer = Manufacturer.objects.create(name='Pages', slug='pages')
+        device_type = DeviceType.objects.create(manufacturer=manufacturer, model='Pages switch', slug='pages-switch')
+        role = DeviceRole.objects.create(name='Pages switch', slug='pages-switch')
+        site = Site.objects.create(name='Pages', slug='pages', status=active)
+        device = Device.objects.create(
+            name=f'pages-{uuid.uuid4().hex[:8]}', device_type=device_type, device_role=role, site=site, status=active,
+        )
+        interface = Interface.objects.create(device=device, name='GigabitEthernet1/0/1', type='1000base-t')
+        vlan = VLAN.objects.create(site=site, vid=10, name='pages-10', status=active)
+        now = timezone.now()
+        for n in range(ROWS):
+            mac = MAConPorts.objects.create(vlan=vlan, **mac_fields(MAC + n), interface=interface, device=device)
+            # по две строки с одинаковым updated: порядок внутри пары задает pk
+            MAConPorts.objects.filter(pk=mac.pk).update(updated=now - timedelta(minutes=n // 2))
+        self.expected = list(MAConPorts.objects.order_by('-updated', '-pk').values_list('pk', flat=True))
+
+    def paginator(self, per_page):
+        queryset = MAConPorts.objects.all()
+        table = PortHistoryTable(queryset)
+        return KeysetPaginator(table.rows, per_page, queryset, table)
+
+    def test_pages(self):
+        paginator = self.paginator(4)
+        pages = [paginator.page(1)]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_page_number()))
+        self.assertEqual([[row.record.pk for row in page.object_list] for page in pages], [
+            self.expected[0:4], self.expected[4:8], self.expected[8:10],
+        ])
+        self.assertEqual([(page.start_index(), page.end_index()) for page in pages], [(1, 4), (5, 8), (9, 10)])
+        self.assertFalse(pages[0].has_previous())
+
+        # назад с последней страницы - та же вторая страница
+        page = paginator.page(pages[2].previous_page_number())
+        self.assertEqual([row.record.pk for row in page.object_list], self.expected[4:8])
+        self.assertEqual(page.start_index(), 5)
+        self.assertTrue(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_is_cursor(self):
+        page = self.paginator(4).page(1)
+        self.assertTrue(KeysetPaginator.is_cursor(page.next_page_number()))
+        self.assertFalse(KeysetPaginator.is_cursor('2'))
+        self.assertFalse(KeysetPaginator.is_cursor('a1_x_y'))
+
+    def test_view_follows_cursors(self):
+        user = get_user_model().objects.create_user(username='porthistory-pages', is_superuser=True)
+        self.client.force_login(user)
+        url = reverse('plugins:nautobot_porthistory_plugin:history')
+        response = self.client.get(url, {'per_page': 3})
+        seen = []
+        pages = 0
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.context['table'].page
+            seen.extend(row.record.pk for row in page.object_list)
+            pages += 1
+            if not page.has_next():
+                break
+            self.assertContains(response, f'page={page.next_page_number()}')
+            response = self.client.get(url, {'per_page': 3, 'page': page.next_page_number()})
+        self.assertEqual(pages, 4)
+        self.assertEqual(seen, self.expected)
+
+        response = self.client.get(url, {'per_page': 3, 'page': page.previous_page_number()})
+        self.assertEqual([row.record.pk for row in response.context['table'].page.object_list], self.expected[6:9])
+
+    def test_estimate_count(self):
+        # на тестовой базе строк меньше порога (или СУБД без статистики) - оценки нет
+        self.assertIsNone(estimate_count(MAConPorts.objects.all()))
+        with mock.patch('nautobot_porthistory_plugin.pagination.estimate_count', return_value=500000):
+            queryset = MAConPorts.objects.all()
+            self.assertEqual(EstimatedCountPaginator(queryset, 10, queryset=queryset).count, 500000)
+            # отфильтрованный список считается точно
+            queryset = MAConPorts.objects.filter(mac_key__startswith='000C29')
+            self.assertEqual(EstimatedCountPaginator(queryset, 10, queryset=queryset).count, ROWS)
@@ -0,0 +1,88 @@
+import os
+import random
+import time
+from ipaddress import IPv4Address, IPv4Network
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from nautobot_porthistory_plugin.prefixes import PrefixIndex, format_ipv4
+
+
+def random_prefixes(vlans, arp_entries, seed=0):
+    """Prefixes of ``vlans`` VLANs (a /22 and a /24 inside it) and ARP entries, 10% of them outside any prefix."""
+    rnd = random.Random(seed)
+    prefixes = []
+    for vlan_id in range(vlans):
+        network = (10 << 24) + (vlan_id << 10)
+        prefixes.append((vlan_id, network, 22, None))
+        prefixes.append((vlan_id, network + (1 << 8), 24, None))
+    arp = []
+    for _ in range(arp_entries):
+        vlan_id = rnd.randrange(vlans)
+        if rnd.random() < 0.1:
+            address = (192 << 24) + rnd.randrange(1 << 16)
+        else:
+            address = (10 << 24) + (vlan_id << 10) + rnd.randrange(1 << 10)
+        arp.append((vlan_id, (address,)))
+    return prefixes, arp
+
+
+class PrefixIndexTestCase(SimpleTestCase):
+
+    def test_longest_prefix_match(self):
+        index = PrefixIndex([
+            (1, int(IPv4Address('10.0.0.0')), 16, 'vrf-a'),
+            (1, int(IPv4Address('10.0.1.0')), 24, 'vrf-b'),
+            (2, int(IPv4Address('192.168.0.0')), 24, None),
+        ])
+        self.assertEqual(len(index), 3)
+        address = int(IPv4Address('10.0.1.15'))
+        self.assertEqual(index.lookup(1, [address]), (address, 24, 'vrf-b'))
+        address = int(IPv4Address('10.0.2.15'))
+        self.assertEqual(index.lookup(1, [address]), (address, 16, 'vrf-a'))
+        self.assertIsNone(index.lookup(2, [address]))
+        self.assertIsNone(index.lookup(3, [address]))
+
+    def test_format_ipv4(self):
+        self.assertEqual(format_ipv4(int(IPv4Address('172.16.254.1'))), '172.16.254.1')
+
+    def test_matches_naive_search(self):
+        # сверим выборку с наивным поиском через ipaddress
+        prefixes, arp = random_prefixes(100, 2000)
+        index = PrefixIndex(prefixes)
+        networks = {}
+        for vlan_id, network, prefix_length, vrf_id in prefixes:
+            networks.setdefault(vlan_id, []).append(IPv4Network((network, prefix_length)))
+        for vlan_id, addresses in arp:
+            candidates = [
+                network for network in networks[vlan_id] if IPv4Address(addresses[0]) in network
+            ]
+            match = index.lookup(vlan_id, addresses)
+            if candidates:
+                longest = max(candidates, key=lambda network: network.prefixlen)
+                self.assertEqual(match[1], longest.prefixlen)
+            else:
+                self.assertIsNone(match)
+
+
+@skipUnless(os.environ.get('PORTHISTORY_BENCH'), 'benchmarks run with PORTHISTORY_BENCH=1')
+class PrefixIndexBenchmark(SimpleTestCase):
+    """MAC to IP matching with 50k prefixes and 500k ARP entries.
+
+    The time budget (seconds) can be changed with PORTHISTORY_BENCH_PREFIX_INDEX_BUDGET.
+    """
+
+    PREFIXES = 50000
+    ARP_ENTRIES = 500000
+
+    def test_benchmark(self):
+        budget = float(os.environ.get('PORTHISTORY_BENCH_PREFIX_INDEX_BUDGET', 10))
+        prefixes, arp = random_prefixes(self.PREFIXES // 2, self.ARP_ENTRIES)
+
+        started = time.perf_counter()
+        index = PrefixIndex(prefixes)
+        lookup = index.lookup
+        matched = sum(1 for vlan_id, addresses in arp if lookup(vlan_id, addresses))
+        self.assertLess(time.perf_counter() - started, budget)
+        self.assertGreater(matched, 0)
@@ -0,0 +1,52 @@
+import uuid
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from nautobot.dcim.models import Device, DeviceRole, DeviceType, Interface, Manufacturer, Site
+from nautobot.extras.models import Status
+from nautobot.ipam.models import VLAN, IPAddress
+
+from nautobot_porthistory_plugin.macs import mac_fields
+from nautobot_porthistory_plugin.models import MAConPorts
+from nautobot_porthistory_plugin.template_content import InterfaceWithIP, MAConInterface
+
+MAC = 0x000C290102FF
+
+
+class PanelsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        active = Status.objects.get(slug='active')
+        manufacturer = Manufacturer.objects.create(name='Panels', slug='panels')
+        device_type = DeviceType.objects.create(manufacturer=manufacturer, model='Panels switch', slug='panels-switch')
+        role = DeviceRole.objects.create(name='Panels switch', slug='panels-switch')
+        site = Site.objects.create(name='Panels', slug='panels', status=active)
+        self.ipaddress = IPAddress.objects.create(address='10.0.0.1/24', status=active)
+        self.interfaces = []
+        for n in range(3):
+            device = Device.objects.create(
+                name=f'panels-{uuid.uuid4().hex[:8]}', device_type=device_type, device_role=role, site=site, status=active,
+            )
+            interface = Interface.objects.create(device=device, name='GigabitEthernet1/0/1', label=f'port {n}', type='1000base-t')
+            vlan = VLAN.objects.create(site=site, vid=10 + n, name=f'panels-{n}', status=active)
+            MAConPorts.objects.create(
+                vlan=vlan, **mac_fields(MAC), interface=interface, device=device, ipaddress=self.ipaddress,
+            )
+            self.interfaces.append(interface)
+
+    def test_ports_with_ipaddress(self):
+        # интерфейсы, устройства и вланы всех строк загружаются одним запросом
+        with self.assertNumQueries(1):
+            panel = str(InterfaceWithIP({'object': self.ipaddress}).render_ports_with_ipaddress(self.ipaddress))
+        for interface in self.interfaces:
+            self.assertIn(str(interface), panel)
+            self.assertIn(interface.device.name, panel)
+
+    def test_mac_on_port(self):
+        interface = self.interfaces[0]
+        with self.assertNumQueries(1):
+            panel = str(MAConInterface({'object': interface}).render_mac_on_port(interface))
+        self.assertIn('00:0C:29:01:02:FF', panel)
+        self.assertIn(str(self.ipaddress), panel)
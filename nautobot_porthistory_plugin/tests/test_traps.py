@@ -0,0 +1,160 @@
+import asyncio
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from nautobot.dcim.models import Device, DeviceRole, DeviceType, Interface, Manufacturer, Platform, Site
+from nautobot.extras.models import Status
+from nautobot.ipam.models import VLAN, IPAddress
+
+from nautobot_porthistory_plugin import collector
+from nautobot_porthistory_plugin.inventory import NAPALM_DRIVER
+from nautobot_porthistory_plugin.macs import mac_fields
+from nautobot_porthistory_plugin.models import MAConPorts, MACHistory, UnusedPorts
+from nautobot_porthistory_plugin.tests.simulator import Simulator, mac_changed_msg, send_trap, switch
+from nautobot_porthistory_plugin.trap_updates import TrapUpdater
+from nautobot_porthistory_plugin.traps import (
+    OID_CMN_HIST_MAC_CHANGED_MSG, OID_CMN_MAC_CHANGED, OID_IF_INDEX, OID_LINK_DOWN, OID_LINK_UP,
+    mac_changes, receive_traps,
+)
+
+SIMULATOR_PORT = 16162
+TRAP_PORT = 16163
+SWITCH = '127.0.50.1'
+MAC = 0x000C290102FF
+
+
+class TrapReceiverTestCase(SimpleTestCase):
+
+    def test_mac_changes(self):
+        msg = mac_changed_msg([(True, 10, MAC, 5), (False, 20, MAC + 1, 7)])
+        self.assertEqual(mac_changes(msg), [(True, 10, MAC, 5), (False, 20, MAC + 1, 7)])
+        self.assertEqual(mac_changes(b'\x00'), [])
+
+    def test_receive(self):
+        # трапы, сгенерированные локально, разрешаются в имена интерфейсов опросом симулятора
+        agents = [switch(SWITCH, 'public', 0, vlans=(10,))]
+
+        async def receive(traps):
+            batches = []
+            ready = asyncio.Event()
+
+            async def emit(events):
+                batches.append(events)
+
+            receiver = asyncio.ensure_future(receive_traps(
+                emit, '127.0.0.1', TRAP_PORT, ['public'], 'public', batch_seconds=0.2, ready=ready.set,
+            ))
+            await ready.wait()
+            for trap in traps:
+                send_trap('127.0.0.1', TRAP_PORT, *trap, source=SWITCH)
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if sum(len(events) for events in batches) >= 4:
+                    break
+            receiver.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+            return [event for events in batches for event in events]
+
+        traps = [
+            ('public', OID_LINK_DOWN, [(f'{OID_IF_INDEX}.3', 3)]),
+            ('public', OID_LINK_UP, [(f'{OID_IF_INDEX}.3', 3)]),
+            ('public', OID_CMN_MAC_CHANGED, [
+                (f'{OID_CMN_HIST_MAC_CHANGED_MSG}.1', mac_changed_msg([(True, 10, MAC, 5), (False, 10, MAC + 1, 6)])),
+            ]),
+            # чужое community отбрасывается
+            ('private', OID_LINK_DOWN, [(f'{OID_IF_INDEX}.4', 4)]),
+        ]
+        with mock.patch.object(collector, 'SNMP_PORT', SIMULATOR_PORT), Simulator(agents, SIMULATOR_PORT):
+            events = asyncio.run(receive(traps))
+        self.assertEqual(events, [
+            ('link', SWITCH, 'GigabitEthernet1/0/3', False),
+            ('link', SWITCH, 'GigabitEthernet1/0/3', True),
+            ('mac', SWITCH, 'GigabitEthernet1/0/5', 10, MAC, True),
+            ('mac', SWITCH, 'GigabitEthernet1/0/6', 10, MAC + 1, False),
+        ])
+
+
+class TrapUpdaterTestCase(TestCase):
+
+    def setUp(self):
+        active = Status.objects.get(slug='active')
+        manufacturer = Manufacturer.objects.create(name='Traps', slug='traps')
+        device_type = DeviceType.objects.create(manufacturer=manufacturer, model='Traps switch', slug='traps-switch')
+        role = DeviceRole.objects.create(name='Traps switch', slug='traps-switch')
+        platform = Platform.objects.create(name='Traps IOS-XE', slug='traps-ios-xe', napalm_driver=NAPALM_DRIVER)
+        site = Site.objects.create(name='Traps', slug='traps', status=active)
+        self.vlan = VLAN.objects.create(
+            site=site, vid=10, name='traps-10', status=active, _custom_field_data={'flag-porthistory': True},
+        )
+        self.device = Device.objects.create(
+            name=f'traps-{uuid.uuid4().hex[:8]}', device_type=device_type, device_role=role,
+            platform=platform, site=site, status=active,
+        )
+        self.device.primary_ip4 = IPAddress.objects.create(address=f'{SWITCH}/32', status=active)
+        self.device.save()
+        self.interfaces = {
+            port: Interface.objects.create(device=self.device, name=f'GigabitEthernet1/0/{port}', type='1000base-t')
+            for port in range(1, 9)
+        }
+        self.updater = TrapUpdater(['traps-switch'], timedelta(hours=24))
+
+    def mac_on_port(self, mac, port):
+        return MAConPorts.objects.create(
+            vlan=self.vlan, **mac_fields(mac), interface=self.interfaces[port], device=self.device,
+        )
+
+    def test_mac_learnt_and_removed(self):
+        self.mac_on_port(MAC + 1, 6)
+        self.mac_on_port(MAC + 2, 7)
+        counts = self.updater.apply([
+            ('mac', SWITCH, 'GigabitEthernet1/0/5', 10, MAC, True),
+            ('mac', SWITCH, 'GigabitEthernet1/0/6', 10, MAC + 1, False),
+            # удаление с другого порта не трогает MAC, уже переехавший на 7-й порт
+            ('mac', SWITCH, 'GigabitEthernet1/0/8', 10, MAC + 2, False),
+            ('mac', SWITCH, 'GigabitEthernet1/0/99', 10, MAC + 3, True),
+        ])
+        self.assertEqual(
+            set(MAConPorts.objects.values_list('mac_key', 'interface__name')),
+            {(f'{MAC:012X}', 'GigabitEthernet1/0/5'), (f'{MAC + 2:012X}', 'GigabitEthernet1/0/7')},
+        )
+        self.assertEqual(counts['skipped'], 1)
+        self.assertEqual(MACHistory.objects.filter(mac_key=f'{MAC:012X}', interface=self.interfaces[5]).count(), 1)
+
+    def test_mac_moved(self):
+        self.mac_on_port(MAC, 1)
+        self.updater.apply([('mac', SWITCH, 'GigabitEthernet1/0/2', 10, MAC, True)])
+        self.updater.apply([('mac', SWITCH, 'GigabitEthernet1/0/2', 10, MAC, True)])
+        self.assertEqual(MAConPorts.objects.get(mac_key=f'{MAC:012X}').interface, self.interfaces[2])
+        # второй раз интервал истории продлевается, а не открывается заново
+        self.assertEqual(MACHistory.objects.filter(mac_key=f'{MAC:012X}').count(), 1)
+
+    def test_mac_created_by_job(self):
+        # MAC job добавил тот же MAC, пока пачка трапов применялась: пачка не падает, строка job-а остается
+        def racing_mac_fields(mac):
+            if not MAConPorts.objects.filter(mac_key=f'{mac:012X}').exists():
+                self.mac_on_port(mac, 1)
+            return mac_fields(mac)
+
+        with mock.patch('nautobot_porthistory_plugin.trap_updates.mac_fields', racing_mac_fields):
+            counts = self.updater.apply([('mac', SWITCH, 'GigabitEthernet1/0/5', 10, MAC, True)])
+        self.assertEqual(MAConPorts.objects.get(mac_key=f'{MAC:012X}').interface, self.interfaces[1])
+        self.assertEqual(counts['history_created'], 1)
+
+    def test_link_events(self):
+        self.mac_on_port(MAC, 3)
+        self.mac_on_port(MAC + 1, 4)
+        UnusedPorts.objects.create(interface=self.interfaces[4], last_output=timezone.now() - timedelta(days=30))
+        self.updater.apply([
+            ('link', SWITCH, 'Gi1/0/3', False),
+            ('link', SWITCH, 'Gi1/0/4', True),
+        ])
+        self.assertEqual(list(MAConPorts.objects.values_list('interface__name', flat=True)), ['GigabitEthernet1/0/4'])
+        self.assertFalse(UnusedPorts.objects.exists())
+
+    def test_unflagged_vlan(self):
+        self.updater.apply([('mac', SWITCH, 'GigabitEthernet1/0/5', 20, MAC, True)])
+        self.assertFalse(MAConPorts.objects.exists())
@@ -0,0 +1,52 @@
+"""Index of cabled interfaces used to exclude links between switches from MAC results."""
+
+from uuid import uuid4
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Q
+
+from nautobot.dcim.models import Cable, Interface
+
+GENERATION_KEY = 'nautobot_porthistory_plugin:cabled_interfaces:generation'
+INDEX_KEY = 'nautobot_porthistory_plugin:cabled_interfaces:{generation}:{site}'
+INDEX_TIMEOUT = 60 * 60 * 24
+
+
+def invalidate_cabled_interfaces():
+    """Start a new cache generation, so every cached index is rebuilt on next use."""
+    cache.set(GENERATION_KEY, uuid4().hex, None)
+
+
+def build_cabled_interfaces(site=None):
+    """Return the set of ids of interfaces with a cable, optionally restricted to one site."""
+    interface_type = ContentType.objects.get_for_model(Interface).pk
+    cables = Cable.objects.filter(Q(termination_a_type=interface_type) | Q(termination_b_type=interface_type))
+    if site:
+        cables = cables.filter(Q(_termination_a_device__site=site) | Q(_termination_b_device__site=site))
+    site_id = site.pk if site else None
+
+    interfaces = set()
+    for a_type, a_id, a_site, b_type, b_id, b_site in cables.values_list(
+        'termination_a_type_id', 'termination_a_id', '_termination_a_device__site_id',
+        'termination_b_type_id', 'termination_b_id', '_termination_b_device__site_id',
+    ):
+        if a_type == interface_type and (site_id is None or a_site == site_id):
+            interfaces.add(a_id)
+        if b_type == interface_type and (site_id is None or b_site == site_id):
+            interfaces.add(b_id)
+    return interfaces
+
+
+def get_cabled_interfaces(site=None):
+    """Cached ``build_cabled_interfaces``, invalidated by Cable save/delete signals."""
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = uuid4().hex
+        cache.set(GENERATION_KEY, generation, None)
+    key = INDEX_KEY.format(generation=generation, site=site.pk if site else 'all')
+    interfaces = cache.get(key)
+    if interfaces is None:
+        interfaces = build_cabled_interfaces(site)
+        cache.set(key, interfaces, INDEX_TIMEOUT)
+    return interfaces
@@ -0,0 +1,133 @@
+"""Shared UDP transport of the SNMP requests of a collection run.
+
+``aiosnmp.Snmp`` binds a socket of its own for every session, that is for every agent,
+phase and ``community@vlan`` context. ``Transport`` sends the requests of all sessions of a
+run through a small pool of unconnected sockets instead, and hands every response to the
+request waiting for it by the agent address and the request-id, like ``aiosnmp`` does
+within one session.
+"""
+
+import asyncio
+import itertools
+import socket
+
+from aiosnmp.exceptions import SnmpTimeoutError
+from aiosnmp.message import GetBulkRequest, GetRequest, SnmpMessage, SnmpVarbind, SnmpVersion
+from aiosnmp.protocols import SnmpProtocol
+
+SOCKETS = 4
+# responses of hundreds of concurrent walks must not overflow the socket buffer
+# (the kernel caps it at net.core.rmem_max)
+RECEIVE_BUFFER = 4 * 1024 * 1024
+
+
+class _SharedProtocol(SnmpProtocol):
+    """``SnmpProtocol`` of a shared socket: responses are matched by ``(host, port, request-id)``."""
+
+    def __init__(self):
+        super().__init__(timeout=None, retries=None, validate_source_addr=True)
+        self.transport = None
+
+    def connection_lost(self, exc):
+        for future in self.requests.values():
+            if not future.done():
+                future.set_exception(exc or ConnectionError('SNMP socket closed'))
+        self.requests.clear()
+
+
+class Transport:
+    """A pool of ``sockets`` UDP sockets shared by the sessions of all agents; use with ``async with``."""
+
+    def __init__(self, sockets=SOCKETS):
+        self.size = sockets
+        self.protocols = []
+        self.next_protocol = None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        for _ in range(self.size):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+            except OSError:
+                pass
+            sock.bind(('0.0.0.0', 0))
+            _, protocol = await loop.create_datagram_endpoint(_SharedProtocol, sock=sock)
+            self.protocols.append(protocol)
+        self.next_protocol = itertools.cycle(self.protocols)
+        return self
+
+    def close(self):
+        for protocol in self.protocols:
+            if protocol.transport is not None:
+                protocol.transport.close()
+        self.protocols = []
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def session(self, host, port, community, timeout, retries, max_repetitions):
+        return Session(self, next(self.next_protocol), (host, port), community, timeout, retries, max_repetitions)
+
+    async def send(self, protocol, address, message, timeout, retries):
+        """Send ``message`` up to ``retries`` times, ``timeout`` seconds apart; return the response varbinds."""
+        key = (*address, message.data.request_id)
+        future = asyncio.get_running_loop().create_future()
+        protocol.requests[key] = future
+        data = message.encode()
+        try:
+            for _ in range(retries):
+                protocol.transport.sendto(data, address)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), timeout)
+                except asyncio.TimeoutError:
+                    continue
+            raise SnmpTimeoutError
+        finally:
+            if protocol.requests.get(key) is future:
+                del protocol.requests[key]
+            if not future.done():
+                future.cancel()
+
+
+class Session:
+    """The part of the ``aiosnmp.Snmp`` interface used by the collector, over a shared ``Transport``.
+
+    Opening and closing a session costs nothing: the socket belongs to the transport.
+    """
+
+    __slots__ = ('transport', 'protocol', 'address', 'community', 'timeout', 'retries', 'max_repetitions')
+
+    def __init__(self, transport, protocol, address, community, timeout, retries, max_repetitions):
+        self.transport = transport
+        self.protocol = protocol
+        self.address = address
+        self.community = community
+        self.timeout = timeout
+        self.retries = retries
+        self.max_repetitions = max_repetitions
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+    async def _send(self, data):
+        message = SnmpMessage(SnmpVersion.v2c, self.community, data)
+        return await self.transport.send(self.protocol, self.address, message, self.timeout, self.retries)
+
+    async def get(self, oids):
+        if isinstance(oids, str):
+            oids = [oids]
+        return await self._send(GetRequest([SnmpVarbind(oid) for oid in oids]))
+
+    async def get_bulk(self, oids, non_repeaters=0, max_repetitions=None):
+        if isinstance(oids, str):
+            oids = [oids]
+        if max_repetitions is None:
+            max_repetitions = self.max_repetitions
+        return await self._send(GetBulkRequest([SnmpVarbind(oid) for oid in oids], non_repeaters, max_repetitions))
@@ -0,0 +1,195 @@
+"""Incremental updates of MACs on ports, MAC history and unused ports from trap events."""
+
+from collections import Counter
+
+from nautobot.extras.models import Status
+from nautobot.ipam.models import VLAN
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from netutils.interface import canonical_interface_name
+
+from nautobot_porthistory_plugin.inventory import load_inventory
+from nautobot_porthistory_plugin.macs import mac_fields
+from nautobot_porthistory_plugin.models import MAConPorts, MACHistory, UnusedPorts
+from nautobot_porthistory_plugin.panels import invalidate_panels
+from nautobot_porthistory_plugin.topology import get_cabled_interfaces
+from nautobot_porthistory_plugin.writers import BulkWriter
+
+
+class TrapUpdater:
+    """Apply batches of events of ``traps.receive_traps`` to the rows of the interfaces they name.
+
+    A MAC learnt on a port is added to (or moved to) the port and its history interval is
+    extended or opened, a removed MAC is deleted from the port, a port that went down loses
+    its MACs and a port that came up is no longer unused. IP addresses of MACs are left to
+    the MAC job; a port that went down becomes unused when the unused ports job finds it
+    idle for ``min_idle_days``.
+
+    A batch is applied in one transaction. MAC job runs write the same rows at the same time:
+    a MAC the job has just added is left to it rather than failing the batch.
+    """
+
+    def __init__(self, switches_role_slug, history_gap):
+        self.switches_role_slug = switches_role_slug
+        self.history_gap = history_gap
+
+    @transaction.atomic
+    def apply(self, events):
+        """Apply a batch of events in their order; return a Counter of the changes."""
+        counts = Counter()
+        status_active = Status.objects.get(slug='active')
+        devices = load_inventory(self.switches_role_slug, status_active, addresses={event[1] for event in events})
+        cabled_interfaces = get_cabled_interfaces()
+
+        # итог пачки: более позднее событие перекрывает раннее
+        # (site_id, vid, MAC числом) -> (интерфейс, устройство, learnt)
+        macs = {}
+        went_up = set()
+        went_down = set()
+        for event in events:
+            kind, host, name = event[:3]
+            device = devices.get(host)
+            intf = device.interfaces.get(canonical_interface_name(name)) if device else None
+            if intf is None:
+                counts['skipped'] += 1
+                continue
+            if kind == 'link':
+                if event[3]:
+                    went_up.add(intf.id)
+                else:
+                    went_down.add(intf.id)
+                    # MAC адреса, появившиеся на порту раньше в этой пачке, ушли вместе с линком
+                    for key in [key for key, (mac_intf, _, learnt) in macs.items() if mac_intf.id == intf.id and learnt]:
+                        del macs[key]
+                continue
+            _, _, _, vid, mac, learnt = event
+            # линки между свичами и порты с flag-ignore-mac пропускаем, как и MAC job
+            if intf.id in cabled_interfaces or intf._custom_field_data.get('flag-ignore-mac'):
+                continue
+            macs[(device.device.site_id, vid, mac)] = (intf, device.device, learnt)
+
+        # события в вланах без flag-porthistory пропускаем
+        vlans = {}
+        if macs:
+            for nb_vlan in VLAN.objects.filter(
+                        site_id__in={site_id for site_id, _, _ in macs},
+                        vid__in={vid for _, vid, _ in macs},
+                        status=status_active,
+                        _custom_field_data={'flag-porthistory': True},
+                    ):
+                vlans[(nb_vlan.site_id, nb_vlan.vid)] = nb_vlan
+        changes = {}
+        for (site_id, vid, mac), (intf, nb_device, learnt) in macs.items():
+            nb_vlan = vlans.get((site_id, vid))
+            if nb_vlan is not None:
+                changes[(nb_vlan.id, mac)] = (intf, nb_device, nb_vlan, learnt)
+
+        # одним запросом: известные строки затронутых MAC адресов и все MAC адреса опустившихся портов
+        nb_mac_on_ports = {}
+        if changes or went_down:
+            for mac_on_port in MAConPorts.objects.filter(
+                        Q(vlan_id__in={vlan_id for vlan_id, _ in changes}, mac_key__in={f'{mac:012X}' for _, mac in changes})
+                        | Q(interface_id__in=went_down)
+                    ):
+                nb_mac_on_ports[(mac_on_port.vlan_id, int(mac_on_port.mac_key, 16))] = mac_on_port
+
+        now = timezone.now()
+        mac_writer = BulkWriter(
+            MAConPorts, ['interface', 'device', 'updated'], touch_values={'updated': now}, ignore_conflicts=True,
+        )
+        changed_interfaces = set()
+        changed_ipaddresses = set()
+        learnt_macs = {}
+        for key, (intf, nb_device, nb_vlan, learnt) in changes.items():
+            if not learnt:
+                # MAC удаляем, только если он все еще числится на этом порту
+                mac_on_port = nb_mac_on_ports.get(key)
+                if mac_on_port is not None and mac_on_port.interface_id == intf.id:
+                    del nb_mac_on_ports[key]
+                    mac_writer.delete(mac_on_port.pk)
+                    changed_interfaces.add(intf.id)
+                    if mac_on_port.ipaddress_id:
+                        changed_ipaddresses.add(mac_on_port.ipaddress_id)
+                continue
+            mac_on_port = nb_mac_on_ports.pop(key, None)
+            learnt_macs[key] = (intf, nb_device, nb_vlan, mac_on_port)
+            changed_interfaces.add(intf.id)
+            if mac_on_port is None:
+                mac_writer.create(MAConPorts(
+                    vlan=nb_vlan,
+                    **mac_fields(key[1]),
+                    interface=intf,
+                    device=nb_device,
+                ))
+                continue
+            if mac_on_port.ipaddress_id:
+                changed_ipaddresses.add(mac_on_port.ipaddress_id)
+            if mac_on_port.interface_id != intf.id:
+                changed_interfaces.add(mac_on_port.interface_id)
+                mac_on_port.interface = intf
+                mac_on_port.device = nb_device
+                mac_on_port.updated = now
+                mac_writer.update(mac_on_port)
+            else:
+                mac_writer.touch(mac_on_port.pk)
+
+        # MAC адреса опустившихся портов, которые не появились снова
+        for mac_on_port in nb_mac_on_ports.values():
+            if mac_on_port.interface_id in went_down:
+                mac_writer.delete(mac_on_port.pk)
+                changed_interfaces.add(mac_on_port.interface_id)
+                if mac_on_port.ipaddress_id:
+                    changed_ipaddresses.add(mac_on_port.ipaddress_id)
+        mac_writer.flush()
+
+        # история: как в MAC job, открытый интервал на том же порту продлеваем, иначе открываем новый
+        open_intervals = {}
+        if learnt_macs:
+            for pk, vlan_id, mac_key, interface_id in MACHistory.objects.filter(
+                        vlan_id__in={vlan_id for vlan_id, _ in learnt_macs},
+                        mac_key__in={f'{mac:012X}' for _, mac in learnt_macs},
+                        last_seen__gte=now - self.history_gap,
+                    ).order_by('last_seen').values_list('pk', 'vlan_id', 'mac_key', 'interface_id'):
+                open_intervals[(vlan_id, int(mac_key, 16))] = (pk, interface_id)
+        history_writer = BulkWriter(MACHistory, [], touch_values={'last_seen': now})
+        for key, (intf, nb_device, nb_vlan, mac_on_port) in learnt_macs.items():
+            interval = open_intervals.get(key)
+            if interval and interval[1] == intf.id:
+                history_writer.touch(interval[0])
+            else:
+                history_writer.create(MACHistory(
+                    vlan=nb_vlan,
+                    **mac_fields(key[1]),
+                    interface=intf,
+                    device=nb_device,
+                    ipaddress_id=mac_on_port.ipaddress_id if mac_on_port else None,
+                    first_seen=now,
+                    last_seen=now,
+                ))
+        history_writer.flush()
+
+        # поднявшийся порт больше не считается неиспользуемым
+        changed_devices = set()
+        if went_up:
+            unused_ports = list(UnusedPorts.objects.filter(interface_id__in=went_up).values_list('pk', 'interface__device_id'))
+            if unused_ports:
+                UnusedPorts.objects.filter(pk__in=[pk for pk, _ in unused_ports]).delete()
+                changed_devices = {device_id for _, device_id in unused_ports}
+            counts['unused_deleted'] = len(unused_ports)
+
+        # панели сбрасываем после фиксации, иначе их могут успеть собрать заново по старым строкам
+        def invalidate():
+            invalidate_panels('mac_on_port', changed_interfaces)
+            invalidate_panels('ports_with_ipaddress', changed_ipaddresses)
+            invalidate_panels('unused_ports', changed_devices)
+
+        transaction.on_commit(invalidate)
+        counts.update({
+            'mac_created': mac_writer.created,
+            'mac_updated': mac_writer.updated,
+            'mac_deleted': mac_writer.deleted,
+            'history_created': history_writer.created,
+            'history_extended': history_writer.touched,
+        })
+        return counts
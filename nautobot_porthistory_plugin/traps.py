@@ -0,0 +1,207 @@
+"""Receiver of linkUp/linkDown and Cisco MAC-notification traps for incremental updates.
+
+Traps are decoded into events on a background event loop. Interfaces are referred to in
+traps by ifIndex or bridge port, so the receiver resolves them to ifName with a GET (and a
+walk of dot1dBasePortIfIndex of the VLAN) to the switch that sent the trap, remembered until
+the switch reboots. Resolved events are emitted in batches, never touching the ORM, exactly
+like the collection pipeline does.
+"""
+
+import asyncio
+import time
+
+from aiosnmp import SnmpV2TrapServer
+
+from nautobot_porthistory_plugin.collector import OID_DOT1D_BASE_PORT_IFINDEX, OID_IF_NAME, Agent
+from nautobot_porthistory_plugin.transport import Transport
+
+OID_SYS_UPTIME_TRAP = '.1.3.6.1.2.1.1.3.0'
+OID_SNMP_TRAP_OID = '.1.3.6.1.6.3.1.1.4.1.0'
+OID_LINK_DOWN = '.1.3.6.1.6.3.1.1.5.3'
+OID_LINK_UP = '.1.3.6.1.6.3.1.1.5.4'
+OID_IF_INDEX = '.1.3.6.1.2.1.2.2.1.1'
+# CISCO-MAC-NOTIFICATION-MIB: cmnMacChangedNotification and its cmnHistMacChangedMsg
+OID_CMN_MAC_CHANGED = '.1.3.6.1.4.1.9.9.215.2.0.1'
+OID_CMN_HIST_MAC_CHANGED_MSG = '.1.3.6.1.4.1.9.9.215.1.1.8.1.2'
+
+MAC_LEARNT = 1
+MAC_REMOVED = 2
+# operation (1 octet), VLAN (2), MAC (6), dot1dBasePort (2)
+MAC_CHANGE_SIZE = 11
+
+TRAP_PORT = 162
+BATCH_SECONDS = 5
+BATCH_EVENTS = 1000
+# names are read again after this time even if the switch did not reboot
+NAME_TTL = 60 * 60
+RESOLVE_PARAMS = {'timeout': 2, 'retries': 2, 'max_repetitions': 25}
+
+
+def mac_changes(value):
+    """Records of a cmnHistMacChangedMsg as ``(learnt, VLAN, MAC, bridge port)``, up to the terminating zero."""
+    changes = []
+    for i in range(0, len(value) - MAC_CHANGE_SIZE + 1, MAC_CHANGE_SIZE):
+        operation = value[i]
+        if operation not in (MAC_LEARNT, MAC_REMOVED):
+            break
+        changes.append((
+            operation == MAC_LEARNT,
+            int.from_bytes(value[i + 1:i + 3], 'big'),
+            int.from_bytes(value[i + 3:i + 9], 'big'),
+            int.from_bytes(value[i + 9:i + 11], 'big'),
+        ))
+    return changes
+
+
+def parse_trap(message):
+    """Uptime (in hundredths of a second) of a v2c trap and its raw events.
+
+    Events are ``('link', ifIndex, up)`` and ``('mac', VLAN, MAC, bridge port, learnt)``;
+    traps of other kinds have none.
+    """
+    values = {varbind.oid: varbind.value for varbind in message.data.varbinds}
+    uptime = values.get(OID_SYS_UPTIME_TRAP)
+    trap_oid = values.get(OID_SNMP_TRAP_OID)
+    events = []
+    if trap_oid in (OID_LINK_UP, OID_LINK_DOWN):
+        for oid, value in values.items():
+            if oid.startswith(f'{OID_IF_INDEX}.'):
+                events.append(('link', int(oid.rsplit('.', 1)[1]), trap_oid == OID_LINK_UP))
+                break
+    elif trap_oid == OID_CMN_MAC_CHANGED:
+        for oid, value in values.items():
+            if oid.startswith(f'{OID_CMN_HIST_MAC_CHANGED_MSG}.') and isinstance(value, bytes):
+                for learnt, vlan, mac, bridge_port in mac_changes(value):
+                    events.append(('mac', vlan, mac, bridge_port, learnt))
+    return (uptime if isinstance(uptime, int) else None, events)
+
+
+class SwitchInterfaces:
+    """Names of interfaces of the switches sending traps, by ifIndex and by bridge port of a VLAN.
+
+    Lookups of the same switch share one request; a switch whose uptime goes back (it
+    rebooted, so its ifIndexes may have changed) is looked up again.
+    """
+
+    def __init__(self, transport, community, params=RESOLVE_PARAMS):
+        self.transport = transport
+        self.community = community
+        self.params = params
+        self.uptimes = {}
+        # (host, ifIndex) -> task of the ifName, (host, VLAN) -> task of the bridge ports
+        self.names = {}
+        self.bridge_ports = {}
+
+    def check_uptime(self, host, uptime):
+        if uptime is None:
+            return
+        if uptime < self.uptimes.get(host, 0):
+            self.forget(host)
+        self.uptimes[host] = uptime
+
+    def forget(self, host):
+        for lookups in (self.names, self.bridge_ports):
+            for key in [key for key in lookups if key[0] == host]:
+                del lookups[key]
+
+    async def lookup(self, lookups, key, fetch):
+        entry = lookups.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            entry = lookups[key] = (time.monotonic() + NAME_TTL, asyncio.ensure_future(fetch()))
+        try:
+            return await asyncio.shield(entry[1])
+        except Exception:
+            if lookups.get(key) is entry:
+                del lookups[key]
+            raise
+
+    async def ifname(self, host, ifindex):
+        async def fetch():
+            agent = Agent(host, self.params, self.transport)
+            async with agent.session(self.community) as snmp:
+                [varbind] = await agent.get(snmp, [f'{OID_IF_NAME}.{ifindex}'])
+            return varbind.value.decode() if isinstance(varbind.value, bytes) else None
+
+        return await self.lookup(self.names, (host, ifindex), fetch)
+
+    async def bridge_port_ifindex(self, host, vlan, bridge_port):
+        async def fetch():
+            agent = Agent(host, self.params, self.transport)
+            async with agent.session(f'{self.community}@{vlan}') as snmp:
+                walk = await agent.walk(snmp, OID_DOT1D_BASE_PORT_IFINDEX)
+            return {int(index.rsplit('.', 1)[1]): ifindex for index, ifindex in walk.items()}
+
+        return (await self.lookup(self.bridge_ports, (host, vlan), fetch)).get(bridge_port)
+
+    async def resolve(self, host, event):
+        """``event`` of ``parse_trap`` with the interface name: ``('link', host, ifName, up)`` or
+        ``('mac', host, ifName, VLAN, MAC, learnt)``; ``None`` when the interface is unknown.
+        """
+        if event[0] == 'link':
+            _, ifindex, up = event
+            name = await self.ifname(host, ifindex)
+            return ('link', host, name, up) if name else None
+        _, vlan, mac, bridge_port, learnt = event
+        ifindex = await self.bridge_port_ifindex(host, vlan, bridge_port)
+        if ifindex is None:
+            return None
+        name = await self.ifname(host, ifindex)
+        return ('mac', host, name, vlan, mac, learnt) if name else None
+
+
+async def receive_traps(emit, address, port, communities, community,
+                        batch_seconds=BATCH_SECONDS, batch_events=BATCH_EVENTS, ready=None):
+    """Receive traps on ``address``:``port`` and emit their resolved events in lists, until cancelled.
+
+    Traps with a community of ``communities`` are accepted; switches are queried with
+    ``community``. A batch is emitted every ``batch_seconds`` or as soon as it has
+    ``batch_events`` events, in the order the traps were received. Events whose interface
+    could not be resolved are dropped (the next poll catches up). ``ready``, if given, is
+    called once the socket is bound.
+    """
+    batch = []
+    full = asyncio.Event()
+
+    async with Transport(sockets=1) as transport:
+        interfaces = SwitchInterfaces(transport, community)
+
+        async def handle(host, trap_port, message):
+            try:
+                uptime, events = parse_trap(message)
+            except Exception:
+                return
+            interfaces.check_uptime(host, uptime)
+            # events take their places in the batch at once, so their order does not depend
+            # on how long the switch takes to answer
+            slots = [[None] for _ in events]
+            batch.extend(slots)
+            for slot, event in zip(slots, events):
+                try:
+                    resolved = await interfaces.resolve(host, event)
+                except Exception:
+                    resolved = None
+                slot[0] = resolved or False
+            if len(batch) >= batch_events:
+                full.set()
+
+        server = SnmpV2TrapServer(host=address, port=port, communities=communities, handler=handle)
+        trap_transport, _ = await server.run()
+        if ready is not None:
+            ready()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(full.wait(), batch_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                full.clear()
+                # events still being resolved start the next batch
+                done = 0
+                while done < len(batch) and batch[done][0] is not None:
+                    done += 1
+                events = [slot[0] for slot in batch[:done] if slot[0]]
+                del batch[:done]
+                if events:
+                    await emit(events)
+        finally:
+            trap_transport.close()
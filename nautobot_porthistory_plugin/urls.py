@@ -6,4 +6,5 @@ from nautobot_porthistory_plugin import views
 
 urlpatterns = [
     path('history/', views.PortHistoryView.as_view(), name='history'),
+    path('history/macs/', views.MACHistoryView.as_view(), name='mac_history'),
 ]
\ No newline at end of file
@@ -8,11 +8,20 @@ from nautobot_porthistory_plugin import models, tables, filters, forms
 class PortHistoryView(generic.ObjectListView):
     """Показывает MAC и IP адреса на портах"""
 
-    queryset = models.MAConPorts.objects.all()
+    # без сортировки по колонке страницы листаются по (updated, id) без OFFSET, см. PortHistoryTable
+    queryset = models.MAConPorts.objects.select_related('device', 'interface', 'vlan', 'ipaddress')
     table = tables.PortHistoryTable
     filterset = filters.PortHistoryFilterSet
     filterset_form = forms.PortHistoryFilterForm
 
     action_buttons = ()
 
+class MACHistoryView(generic.ObjectListView):
+    """Показывает историю MAC адресов на портах"""
 
+    queryset = models.MACHistory.objects.select_related('device', 'interface', 'vlan', 'ipaddress')
+    table = tables.MACHistoryTable
+    filterset = filters.MACHistoryFilterSet
+    filterset_form = forms.MACHistoryFilterForm
+
+    action_buttons = ()
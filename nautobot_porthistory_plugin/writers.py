@@ -0,0 +1,75 @@
+"""Batched database writes for nautobot_porthistory_plugin jobs."""
+
+from django.db import transaction
+
+BATCH_SIZE = 1000
+
+
+class BulkWriter:
+    """Accumulate creates, updates and deletes of one model and apply them in chunks.
+
+    Every chunk is written inside one transaction with a ``bulk_create``, a ``bulk_update``
+    of ``update_fields`` and a single ``DELETE ... WHERE pk IN (...)``. Rows that did not
+    change but still have to be marked as seen are "touched": ``touch_values`` is applied
+    to all of them with one ``UPDATE ... WHERE pk IN (...)``. With ``ignore_conflicts`` created
+    rows that violate a unique constraint (another writer has just created them) are skipped;
+    they are still counted in ``created``.
+    """
+
+    def __init__(self, model, update_fields, touch_values=None, batch_size=BATCH_SIZE, ignore_conflicts=False):
+        self.model = model
+        self.update_fields = update_fields
+        self.touch_values = touch_values
+        self.batch_size = batch_size
+        self.ignore_conflicts = ignore_conflicts
+        self.to_create = []
+        self.to_update = []
+        self.to_delete = []
+        self.to_touch = []
+        self.created = self.updated = self.deleted = self.touched = 0
+
+    def __len__(self):
+        return len(self.to_create) + len(self.to_update) + len(self.to_delete) + len(self.to_touch)
+
+    def create(self, obj):
+        self.to_create.append(obj)
+        self._flush_if_full()
+
+    def update(self, obj):
+        self.to_update.append(obj)
+        self._flush_if_full()
+
+    def delete(self, pk):
+        self.to_delete.append(pk)
+        self._flush_if_full()
+
+    def touch(self, pk):
+        self.to_touch.append(pk)
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        if len(self) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not len(self):
+            return
+        with transaction.atomic():
+            if self.to_create:
+                self.model.objects.bulk_create(
+                    self.to_create, batch_size=self.batch_size, ignore_conflicts=self.ignore_conflicts,
+                )
+            if self.to_update:
+                self.model.objects.bulk_update(self.to_update, self.update_fields, batch_size=self.batch_size)
+            if self.to_delete:
+                self.model.objects.filter(pk__in=self.to_delete).delete()
+            if self.to_touch:
+                self.model.objects.filter(pk__in=self.to_touch).update(**self.touch_values)
+        self.created += len(self.to_create)
+        self.updated += len(self.to_update)
+        self.deleted += len(self.to_delete)
+        self.touched += len(self.to_touch)
+        self.to_create = []
+        self.to_update = []
+        self.to_delete = []
+        self.to_touch = []